@@ -31,6 +31,14 @@ INPUTS:
   - q_data_requests to comunicate with data_delivery_worker
   - workerQueues list of queues that allows comunication of data from data_delivery_worker 
     to DIC_worker
+  - q_slab_ready (optional) on which data_delivery_worker says where the shared slabs are
+    after each "NewExtents", this is passed on to the DIC_workers with each node
+
+The sequence of slabs is planned before reading anything (see tools/plan_slabs.py) and given
+  to data_delivery_worker with a "SlabPlan", so that it can load the next slab in advance.
+
+The nodes are sent to the DIC_workers in chunks of data.nodeBatchSize * data.threadsPerWorker,
+  and come back in one array per chunk which is copied into kinematics in one go.
   
 OUTPUTS:
   - filled-in kinematics
@@ -42,6 +50,7 @@ import multiprocessing
 import logging
 
 from DIC_worker import DIC_worker
+from tools.plan_slabs import plan_slabs, log_slab_plan
 from tools.print_variable import pv
 
 
@@ -75,7 +84,7 @@ def display_time(seconds, granularity=2):
 # ===========================
 # === Program Starts Here ===
 # ===========================
-def DIC_setup( kinematics, data, q_data_requests, workerQueues ):
+def DIC_setup( kinematics, data, q_data_requests, workerQueues, q_slab_ready=None ):
 
     # Wake up the data_delivery_worker with a new "data" array.
     q_data_requests.put( [ "NewData", data ] )
@@ -115,15 +124,6 @@ def DIC_setup( kinematics, data, q_data_requests, workerQueues ):
         p.start()
     # ----------------------------------
 
-    # Calculate the highest slice we need
-    currentTopSlice_image1 = min(extents[:,0,0,0])
-    currentTopSlice_image2 = max( min( min(extents[:,1,0,0] ) - int( data.subpixel_mode[2]*max(data.correlation_window)*numpy.sqrt(3)+1 ), data.image_slices_extent[1,1]), 0 )
-
-    # Current bottom slice is the minimum between the lowest slice given by the max on the extents
-    #   and the current bottom slice due to memory limit
-    currentBottomSlice_image1 = min( max(extents[:,0,1,0]), currentTopSlice_image1 + data.memLimitSlices)
-    currentBottomSlice_image2 = min( max(extents[:,1,1,0]) + int( data.subpixel_mode[2]*max(data.correlation_window)*numpy.sqrt(3)+1 ), currentTopSlice_image2 + data.memLimitSlices)
-
     # Initializing a node done table
     nodeDoneTable = numpy.zeros( ( kinematics.shape[0], 1 ), dtype = bool )
 
@@ -142,7 +142,20 @@ def DIC_setup( kinematics, data, q_data_requests, workerQueues ):
     nodeDoneTable[ numpy.logical_or( extentsCheck[:,0], extentsCheck[:,1] ) ] = True
     kinematics[    numpy.logical_or( extentsCheck[:,0], extentsCheck[:,1] ), 11 ] += 512
 
+    # --- Plan all the slabs before reading anything, see tools/plan_slabs.py ---
+    slabPlan, unplannedNodes = plan_slabs( extents, nodeDoneTable, data )
+    if len( unplannedNodes ) > 0:
+      try: logging.err.error("DIC_setup(): %i nodes do not fit in any slab with the memory limit set"%( len( unplannedNodes ) ))
+      except: print "DIC_setup(): %i nodes do not fit in any slab with the memory limit set"%( len( unplannedNodes ) )
+      nodeDoneTable[ unplannedNodes ] = True
+      kinematics[    unplannedNodes, 11 ] += 512
+    log_slab_plan( slabPlan, extents, data )
+
+    # Give the whole plan to data_delivery_worker, so that it can load the next slab while the workers are busy with this one
+    q_data_requests.put( [ "SlabPlan", [ slab[0:2] for slab in slabPlan ] ] )
+
     # --- Variables for receive queue management ---
+    chunkSize            = data.nodeBatchSize * data.threadsPerWorker
     nNodes_to_correlate = kinematics[ :, 0 ].shape[0] - sum( nodeDoneTable )
     nodesProcessedTotal  = 0
     printInterval   = max( 1, int(nNodes_to_correlate*data.printPercent/100.0) )
@@ -153,47 +166,36 @@ def DIC_setup( kinematics, data, q_data_requests, workerQueues ):
     prevNodesProcessed = 0
     # ----------------------------------------------------------
 
+    # Nothing to do, stop the DIC_workers
+    if len( slabPlan ) == 0:
+        for workerNumber in range( data.nWorkers ):
+            q_nodes.put( [ "STOP" ] )
 
-    #Outside loop continues until there are no nodes left
-    while not nodeDoneTable.all():
+    #Outside loop goes through the planned slabs
+    for slabNumber, [ zExtents_image1, zExtents_image2, nodesInSlab ] in enumerate( slabPlan ):
 
         # --- update NewExtents for the data_delivery_worker for the newly added nodes ---
-        q_data_requests.put( [ "NewExtents", [ [ currentTopSlice_image1, currentBottomSlice_image1 ], [ currentTopSlice_image2, currentBottomSlice_image2 ] ] ] )
-        # --------------------------------------------------
+        q_data_requests.put( [ "NewExtents", [ zExtents_image1, zExtents_image2 ] ] )
 
-        # reset node counter -- in order to know when to stop...
-        nodesToProcess = 0
+        # Wait for the slabs to be loaded and shared, the workers will cut their windows out of them
+        slabInfo = None
+        if q_slab_ready is not None:
+            slabInfo = q_slab_ready.get()[1]
+        # --------------------------------------------------
 
-        # For every node check if it has been done and if not whether it is inside the current block of data
-        for nodeNumber in range( kinematics.shape[0] ):
-            nodeExtent = extents[ nodeNumber ]
-            if not nodeDoneTable[ nodeNumber ]  and nodeExtent[0,0,0] >= currentTopSlice_image1    \
-                                                and nodeExtent[0,1,0] <= currentBottomSlice_image1 \
-                                                and nodeExtent[1,0,0] >= currentTopSlice_image2    \
-                                                and nodeExtent[1,1,0] <= currentBottomSlice_image2 :
+        # node counter -- in order to know when to stop...
+        nodesToProcess = len( nodesInSlab )
 
-                # Adding the node to the queue for the DIC_worker and update nodeDoneTable
-                q_nodes.put( [ nodeNumber, nodeExtent ] )
-                nodeDoneTable[ nodeNumber ] = True
-                # Add one to node counter...
-                nodesToProcess += 1
+        # Adding the nodes to the queue for the DIC_worker, a chunk at a time
+        for chunk in range( 0, len( nodesInSlab ), chunkSize ):
+            chunkNodes = nodesInSlab[ chunk:chunk+chunkSize ]
+            q_nodes.put( [ "Nodes", chunkNodes, extents[ chunkNodes ], slabInfo ] )
 
         # Checking if all nodes have been sent to the worker add STOP to queue to stop the DIC_workers
-        if nodeDoneTable.all():
+        if slabNumber == len( slabPlan ) - 1:
             for workerNumber in range( data.nWorkers ):
                 q_nodes.put( [ "STOP" ] )
 
-        # Updating current slices
-        # Calculate the highest slice from NOT done nodes
-        if ( nodeDoneTable == False ).any():
-            currentTopSlice_image1 = min( extents[ numpy.where( nodeDoneTable == False )[0], 0, 0, 0] )
-            currentTopSlice_image2 = max( min( min( extents[ numpy.where( nodeDoneTable == False )[0], 1, 0, 0] - int( data.subpixel_mode[2]*max(data.correlation_window)*numpy.sqrt(3)+1 ) ), data.image_slices_extent[1,1]), 0 )
-
-        # Current bottom slice is the minimum between the lowest slice given by the max on the extents
-        #   and the current bottom slice due to memory limit
-        currentBottomSlice_image1 = min( max(extents[:,0,1,0]), currentTopSlice_image1 + data.memLimitSlices)
-        currentBottomSlice_image2 = min( max(extents[:,1,1,0]) + int( data.subpixel_mode[2]*max(data.correlation_window)*numpy.sqrt(3)+1 ), currentTopSlice_image2 + data.memLimitSlices)
-
 
         # Loop until all workers have hanged up
         #while finishedThreads < data.nWorkers:
@@ -201,10 +203,14 @@ def DIC_setup( kinematics, data, q_data_requests, workerQueues ):
 
             message = q_results.get()
 
-            nodesProcessedTotal  += 1
-            nodesToProcess       -= 1
+            # Results of a chunk of nodes
+            nodeNumbers = message[0]
+            results     = message[1]
+
+            nodesProcessedTotal  += len( nodeNumbers )
+            nodesToProcess       -= len( nodeNumbers )
             
-            if nodesProcessedTotal%printInterval == 0:
+            if nodesProcessedTotal // printInterval > ( nodesProcessedTotal - len( nodeNumbers ) ) // printInterval:
               
                   print "\r\tCompleted node number %05i  ( %2.2f %% )"%( nodesProcessedTotal, 100*(nodesProcessedTotal)/float(nNodes_to_correlate) ),
 
@@ -229,27 +235,18 @@ def DIC_setup( kinematics, data, q_data_requests, workerQueues ):
                   prevNodesProcessed     = nodesProcessedTotal
                   # -------------------------------------
 
-            # Extract result of this thread's result
-            nodeNumber = message[0]
-
             #  Since C-code pixel search doesn't know about the prior field and the search window, add these back in now, in order for the
             #   displacement to be absolute.
-            message[1][0] += extents[nodeNumber,1,0,0] - extents[nodeNumber,0,0,0]
-            message[1][1] += extents[nodeNumber,1,0,1] - extents[nodeNumber,0,0,1]
-            message[1][2] += extents[nodeNumber,1,0,2] - extents[nodeNumber,0,0,2]
+            results[ :, 0:3 ] += extents[ nodeNumbers, 1, 0 ] - extents[ nodeNumbers, 0, 0 ]
 
             # Copy into relevant results matrices...
-            kinematics[ nodeNumber, 4  ]  = message[1][0]
-            kinematics[ nodeNumber, 5  ]  = message[1][1]
-            kinematics[ nodeNumber, 6  ]  = message[1][2]
-            kinematics[ nodeNumber, 7  ]  = message[2][0]
-            kinematics[ nodeNumber, 8  ]  = message[2][1]
-            kinematics[ nodeNumber, 9  ]  = message[2][2]
-            kinematics[ nodeNumber, 10 ]  = message[3]
-            kinematics[ nodeNumber, 11 ] += message[4]     # Error is additive
+            kinematics[ nodeNumbers, 4:7  ]  = results[ :, 0:3 ]
+            kinematics[ nodeNumbers, 7:10 ]  = results[ :, 3:6 ]
+            kinematics[ nodeNumbers, 10   ]  = results[ :, 6 ]
+            kinematics[ nodeNumbers, 11   ] += results[ :, 7 ]     # Error is additive
 
             # 2015-07-30 - EA: cc_percent badly applied, applying it differently, this is not elegant, but at least not wrong:
             if data.cc_percent:
-              kinematics[ nodeNumber, 10 ]  = kinematics[ nodeNumber, 10 ] * 100
+              kinematics[ nodeNumbers, 10 ]  = kinematics[ nodeNumbers, 10 ] * 100
 
     return kinematics
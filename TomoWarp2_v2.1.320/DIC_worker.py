@@ -26,26 +26,42 @@
 
 """ 
 Worker to pocess nodes one after the other and do pixel_search, refinement, etc...
+The nodes come in chunks from DIC_setup (data.nodeBatchSize nodes per thread), the pixel search of a chunk
+  is done in one call and the results of the whole chunk are sent back in one array.
+With data.threadsPerWorker > 1 each chunk is shared between a pool of threads. Only the pixel search (C code)
+  releases the GIL, the CC and image interpolations run one thread at a time, so the threads only help the runs
+  that spend their time in the pixel search.
+When data_delivery_worker shares its slabs (the nodes come with a slabInfo), the windows are cut
+  straight out of the shared slabs, otherwise they are asked for with a "DataRequest".
+With the image interpolation with rotation, the window of image 2 comes with the padding needed for the rotation,
+  so that each node needs a single data fetch.
 
 INPUTS:
   - workerNumber
-  - q_nodes to receive info on nodes
-  - q_results to comunicate correlation result
+  - q_nodes to receive info on nodes: [ "Nodes", nodeNumbers, nodeExtents, slabInfo ] or [ "STOP" ]
+  - q_results to comunicate correlation result: [ nodeNumbers, results ], with a line of results per node:
+      displacement (3), rotation (3), cc, error
   - q_data_requests to ask for data to data_delivery_worker
   - q_data to receive data from data_delivery_worker
   - "data" structure
 """
 
 import time
+import threading
 import numpy
 import logging
+from multiprocessing.pool import ThreadPool
 
-# This is our pixel_search C-code
-from pixel_search.c_code import pixel_search
+# The pixel search C-code, through its engines
+from pixel_search.integer_pixel_search import integer_pixel_search, pyramid_pixel_search, \
+    batch_integer_pixel_search
 from sub_pixel.cc_interpolation import cc_interpolation_local, \
-    cc_interpolation_local_2D
+    cc_interpolation_local_2D, cc_interpolation_fit, cc_interpolation_fit_2D, \
+    cc_interpolation_fit_batch, cc_interpolation_fit_2D_batch
 from sub_pixel.image_interpolation_translation_rotation import \
     image_interpolation_translation_rotation
+from data_delivery_worker import node_data, open_shared_slab
+from tools.plan_slabs import rotation_padding
 #from print_variable import pv
 
 
@@ -55,197 +71,363 @@ def DIC_worker( workerNumber, q_nodes, q_results, q_data_requests, q_data, data
     try: logging.log.info("DIC_worker %i: Started up"%( workerNumber ))
     except: print "DIC_worker %i: Started up"%( workerNumber )
 
+    # With data.threadsPerWorker > 1 the nodes of a batch are shared between a pool of threads.
+    #   The C-code releases the GIL, so the pixel searches of the different threads run in parallel.
+    pool = None
+    if data.threadsPerWorker > 1:
+        pool = ThreadPool( data.threadsPerWorker )
+
+    # Lock for the data requests made while treating a node, the reply comes back on q_data which is shared by all the threads
+    dataLock = threading.Lock()
+
+    # The shared ring buffers currently opened by this worker: [ generation, [ im1, im2 ] ]
+    slab = None
+
     while True:
         #time.sleep( 1 )
-        setupMessage = q_nodes.get()
 
-        if setupMessage[0] == "STOP":
+        # Take the next chunk of nodes
+        message = q_nodes.get()
+
+        if message[0] == "STOP":
+            if pool is not None:
+                pool.close()
+                pool.join()
             try: logging.log.info("DIC_worker %i: Got a request to stop, quitting."%( workerNumber ))
             except: "DIC_worker %i: Got a request to stop, quitting."%( workerNumber )
             return -1
 
+        setupMessages = [ [ nodeNumber, nodeExtent, message[3] ] for nodeNumber, nodeExtent in zip( message[1], message[2] ) ]
+
+        # Open the shared ring buffers of this batch if they are new (they only change when data_delivery_worker
+        #   has to reallocate them). A batch never spans two slabs, DIC_setup waits for all the results of a slab before moving on
+        slabInfo = setupMessages[0][2] if len( setupMessages ) > 0 and len( setupMessages[0] ) > 2 else None
+        if slabInfo is not None and ( slab is None or slab[0] != slabInfo[0] ):
+            try:
+                slab = [ slabInfo[0], open_shared_slab( slabInfo ) ]
+            except Exception as e:
+                try: logging.log.warn("DIC_worker %i: Could not open the shared slabs, asking data_delivery_worker: %s"%( workerNumber, e ))
+                except: print "DIC_worker %i: Could not open the shared slabs, asking data_delivery_worker: %s"%( workerNumber, e )
+                slab = None
+        # [ generation, [ im1, im2 ], [ zExtents_im1, zExtents_im2 ] ] of this slab
+        currentSlab = slab + [ slabInfo[2] ] if slabInfo is not None and slab is not None and slab[0] == slabInfo[0] else None
+
+        if currentSlab is not None:
+            # Cut the windows out of the shared slabs
+            dataMessages = [ float_windows( node_data( currentSlab[1][0], currentSlab[1][1], currentSlab[2][0], currentSlab[2][1], \
+                                                       setupMessage[1], data, copy=False, padding=rotation_padding( data ) ) ) for setupMessage in setupMessages ]
         else:
-            # Treat this node...
-            nodeNumber  = setupMessage[0]
-            extent      = setupMessage[1]
-
-            # Make a data request to data_delivery_worker, just with worker number data extents
-            q_data_requests.put( [ "DataRequest", workerNumber, extent ] )
-
-            # Get message back from data_delivery_worker, hopefully containing image data:
-            dataMessage = q_data.get()
-
-            # Define these high up to be able to return them, even if everything goes wrong.
-            error   = 0
-            cc      = 0.0
-            nodeDisplacement = numpy.array( [ 0.0, 0.0, 0.0 ] )
-            nodeDispSubpixel = numpy.array( [ 0.0, 0.0, 0.0 ] )
-            nodeRotSubpixel  = numpy.array( [ 0.0, 0.0, 0.0 ] )
-
-            if  dataMessage[0] == "Error":
-                # Error fetching the data from the data_delivery_worker, return nothing but a data error (#1)
-                error += 1
-
-            elif dataMessage[0] == "Data":
-                # Reinitialise all important variables
-                im1     = dataMessage[1]
-                im1Dim  = im1.shape
-                im2     = dataMessage[2]
-                im2Dim  = im2.shape
-
-                # Get images out of the reply from data_delivery_worker
-                #   NOTE: im2 should be bigger than im1 if the search range is not zero. (it is checked in data_delivery_worker)
-
-                # 2015-01-19 EA: Check that the mean value of the reference im1 is greater than the grey_threshold
-                if im1.mean() < data.grey_threshold[0] or im1.mean() > data.grey_threshold[1]:
-                    # outside the range of interesting gray values, don't correlate, return error = 2
-                    error += 2
-
-                else:
-                    # we're within grey threshold... continue...
-
-                    # --- Run C-code PIXEL SEARCH ---
-                    # get displacement of this node from returns...
-
-                    returns = pixel_search.pixel_search( im1, im2, 4 )
-                    # -------------------------------
-
-                    nodeDisplacement = returns[0:3]
-                    cc               = returns[3]
-
-
-                    # We're doing a subpixel search -- either CC or Image Interpolation!
-                    if any( data.subpixel_mode ):
-
-                        # ==================================
-                        # === data check for CC and II-T ===
-                        # ==================================
-
-                        # Both CC and translation-only image interpolation take im2 = im1+-1 pixel, so prepare it in case we're in this case:
-                        if ( data.subpixel_mode[0] ) or ( data.subpixel_mode[1] and not data.subpixel_mode[2] ):
-                            cornerOffset = 1
-                            im2Pm1 = im2[  int(nodeDisplacement[0])-cornerOffset:int(nodeDisplacement[0])+im1Dim[0]+cornerOffset,\
-                                           int(nodeDisplacement[1])-cornerOffset:int(nodeDisplacement[1])+im1Dim[1]+cornerOffset,\
-                                           int(nodeDisplacement[2])-cornerOffset:int(nodeDisplacement[2])+im1Dim[2]+cornerOffset  ]
-
-                            # === Step 1: Measure the dimensions of image 1 ===
-                            im2Pm1Dim = numpy.array( im2Pm1.shape )
-                            # 2015-12-17 EA: adding Check for 2D images, the z-dimension will always be 1...
-                            if im1.shape[0] == 1 and im2.shape[0] == 1:
-                                # then we're dealing with a 2D image
-                                if ( im2Pm1Dim[1] - im1Dim[1] ) != 2*cornerOffset or  ( im2Pm1Dim[2] - im1Dim[2] ) != 2*cornerOffset:
-                                    # We don't have enough data (i.e. +- 1 px) to do a CC interpolation, quit.
-                                    error           += 32
-
-                            else:
-                                # We're in 3D
-                                if not all( ( im2Pm1Dim - im1Dim ) == 2*cornerOffset ):
-                                    # We don't have enough data (i.e. +- 1 px) to do a CC interpolation, quit.
-                                    error           += 32
-
-                        # ==================================
-
+            # Make the data requests to data_delivery_worker for all the nodes of the batch, just with worker number data extents
+            for setupMessage in setupMessages:
+                q_data_requests.put( [ "DataRequest", workerNumber, setupMessage[1], rotation_padding( data ) ] )
+
+            # Get messages back from data_delivery_worker (in the same order), hopefully containing image data:
+            dataMessages = [ float_windows( q_data.get() ) for setupMessage in setupMessages ]
+
+        # --- Run C-code PIXEL SEARCH for all the nodes of the batch in one go ---
+        #   (only for the nodes with data within the grey threshold, the others are treated below as usual)
+        batchReturns = [ None ] * len( setupMessages )
+        if data.pyramid_levels == 0 and len( setupMessages ) > 1:
+            batchNodes = [ i for i, dataMessage in enumerate( dataMessages ) if dataMessage[0] == "Data" and \
+                                                                                data.grey_threshold[0] <= dataMessage[1].mean() <= data.grey_threshold[1] ]
+            # One chunk of nodes for each thread
+            chunks = [ batchNodes[ thread::data.threadsPerWorker ] for thread in range( data.threadsPerWorker ) ]
+            chunks = [ chunk for chunk in chunks if len( chunk ) > 0 ]
+
+            def searchChunk( chunk ):
+                return batch_integer_pixel_search( [ dataMessages[ i ][1] for i in chunk ], [ dataMessages[ i ][2] for i in chunk ], \
+                                                   data.pixel_search_engine, returnNeighbourhood=data.subpixel_mode[0] )
+
+            if pool is None:
+                chunkResults = [ searchChunk( chunk ) for chunk in chunks ]
+            else:
+                chunkResults = pool.map( searchChunk, chunks )
+
+            for chunk, results in zip( chunks, chunkResults ):
+                for i, result in zip( chunk, results ):
+                    batchReturns[ i ] = result
+
+        # --- CC INTERPOLATION of all the nodes of the batch with the CC values around their maximum in one go ---
+        ccFits = [ None ] * len( setupMessages )
+        if data.subpixel_mode[0]:
+            ccFits = batch_cc_interpolation_fit( batchReturns, data )
+        # -------------------------------
+
+        # Treat the nodes...
+        def treatNode( batchIndex ):
+            return DIC_worker_node( workerNumber, setupMessages[ batchIndex ][0], setupMessages[ batchIndex ][1], dataMessages[ batchIndex ], \
+                                    batchReturns[ batchIndex ], q_data_requests, q_data, dataLock, data, currentSlab, ccFits[ batchIndex ] )
+
+        if pool is None:
+            nodeResults = [ treatNode( batchIndex ) for batchIndex in range( len( setupMessages ) ) ]
+        else:
+            nodeResults = pool.map( treatNode, range( len( setupMessages ) ) )
+
+        # In any case send something on the q_results for each node, all the chunk in one go
+        q_results.put( [ message[1], numpy.array( [ numpy.hstack( nodeResult[1:] ) for nodeResult in nodeResults ] ) ] )
+
+
+def float_windows( dataMessage ):
+    # The slabs in data_delivery_worker are kept in the data type of the images (e.g., 8 or 16 bit integers),
+    #   the windows are converted to float 32b here, one by one, for the pixel search and the subpixel refinement
+    if dataMessage[0] == "Data" and len( dataMessage ) > 3:
+        # im2 with the padding for the rotation, im2 is taken out of it
+        im2Padded = numpy.asarray( dataMessage[3], dtype='<f4' )
+        top       = dataMessage[4]
+        im2       = im2Padded[ top[0]:top[0]+dataMessage[2].shape[0], top[1]:top[1]+dataMessage[2].shape[1], top[2]:top[2]+dataMessage[2].shape[2] ]
+        return [ "Data", numpy.asarray( dataMessage[1], dtype='<f4' ), im2, im2Padded, top ]
+    if dataMessage[0] == "Data":
+        return [ "Data", numpy.asarray( dataMessage[1], dtype='<f4' ), numpy.asarray( dataMessage[2], dtype='<f4' ) ]
+    return dataMessage
+
+
+def batch_cc_interpolation_fit( batchReturns, data ):
+    # CC interpolation fit of the nodes of a batch that have the CC values around the maximum of their pixel search,
+    #   one call for the 3D nodes and one for the 2D ones. Returns the fit of each node, None for the other nodes
+    ccFits = [ None ] * len( batchReturns )
+
+    for dimensions, cc_interpolation_fit_nodes in [ [ 3, cc_interpolation_fit_batch ], [ 2, cc_interpolation_fit_2D_batch ] ]:
+        fitNodes = [ i for i, batchReturn in enumerate( batchReturns ) if batchReturn is not None and \
+                                                                           batchReturn[1] is not None and batchReturn[1].ndim == dimensions ]
+        if len( fitNodes ) == 0: continue
+
+        fits = cc_interpolation_fit_nodes( numpy.array( [ batchReturns[ i ][1] for i in fitNodes ] ), \
+                                           data.subpixel_CC_refinement_step_threshold, \
+                                           data.subpixel_CC_max_refinement_iterations, \
+                                           data.subpixel_CC_max_refinement_step  )
+        for i, fit in zip( fitNodes, fits ):
+            ccFits[ i ] = fit
+
+    return ccFits
+
+
+def DIC_worker_node( workerNumber, nodeNumber, extent, dataMessage, batchReturn, q_data_requests, q_data, dataLock, data, slab=None, ccFit=None ):
+    # Treat one node, with the data already received from data_delivery_worker and, if it was done
+    #   with the rest of the batch, the result of the pixel search (batchReturn, None otherwise).
+    #   slab is the shared slab the data came from, if any, to cut more data out of it.
+    #   ccFit is the result of the CC interpolation fit if it was done with the rest of the batch.
+    #   Returns the message for q_results.
+
+    # Define these high up to be able to return them, even if everything goes wrong.
+    error   = 0
+    cc      = 0.0
+    nodeDisplacement = numpy.array( [ 0.0, 0.0, 0.0 ] )
+    nodeDispSubpixel = numpy.array( [ 0.0, 0.0, 0.0 ] )
+    nodeRotSubpixel  = numpy.array( [ 0.0, 0.0, 0.0 ] )
+    pyramidDisagreement = False
+
+    if  dataMessage[0] == "Error":
+        # Error fetching the data from the data_delivery_worker, return nothing but a data error (#1)
+        error += 1
+
+    elif dataMessage[0] == "Data":
+        # Reinitialise all important variables
+        im1     = dataMessage[1]
+        im1Dim  = im1.shape
+        im2     = dataMessage[2]
+        im2Dim  = im2.shape
+
+        # Get images out of the reply from data_delivery_worker
+        #   NOTE: im2 should be bigger than im1 if the search range is not zero. (it is checked in data_delivery_worker)
+
+        # 2015-01-19 EA: Check that the mean value of the reference im1 is greater than the grey_threshold
+        if im1.mean() < data.grey_threshold[0] or im1.mean() > data.grey_threshold[1]:
+            # outside the range of interesting gray values, don't correlate, return error = 2
+            error += 2
 
-                        # ==================================
-                        # === data check for II-Rotation ===
-                        # ==================================
-                        # Also check the data extents for the rotation...
-                        if ( data.subpixel_mode[1] and data.subpixel_mode[2] ):
-                            cornerOffsetRot = int( ( ( numpy.sqrt(3) * max( im1Dim ) ) - max( im1Dim ) + 1 ) / 2.0 )
+        else:
+            # we're within grey threshold... continue...
+
+            # --- Run C-code PIXEL SEARCH ---
+            # get displacement of this node from returns...
+
+            # If we are going to do a CC interpolation, the pixel search also gives the 3x3x3 CC values
+            #   around the maximum, so they don't have to be calculated again
+            ccNeighbourhood = None
+            if batchReturn is not None:
+                # Already done with the rest of the batch
+                returns, ccNeighbourhood = batchReturn
+            elif data.pyramid_levels > 0:
+                # Coarse-to-fine search, remember if the maxima at the different levels disagree
+                returns, ccNeighbourhood, pyramidDisagreement = pyramid_pixel_search( im1, im2, data.pyramid_levels, data.pixel_search_engine, \
+                                                                                      returnNeighbourhood=data.subpixel_mode[0] )
+            elif data.subpixel_mode[0]:
+                returns, ccNeighbourhood = integer_pixel_search( im1, im2, data.pixel_search_engine, returnNeighbourhood=True )
+            else:
+                returns = integer_pixel_search( im1, im2, data.pixel_search_engine )
+            # -------------------------------
+
+            nodeDisplacement = returns[0:3]
+            cc               = returns[3]
+
+
+            # We're doing a subpixel search -- either CC or Image Interpolation!
+            if any( data.subpixel_mode ):
+
+                # ==================================
+                # === data check for CC and II-T ===
+                # ==================================
+
+                # Both CC and translation-only image interpolation take im2 = im1+-1 pixel, so prepare it in case we're in this case:
+                if ( data.subpixel_mode[0] ) or ( data.subpixel_mode[1] and not data.subpixel_mode[2] ):
+                    cornerOffset = 1
+                    im2Pm1 = im2[  int(nodeDisplacement[0])-cornerOffset:int(nodeDisplacement[0])+im1Dim[0]+cornerOffset,\
+                                   int(nodeDisplacement[1])-cornerOffset:int(nodeDisplacement[1])+im1Dim[1]+cornerOffset,\
+                                   int(nodeDisplacement[2])-cornerOffset:int(nodeDisplacement[2])+im1Dim[2]+cornerOffset  ]
+
+                    # === Step 1: Measure the dimensions of image 1 ===
+                    im2Pm1Dim = numpy.array( im2Pm1.shape )
+                    # 2015-12-17 EA: adding Check for 2D images, the z-dimension will always be 1...
+                    if im1.shape[0] == 1 and im2.shape[0] == 1:
+                        # then we're dealing with a 2D image
+                        if ( im2Pm1Dim[1] - im1Dim[1] ) != 2*cornerOffset or  ( im2Pm1Dim[2] - im1Dim[2] ) != 2*cornerOffset:
+                            # We don't have enough data (i.e. +- 1 px) to do a CC interpolation, quit.
+                            error           += 32
+
+                    else:
+                        # We're in 3D
+                        if not all( ( im2Pm1Dim - im1Dim ) == 2*cornerOffset ):
+                            # We don't have enough data (i.e. +- 1 px) to do a CC interpolation, quit.
+                            error           += 32
+
+                # ==================================
+
+
+                # ==================================
+                # === data check for II-Rotation ===
+                # ==================================
+                # Also check the data extents for the rotation...
+                if ( data.subpixel_mode[1] and data.subpixel_mode[2] ):
+                    cornerOffsetRot = int( ( ( numpy.sqrt(3) * max( im1Dim ) ) - max( im1Dim ) + 1 ) / 2.0 )
+
+                    # im2 came with the padding for the rotation, if it could be delivered
+                    if len( dataMessage ) > 3:
+                        im2Padded, im2Top = dataMessage[3], numpy.array( dataMessage[4], dtype=int )
+                    else:
+                        im2Padded, im2Top = im2, numpy.zeros( 3, dtype=int )
+
+                    rotTop = numpy.array( nodeDisplacement, dtype=int ) + im2Top - cornerOffsetRot
+                    if ( rotTop >= 0 ).all():
+                        im2Rot = im2Padded[  rotTop[0]:rotTop[0]+im1Dim[0]+2*cornerOffsetRot,\
+                                             rotTop[1]:rotTop[1]+im1Dim[1]+2*cornerOffsetRot,\
+                                             rotTop[2]:rotTop[2]+im1Dim[2]+2*cornerOffsetRot  ]
+                    else:
+                        # Out of the data on this side
+                        im2Rot = numpy.zeros( ( 0, 0, 0 ) )
+
+                    # === Step 1: Measure the dimensions of image 1 ===
+                    im2RotDim = numpy.array( im2Rot.shape )
+
+                    if not all( ( im2RotDim - im1Dim ) == 2*cornerOffsetRot ):
+                        # We don't have enough data (i.e. +- 1 px) to do a CC interpolation. asking for more data
+
+                        newExtent = extent.copy()
+                        newExtent[1,0] = [  nodeDisplacement[0]-cornerOffsetRot+extent[1,0,0], \
+                                            nodeDisplacement[1]-cornerOffsetRot+extent[1,0,1], \
+                                            nodeDisplacement[2]-cornerOffsetRot+extent[1,0,2] ]
+
+                        # (the bottom of the extents is included)
+                        newExtent[1,1] = [  nodeDisplacement[0]+cornerOffsetRot+extent[1,0,0]+im1Dim[0]-1, \
+                                            nodeDisplacement[1]+cornerOffsetRot+extent[1,0,1]+im1Dim[1]-1, \
+                                            nodeDisplacement[2]+cornerOffsetRot+extent[1,0,2]+im1Dim[2]-1 ]
+
+                        if slab is not None:
+                            # Cut it out of the shared slabs
+                            dataMessage = node_data( slab[1][0], slab[1][1], slab[2][0], slab[2][1], newExtent, data, copy=False )
+                        else:
+                            # Make a data request to data_delivery_worker, just with worker number data extents
+                            #   (locked, the other threads of this worker use the same q_data)
+                            with dataLock:
+                                q_data_requests.put( [ "DataRequest", workerNumber, newExtent ] )
+                                dataMessage = q_data.get()
 
-                            im2Rot = im2[  nodeDisplacement[0]-cornerOffsetRot:nodeDisplacement[0]+im1Dim[0]+cornerOffsetRot,\
-                                           nodeDisplacement[1]-cornerOffsetRot:nodeDisplacement[1]+im1Dim[1]+cornerOffsetRot,\
-                                           nodeDisplacement[2]-cornerOffsetRot:nodeDisplacement[2]+im1Dim[2]+cornerOffsetRot  ]
+                        if  dataMessage[0] == "Error":
+                            # Error fetching the data from the data_delivery_worker, return nothing but a data error (#1)
+                            error += 1
 
-                            # === Step 1: Measure the dimensions of image 1 ===
-                            im2RotDim = numpy.array( im2Rot.shape )
+                        elif dataMessage[0] == "Data":
+                            im2Rot     = float_windows( dataMessage )[2]
+                            im2RotDim  = numpy.array( im2Rot.shape )
 
                             if not all( ( im2RotDim - im1Dim ) == 2*cornerOffsetRot ):
-                                # We don't have enough data (i.e. +- 1 px) to do a CC interpolation. asking for more data
-
-                                newExtent = extent.copy()
-                                newExtent[1,0] = [  nodeDisplacement[0]-cornerOffsetRot+extent[1,0,0], \
-                                                    nodeDisplacement[1]-cornerOffsetRot+extent[1,0,1], \
-                                                    nodeDisplacement[2]-cornerOffsetRot+extent[1,0,2] ]
-
-                                newExtent[1,1] = [  nodeDisplacement[0]+cornerOffsetRot+extent[1,0,0]+im1Dim[0], \
-                                                    nodeDisplacement[1]+cornerOffsetRot+extent[1,0,1]+im1Dim[1], \
-                                                    nodeDisplacement[2]+cornerOffsetRot+extent[1,0,2]+im1Dim[2] ]
-
-                                # Make a data request to data_delivery_worker, just with worker number data extents
-                                q_data_requests.put( [ "DataRequest", workerNumber, newExtent ] )
-                                dataMessage = q_data.get()
-
-                                if  dataMessage[0] == "Error":
-                                    # Error fetching the data from the data_delivery_worker, return nothing but a data error (#1)
-                                    error += 1
-
-                                elif dataMessage[0] == "Data":
-                                    im2Rot     = dataMessage[2]
-                                    im2RotDim  = numpy.array( im2Rot.shape )
-
-                                    if not all( ( im2RotDim - im1Dim ) == 2*cornerOffsetRot ):
-                                        #Got more data but it was the wrong shape
-                                        error           += 32
-
-                        # ==================================
-
-                        # ===========================
-                        # === CC INTERPOLATION ======
-                        # ===========================
-                        # OK, let's do the CC interpolation if we've been asked to do it!
-                        if data.subpixel_mode[0] and error == 0:
-
-                            if im1.shape[0] == 1 and im2.shape[0] == 1:
-                                returns = cc_interpolation_local_2D(  im1, im2Pm1, \
-                                                                      data.subpixel_CC_refinement_step_threshold, \
-                                                                      data.subpixel_CC_max_refinement_iterations, \
-                                                                      data.subpixel_CC_max_refinement_step  )
-                            else:
-                                returns = cc_interpolation_local(     im1, im2Pm1, \
-                                                                      data.subpixel_CC_refinement_step_threshold, \
-                                                                      data.subpixel_CC_max_refinement_iterations, \
-                                                                      data.subpixel_CC_max_refinement_step  )
-
-                            nodeDispSubpixel = returns[0:3]
-                            ccSubpixel       = returns[3]
-                            iterations       = returns[4]
-                            error           += returns[5]
-
-                            if ccSubpixel >= cc and error == 0: cc = ccSubpixel
-                            else:               error += 1024
-                        # ===========================
-
-
-                        # ===========================
-                        # === IMAGE INTERPOLATION ===
-                        # ===========================
-                        if data.subpixel_mode[1] and error == 0:
-                            if data.subpixel_mode[2]:
-                                #Doing Image Interpolation with Translation AND Rotation!
-                                guess = numpy.hstack( ( nodeDispSubpixel, nodeRotSubpixel) )
-
-                                returns = image_interpolation_translation_rotation( im1, im2Rot, guess, cornerOffsetRot, data.subpixel_II_interpolationMode, data.subpixel_II_interpolation_order, data.subpixel_II_optimisation_mode )
-
-                                nodeDispSubpixel = returns[0][0:3]
-                                nodeRotSubpixel  = returns[0][3:6]
-                                ccSubpixel       = returns[1]
-                                iterations       = returns[2]
-                                error           += returns[3]
-
-                                cc = ccSubpixel
-
-                            else:
-                                #Doing Image Interpolation with Translation!
-                                returns = image_interpolation_translation_rotation( im1, im2Pm1, nodeDispSubpixel, cornerOffset, data.subpixel_II_interpolationMode, data.subpixel_II_interpolation_order, data.subpixel_II_optimisation_mode )
-
-                                nodeDispSubpixel = returns[0]
-                                ccSubpixel       = returns[1]
-                                iterations       = returns[2]
-                                error           += returns[3]
-
-                                cc = ccSubpixel
-                        # ===========================
-
-            # In any case send something on the q_results
-            q_results.put( [ nodeNumber, nodeDispSubpixel + nodeDisplacement, nodeRotSubpixel, cc, error ]  )
\ No newline at end of file
+                                #Got more data but it was the wrong shape
+                                error           += 32
+
+                # ==================================
+
+                # ===========================
+                # === CC INTERPOLATION ======
+                # ===========================
+                # OK, let's do the CC interpolation if we've been asked to do it!
+                if data.subpixel_mode[0] and error == 0:
+
+                    if ccFit is not None:
+                        # Already done with the rest of the batch
+                        returns = ccFit
+                    elif ccNeighbourhood is not None and im1.shape[0] == 1 and im2.shape[0] == 1:
+                        returns = cc_interpolation_fit_2D(    ccNeighbourhood, \
+                                                              data.subpixel_CC_refinement_step_threshold, \
+                                                              data.subpixel_CC_max_refinement_iterations, \
+                                                              data.subpixel_CC_max_refinement_step  )
+                    elif ccNeighbourhood is not None:
+                        returns = cc_interpolation_fit(       ccNeighbourhood, \
+                                                              data.subpixel_CC_refinement_step_threshold, \
+                                                              data.subpixel_CC_max_refinement_iterations, \
+                                                              data.subpixel_CC_max_refinement_step  )
+                    elif im1.shape[0] == 1 and im2.shape[0] == 1:
+                        returns = cc_interpolation_local_2D(  im1, im2Pm1, \
+                                                              data.subpixel_CC_refinement_step_threshold, \
+                                                              data.subpixel_CC_max_refinement_iterations, \
+                                                              data.subpixel_CC_max_refinement_step  )
+                    else:
+                        returns = cc_interpolation_local(     im1, im2Pm1, \
+                                                              data.subpixel_CC_refinement_step_threshold, \
+                                                              data.subpixel_CC_max_refinement_iterations, \
+                                                              data.subpixel_CC_max_refinement_step  )
+
+                    nodeDispSubpixel = returns[0:3]
+                    ccSubpixel       = returns[3]
+                    iterations       = returns[4]
+                    error           += returns[5]
+
+                    if ccSubpixel >= cc and error == 0: cc = ccSubpixel
+                    else:               error += 1024
+                # ===========================
+
+
+                # ===========================
+                # === IMAGE INTERPOLATION ===
+                # ===========================
+                if data.subpixel_mode[1] and error == 0:
+                    if data.subpixel_mode[2]:
+                        #Doing Image Interpolation with Translation AND Rotation!
+                        guess = numpy.hstack( ( nodeDispSubpixel, nodeRotSubpixel) )
+
+                        returns = image_interpolation_translation_rotation( im1, im2Rot, guess, cornerOffsetRot, data.subpixel_II_interpolationMode, data.subpixel_II_interpolation_order, data.subpixel_II_optimisation_mode, data.subpixel_II_adaptive_tolerance )
+
+                        nodeDispSubpixel = returns[0][0:3]
+                        nodeRotSubpixel  = returns[0][3:6]
+                        ccSubpixel       = returns[1]
+                        iterations       = returns[2]
+                        error           += returns[3]
+
+                        cc = ccSubpixel
+
+                    else:
+                        #Doing Image Interpolation with Translation!
+                        returns = image_interpolation_translation_rotation( im1, im2Pm1, nodeDispSubpixel, cornerOffset, data.subpixel_II_interpolationMode, data.subpixel_II_interpolation_order, data.subpixel_II_optimisation_mode, data.subpixel_II_adaptive_tolerance )
+
+                        nodeDispSubpixel = returns[0]
+                        ccSubpixel       = returns[1]
+                        iterations       = returns[2]
+                        error           += returns[3]
+
+                        cc = ccSubpixel
+                # ===========================
+
+    # Flag nodes where the coarse and the fine pixel search disagree. This is done at the end
+    #   so that it doesn't stop the subpixel refinement.
+    if pyramidDisagreement: error += 2048
+
+    # In any case return something for the q_results
+    return [ nodeNumber, nodeDispSubpixel + nodeDisplacement, nodeRotSubpixel, cc, error ]
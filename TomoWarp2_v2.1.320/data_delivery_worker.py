@@ -46,23 +46,272 @@ Inputs on the IN pipes:
                                                   a few times from each DIC_setup run
   - "DataRequest": data requests from nodes    # This will come #nodes times for each 
                                                   DIC_setup
+                   with the padding of image 2 for the image interpolation with rotation,
+                   so that a node gets all its data with one request (see node_data())
+  - "SlabPlan":    the list of all the extents that will come with "NewExtents", planned
+                   by DIC_setup (see tools/plan_slabs.py)
   - "STOP":        to stop the process
+
+Slabs: the slices are kept in ring buffers (see tools/load_slices.py), moving to new extents
+  only reads the slices that are not in memory yet and writes them over the ones that are not
+  needed any more, the memory used stays the one of the ring buffers.
+
+Shared slabs: the ring buffers are .npy files in a shared memory directory (/dev/shm if
+  available), memory-mapped here and in the DIC_workers. After each "NewExtents" the file
+  names, the z-extents and a generation counter (which changes with the files, i.e., only if
+  a ring buffer had to be reallocated) are sent back on q_slab_ready, DIC_setup gives them to
+  the DIC_workers with each node, and the workers take their windows directly from the
+  memory-mapped ring buffers (see node_data()) instead of sending a "DataRequest".
+  If the shared directory can not be used, does not have the free space for the slabs (see
+  room_for_rings()), or there is a single slab in the "SlabPlan", the slab info is None and the
+  workers send "DataRequest" as before.
+
+Prefetch: the slices of the extents following the current "NewExtents" in the "SlabPlan" are
+  read straight away into the part of the ring buffers that the current slabs do not use, the
+  current slabs stay untouched for the DIC_workers.
+  When the matching "NewExtents" arrives only the z-extents change, without reading anything.
+  The prefetch runs in a thread, the "DataRequest" for the current slabs are answered meanwhile
+  and any other message waits for it to be over.
+  With data.slabPrefetch (off by default) memLimitSlices is halved (see input_parameters_update) and the ring
+  buffers have room for two slabs (see load_slices.slab_capacity), so they fit in memLimitMB.
+  If the two slabs do not fit together in the ring buffers, there is no prefetch.
 """
 
-import sys
+import os
+import shutil
+import tempfile
+import itertools
+import threading
+import numpy
 import logging
-from tools.load_slices import load_slices
+from tools.load_slices import load_slices, slab_capacity, ring_rows
+from tools.read_images import close_tiff_3D
+from tools.volume_cache import close_volume_caches
+
+# Free space of the shared directory needed to share the slabs: this factor times their size, plus these MB
+SHARED_HEADROOM_FACTOR = 1.1
+SHARED_HEADROOM_MB     = 64
+
+# Generation numbers of the shared slabs of this process
+slabGenerations = itertools.count( 1 )
+
+
+def shared_slab_directory():
+    # Directory for the shared slabs, in memory (/dev/shm) if possible, otherwise in the temporary directory
+    for parent in [ "/dev/shm", None ]:
+        try:
+            return tempfile.mkdtemp( prefix="tomowarp_slabs_", dir=parent )
+        except:
+            pass
+    return None
+
+
+def share_ring( directory, generation, imageNumber, image ):
+    # Copy a ring buffer into a .npy file of the shared directory, returns the memory-mapped ring buffer (to keep
+    #   writing into) and the file name
+    fileName = os.path.join( directory, "slab_%06i_im%i.npy"%( generation, imageNumber ) )
+
+    ring = numpy.lib.format.open_memmap( fileName, mode='w+', dtype=image.dtype, shape=image.shape )
+    ring[:] = image
+
+    return ring, fileName
+
+
+def room_for_rings( directory, nbytes ):
+    # Whether nbytes fit in the free space of the shared directory, with some room to spare: writing in a memory-mapped
+    #   file of a full tmpfs (e.g. the 64 MB /dev/shm of docker) kills the process with a SIGBUS, which can not be caught
+    try:
+        fileSystem = os.statvfs( directory )
+    except:
+        return False
+    return fileSystem.f_bavail * fileSystem.f_frsize >= SHARED_HEADROOM_FACTOR * nbytes + SHARED_HEADROOM_MB * 1024 * 1024
+
+
+def share_rings( directory, shared, im1, im2 ):
+    # shared = [ generation, [ ring im1, ring im2 ], [ file im1, file im2 ] ] describes the ring buffers already shared (None at first)
+    #   If im1 and im2 are not these ones (first slabs, or reallocated by load_slices) they are copied in new files.
+    #   Returns the ring buffers to use from now on and the description of the shared ones
+    if shared is not None and im1 is shared[1][0] and im2 is shared[1][1]:
+        return im1, im2, shared
+
+    if not room_for_rings( directory, im1.nbytes + im2.nbytes ):
+        raise Exception( "not enough free space in %s for %.1f MB of slabs"%( directory, ( im1.nbytes + im2.nbytes ) / 1024.0 / 1024.0 ) )
+
+    # Never the number of files that may still be mapped, even after a failure (shared is then None)
+    generation = next( slabGenerations )
+    im1, fileName1 = share_ring( directory, generation, 1, im1 )
+    im2, fileName2 = share_ring( directory, generation, 2, im2 )
+    return im1, im2, [ generation, [ im1, im2 ], [ fileName1, fileName2 ] ]
+
+
+def remove_slab_files( fileNames ):
+    # Workers that still have them mapped keep them until they let go
+    for fileName in fileNames:
+        try: os.remove( fileName )
+        except: pass
+
+
+def rings_fit( zExtents_a, zExtents_b, ring ):
+    # Whether the slices of both extents fit together in the ring buffer
+    return ring is not None and len( ring ) > 0 and \
+           max( zExtents_a[1], zExtents_b[1] ) - min( zExtents_a[0], zExtents_b[0] ) + 1 <= len( ring )
+
+
+def prefetch_slabs( zExtents_next, zExtents_im1_current, zExtents_im2_current, im1, im2, data, sharedDirectory, shared ):
+    # Read the slices of zExtents_next in the part of the ring buffers im1 and im2 that the current slabs do not use
+    #   Returns the prefetched slabs [ requested extents, zExtents_im1, zExtents_im2, im1, im2, shared ], None if
+    #   there is no room for them or it failed
+    if not rings_fit( zExtents_next[0], zExtents_im1_current, im1 ) or not rings_fit( zExtents_next[1], zExtents_im2_current, im2 ):
+      try: logging.log.info( "data_delivery_worker(): No room to prefetch "+str( zExtents_next ) )
+      except: print  "data_delivery_worker(): No room to prefetch "+str( zExtents_next )
+      return None
+
+    try: logging.log.info( "data_delivery_worker(): Prefetching "+str( zExtents_next ) )
+    except: print  "data_delivery_worker(): Prefetching "+str( zExtents_next )
+
+    try:
+      zExtents_im1_next, im1_next = load_slices( zExtents_next[0], zExtents_im1_current, im1, 1, data )
+      zExtents_im2_next, im2_next = load_slices( zExtents_next[1], zExtents_im2_current, im2, 2, data )
+
+      # Share them in new files if load_slices had to reallocate a ring buffer
+      if shared is not None:
+        im1_next, im2_next, shared = share_rings( sharedDirectory, shared, im1_next, im2_next )
+
+      return [ zExtents_next, zExtents_im1_next, zExtents_im2_next, im1_next, im2_next, shared ]
+    except Exception as exc:
+      # Never mind, it will be loaded with the "NewExtents"
+      try: logging.log.warn( "data_delivery_worker(): could not prefetch: %s"%( exc ) )
+      except: print "data_delivery_worker(): could not prefetch: %s"%( exc )
+      return None
+
+
+def start_prefetch( *prefetchArguments ):
+    # Run prefetch_slabs() in a thread, so that the "DataRequest" for the current slabs are answered while it reads.
+    #   It only writes in the part of the ring buffers that the current slabs do not use. Returns [ thread, result ]
+    result = [ None ]
+
+    def prefetch():
+        result[0] = prefetch_slabs( *prefetchArguments )
+
+    thread = threading.Thread( target=prefetch )
+    thread.daemon = True
+    thread.start()
+    return [ thread, result ]
+
+
+def finish_prefetch( prefetching ):
+    # Wait for the thread of start_prefetch(), returns the prefetched slabs (None if there was no room or it failed)
+    prefetching[0].join()
+    return prefetching[1][0]
+
+
+def open_shared_slab( slabInfo ):
+    # Memory-map the two ring buffers described by slabInfo = [ generation, [ file im1, file im2 ], [ z-extents im1, z-extents im2 ] ]
+    return [ numpy.load( slabInfo[1][0], mmap_mode='r' ), numpy.load( slabInfo[1][1], mmap_mode='r' ) ]
+
+
+def node_data( im1, im2, zExtents_im1_current, zExtents_im2_current, nodeExtent, data, copy=True, padding=0 ):
+    # Cut the windows of one node out of the ring buffers im1 and im2, which hold the slices zExtents_imX_current.
+    #   Returns the message for the DIC_worker: [ "Data", im1_subvolume, im2_subvolume ] or [ "Error", None, None ]
+    #   With copy=False the windows are views of the ring buffers, when they do not wrap around.
+    #   With padding > 0 im2 is also cut with padding more voxels on each side (as far as the ring buffer goes),
+    #   for the image interpolation with rotation, and the message is
+    #   [ "Data", im1_subvolume, im2_subvolume, im2_padded, position of im2_subvolume in im2_padded ]
+
+    # 2015-11-18 EA: There is a strange error of im2.shape failing because im2 is a list...
+    #   putting in a light check to avoid this...
+    try:
+        # Shape of the slabs in the ring buffers
+        im1Shape = ( zExtents_im1_current[1] - zExtents_im1_current[0] + 1, ) + im1.shape[1:]
+        im2Shape = ( zExtents_im2_current[1] - zExtents_im2_current[0] + 1, ) + im2.shape[1:]
+
+        # Node extents are in absolute coordinates
+        extent_im1 = local_extent( nodeExtent[0], zExtents_im1_current, im1Shape, data.ROI_corners[0] )
+        extent_im2 = local_extent( nodeExtent[1], zExtents_im2_current, im2Shape, data.ROI_corners[1] )
+
+        im1_subvolume = im1[  ring_rows( extent_im1[0,0] + zExtents_im1_current[0], extent_im1[1,0] + zExtents_im1_current[0], len( im1 ) ),\
+                              extent_im1[0,1]:extent_im1[1,1]+1,\
+                              extent_im1[0,2]:extent_im1[1,2]+1 ]
+
+        im2_subvolume = im2[  ring_rows( extent_im2[0,0] + zExtents_im2_current[0], extent_im2[1,0] + zExtents_im2_current[0], len( im2 ) ),\
+                              extent_im2[0,1]:extent_im2[1,1]+1,\
+                              extent_im2[0,2]:extent_im2[1,2]+1 ]
+
+        if copy:
+            im1_subvolume = numpy.array( im1_subvolume )
+            im2_subvolume = numpy.array( im2_subvolume )
+
+        # make sure that we have enough data to send at least for a correlation window.
+        if im1_subvolume.shape != tuple([ x*2+1 for x in data.correlation_window]) or im2_subvolume.shape < tuple([ x*2+1 for x in data.correlation_window]):
+            return [ "Error", None, None ]
+
+        elif padding > 0:
+            paddedExtent  = numpy.array( nodeExtent[1], copy=True )
+            paddedExtent[0] -= padding
+            paddedExtent[1] += padding
+            extent_padded = local_extent( paddedExtent, zExtents_im2_current, im2Shape, data.ROI_corners[1] )
+
+            im2_padded = im2[  ring_rows( extent_padded[0,0] + zExtents_im2_current[0], extent_padded[1,0] + zExtents_im2_current[0], len( im2 ) ),\
+                               extent_padded[0,1]:extent_padded[1,1]+1,\
+                               extent_padded[0,2]:extent_padded[1,2]+1 ]
+            if copy:
+                im2_padded = numpy.array( im2_padded )
+
+            return [ "Data", im1_subvolume, im2_subvolume, im2_padded, extent_im2[0] - extent_padded[0] ]
+
+        else:
+            return [ "Data", im1_subvolume, im2_subvolume ]
+    except:
+        return [ "Error", None, None ]
+
+
+def local_extent( extent, zExtents_current, slabShape, ROI_corners ):
+    # Extent [ top, bottom ] x [ z, y, x ] in absolute coordinates, in the coordinates of the slab holding the slices
+    #   zExtents_current of the loaded ROI, cropped to fit in the slab
+
+    # The copy keeps the caller's extent as it is
+    extent = numpy.array( extent, copy=True )
+
+    #   First: Add crop in horizontal directions, -- the loaded ROI is still in absolute image coordinates
+    extent[ :, 1:3 ] = extent[ :, 1:3 ] - ROI_corners[0,1:3]
+
+    # Second, add z_extent for this row of nodes.
+    extent[ :, 0 ]   = extent[ :, 0 ]   - zExtents_current[0]
+
+    for i_d in range(3):
+        # crop the extent of requested volume to fit in the available volume (i_d = index for dimensions)
+        extent[ extent[:,i_d]  <  0,             i_d ] = 0
+        extent[ extent[:,i_d]  >  slabShape[i_d], i_d ] = slabShape[i_d]
+        # the bottom slices are included, the ring buffer has no slices after the slab
+        extent[ 1, i_d ] = min( extent[ 1, i_d ], slabShape[i_d] - 1 )
+
+    return extent
 
 
 # to unpickle our pipes to the DIC workers, otherwise they can't be send by pipe, see
 #   http://stackoverflow.com/questions/1446004/python-2-6-send-connection-object-over-queue-pipe-etc
 
-def data_delivery_worker( pipe_data_requests_out, workerQueues ):
+def data_delivery_worker( pipe_data_requests_out, workerQueues, q_slab_ready=None ):
   
   
     try: logging.log.info( "data_delivery_worker: Started." )
     except: print "data_delivery_worker: Started." 
 
+    # Shared slabs, only if someone (DIC_setup) is listening on q_slab_ready
+    #   shared = [ generation, [ ring im1, ring im2 ], [ file im1, file im2 ] ] of the current slabs
+    sharedDirectory = None
+    if q_slab_ready is not None:
+        sharedDirectory = shared_slab_directory()
+    shared          = None
+
+    # Prefetched slabs: [ requested extents, zExtents_im1, zExtents_im2, im1, im2, shared ]
+    #   and the prefetch running in its thread, see start_prefetch()
+    prefetched      = None
+    prefetching     = None
+
+    # Extents of all the slabs to come, if DIC_setup sent a plan
+    slabPlan        = []
+
     # Initialise current z-extents and empty images
     zExtents_im1_current = [ -1, -1 ]
     zExtents_im2_current = [ -1, -1 ]
@@ -82,81 +331,117 @@ def data_delivery_worker( pipe_data_requests_out, workerQueues ):
         # Get a message from the pipe_data_requests
         message = pipe_data_requests_out.get()
 
+        if message[0] not in [ "DataRequest", "SlabPlan" ] and prefetching is not None:
+            # Wait for the prefetch to be over, only the "DataRequest" are answered while it runs
+            prefetched  = finish_prefetch( prefetching )
+            prefetching = None
+
         if message[0] == "NewData":
             # Here we are expecting a new DATA array, and individual pipes to workers
             data              = message[1]
+            slabPlan          = []
+
+            # Keep what is in memory only if the ring buffers have the right size for this data
+            if im1 is not None and len( im1 ) > 0 and len( im1 ) != slab_capacity( data ):
+              zExtents_im1_current = [ -1, -1 ]
+              zExtents_im2_current = [ -1, -1 ]
+              im1 = None
+              im2 = None
+              prefetched = None
+
+        elif message[0] == "SlabPlan":
+            # Here we are expecting the list of extents that will come with "NewExtents"
+            slabPlan          = message[1]
 
         elif message[0] == "NewExtents":
 
-            try: logging.log.info( "data_delivery_worker(): message = "+str( message ) )
-            except: print  "data_delivery_worker(): message = "+str( message ) 
+            try: logging.log.debug( "data_delivery_worker(): new extents "+str( message[1] ) )
+            except: print  "data_delivery_worker(): new extents "+str( message[1] )
             # Here we are expecting two arrays with a new top and bottom z slices numbers for im1 and im2
             zExtents_im1_new = message[1][0]
             zExtents_im2_new = message[1][1]
 
-            try:
-              # load new slices, if any, and update current z extents.
-              try: logging.log.info( "data_delivery_worker(): Loading data..." )
-              except: print  "data_delivery_worker(): Loading data..." 
-              zExtents_im1_current, im1 = load_slices( zExtents_im1_new, zExtents_im1_current, im1, 1, data )
-              zExtents_im2_current, im2 = load_slices( zExtents_im2_new, zExtents_im2_current, im2, 2, data )
-              try: logging.log.info( "data_delivery_worker(): Done" )
-              except: print  "data_delivery_worker(): Done" 
-            except Exception as exc:
-              #raise Exception(exc)
-              try: logging.err.error( exc.message )
-              except: print exc.message 
-              im1=[]
-              im2=[]
+            if prefetched is not None and numpy.array_equal( prefetched[0], message[1] ):
+              # Already in the ring buffers
+              try: logging.log.info( "data_delivery_worker(): Using the prefetched data" )
+              except: print  "data_delivery_worker(): Using the prefetched data"
+              if shared is not None and prefetched[5][2] != shared[2]:
+                remove_slab_files( shared[2] )
+              requested, zExtents_im1_current, zExtents_im2_current, im1, im2, shared = prefetched
+              prefetched = None
 
-        elif message[0] == "DataRequest":
+            else:
+              if prefetched is not None:
+                # Not what was expected, forget it
+                if shared is not None and prefetched[5][2] != shared[2]:
+                  remove_slab_files( prefetched[5][2] )
+                prefetched = None
 
-            # Here we are expecting a worker number (in order to reply on the right queue), an im1 top and bottom corner, and im2 top and bottom corner
-            workerNumber = message[1]
-            nodeExtent   = message[2]
+              try:
+                # load new slices, if any, and update current z extents.
+                try: logging.log.info( "data_delivery_worker(): Loading data..." )
+                except: print  "data_delivery_worker(): Loading data..." 
+                zExtents_im1_current, im1 = load_slices( zExtents_im1_new, zExtents_im1_current, im1, 1, data )
+                zExtents_im2_current, im2 = load_slices( zExtents_im2_new, zExtents_im2_current, im2, 2, data )
+                try: logging.log.info( "data_delivery_worker(): Done" )
+                except: print  "data_delivery_worker(): Done" 
+              except Exception as exc:
+                #raise Exception(exc)
+                try: logging.err.error( exc.message )
+                except: print exc.message 
+                zExtents_im1_current = [ -1, -1 ]
+                zExtents_im2_current = [ -1, -1 ]
+                im1=[]
+                im2=[]
 
-            # Node extents are in absolute coordinates:
-            #   First: Add crop in horizontal directions, -- the loaded ROI is still in absolute image coordinates
-            nodeExtent[ 0, :, 1:3 ] = nodeExtent[ 0, :, 1:3 ] - data.ROI_corners[0,0,1:3]
-            nodeExtent[ 1, :, 1:3 ] = nodeExtent[ 1, :, 1:3 ] - data.ROI_corners[1,0,1:3]
+              if sharedDirectory is not None and len( im1 ) > 0 and len( im2 ) > 0 and len( slabPlan ) > 1:
+                # Put the ring buffers in shared memory, if they are not already. Not with a single slab (e.g. the
+                #   whole volume without memLimitMB), which would only be in memory twice
+                try:
+                  previousFiles = shared[2] if shared is not None else []
+                  im1, im2, shared = share_rings( sharedDirectory, shared, im1, im2 )
 
-            # Second, add z_extent for this row of nodes.
-            nodeExtent[0,:,0]       = nodeExtent[0,:,0]       - zExtents_im1_current[0]
-            nodeExtent[1,:,0]       = nodeExtent[1,:,0]       - zExtents_im2_current[0]
+                  # The files of the previous generation are not needed any more
+                  if shared[2] != previousFiles:
+                    remove_slab_files( previousFiles )
+                except Exception as exc:
+                  try: logging.err.error( "data_delivery_worker(): could not share the slabs: %s"%( exc ) )
+                  except: print "data_delivery_worker(): could not share the slabs: %s"%( exc )
+                  shared = None
 
-            # 2015-11-18 EA: There is a strange error of im2.shape failing because im2 is a list...
-            #   putting in a light check to avoid this...
-            try:
-                im1.shape
-                im2.shape
+            if q_slab_ready is not None:
+              # Tell DIC_setup where the slabs are
+              slabInfo = None
+              if shared is not None and len( im1 ) > 0 and len( im2 ) > 0:
+                slabInfo = [ shared[0], shared[2], [ zExtents_im1_current, zExtents_im2_current ] ]
+              q_slab_ready.put( [ "SlabReady", slabInfo ] )
 
-                for i_d in range(3):
-                    # crop the extent of requested volume to fit in the available volume (i_d = index for dimensions)
-                    nodeExtent[ 0, nodeExtent[0,:,i_d]  <  0,        i_d      ] = 0
-                    nodeExtent[ 0, nodeExtent[0,:,i_d]  >  im1.shape[i_d], i_d] = im1.shape[i_d]
-                    nodeExtent[ 1, nodeExtent[1,:,i_d]  <  0,        i_d      ] = 0
-                    nodeExtent[ 1, nodeExtent[1,:,i_d]  >  im2.shape[i_d], i_d] = im2.shape[i_d]
+            # Start loading the slab that follows in the plan, while the DIC_workers are busy with this one
+            if data.slabPrefetch and len( im1 ) > 0 and len( im2 ) > 0:
+              nextSlabs = [ i+1 for i, zExtents in enumerate( slabPlan[:-1] ) if numpy.array_equal( zExtents, message[1] ) ]
+              if len( nextSlabs ) > 0:
+                prefetching = start_prefetch( slabPlan[ nextSlabs[0] ], zExtents_im1_current, zExtents_im2_current, \
+                                              im1, im2, data, sharedDirectory, shared )
 
-                im1_subvolume = im1[  nodeExtent[0,0,0]:nodeExtent[0,1,0]+1,\
-                                      nodeExtent[0,0,1]:nodeExtent[0,1,1]+1,\
-                                      nodeExtent[0,0,2]:nodeExtent[0,1,2]+1 ].copy()
-
-                im2_subvolume = im2[  nodeExtent[1,0,0]:nodeExtent[1,1,0]+1,\
-                                      nodeExtent[1,0,1]:nodeExtent[1,1,1]+1,\
-                                      nodeExtent[1,0,2]:nodeExtent[1,1,2]+1 ].copy()
+        elif message[0] == "DataRequest":
 
-                # make sure that we have enough data to send at least for a correlation window.
-                if im1_subvolume.shape != tuple([ x*2+1 for x in data.correlation_window]) or im2_subvolume.shape < tuple([ x*2+1 for x in data.correlation_window]):
-                    workerQueues[ workerNumber ].put( [ "Error", None, None] )
+            # Here we are expecting a worker number (in order to reply on the right queue), an im1 top and bottom corner, and im2 top and bottom corner
+            #   and, optionally, the padding of im2 for the rotation
+            workerNumber = message[1]
+            nodeExtent   = message[2]
+            padding      = message[3] if len( message ) > 3 else 0
 
-                else:
-                    # Reply with data into the worker's data queue
-                    workerQueues[ workerNumber ].put( [ "Data", im1_subvolume, im2_subvolume ] )
-            except:
-                workerQueues[ workerNumber ].put( [ "Error", None, None] )
+            # Reply with data into the worker's data queue
+            workerQueues[ workerNumber ].put( node_data( im1, im2, zExtents_im1_current, zExtents_im2_current, nodeExtent, data, padding=padding ) )
 
 
         elif message[0] == "STOP":
             try: logging.log.info( "data_delivery_worker: Received stop, stopping" )
             except: print  "data_delivery_worker: Received stop, stopping" 
+            prefetched = None
+            close_tiff_3D()
+            close_volume_caches()
+            if sharedDirectory is not None:
+                shutil.rmtree( sharedDirectory, ignore_errors=True )
             return -1
+
@@ -164,7 +164,7 @@ class Minimal_setup(Frame):
 
         self.variables['Advanced'] = IntVar()
 
-        self.extDict = {'auto':'', 'TIFF':"\.[Tt][iI][Ff]{1,2}", 'RAW':'', 'EDF':"\.[Ee][De][Ff]", 'TIFF_PIL':"\.[Tt][iI][Ff]{1,2}"}
+        self.extDict = {'auto':'', 'TIFF':"\.[Tt][iI][Ff]{1,2}", 'RAW':'', 'EDF':"\.[Ee][De][Ff]", 'TIFF_PIL':"\.[Tt][iI][Ff]{1,2}", 'CHUNKED':"\.[Tt][Ww][Cc]"}
 
         stringList = ['DIR_image1','DIR_image2', 'DIR_out', 'image_format', 'image_data_format' ]
 
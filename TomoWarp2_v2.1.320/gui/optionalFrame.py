@@ -220,7 +220,7 @@ class Optional_setup(Frame):
           self.variables[field].set(self.data[field])
 
         floatList = ['grey_low_threshold', 'grey_high_threshold', 'subpixel_CC_refinement_step_threshold',\
-                      'errorLowLimit', 'errorHighLimit', 'prior_cc_threshold']
+                      'errorLowLimit', 'errorHighLimit', 'prior_cc_threshold', 'subpixel_II_adaptive_tolerance']
 
         for field in floatList:
           self.variables[field] = DoubleVar()
@@ -292,7 +292,7 @@ class Advanced_setup( Toplevel ):
 
         self.configure( bd=1, relief=SUNKEN)
         self.interpolatioModeList = [ " pytricubic", "map_coordinates"]
-        self.formatList = [ "Nelder-Mead", "Powell", "CG", "BFGS", "Newton-CG", "L-BFGS-B", "TNC", "COBYLA", "SLSQP", "dogleg", "trust-ncg" ,"subPixelSearch"]
+        self.formatList = [ "Nelder-Mead", "Powell", "CG", "BFGS", "Newton-CG", "L-BFGS-B", "TNC", "COBYLA", "SLSQP", "dogleg", "trust-ncg" ,"subPixelSearch", "Gauss-Newton", "adaptiveSubPixelSearch"]
         self.createWidgets()
         centre_win( self )
 
@@ -332,6 +332,9 @@ class Advanced_setup( Toplevel ):
         Label( self, text="Optimisation Mode", width=self.labelWidth, anchor=W                                    ).grid( row=currentRow, column=0, sticky=W,   padx=5 )
         OptionMenu( self, self.master.variables['subpixel_II_optimisation_mode'], *self.formatList                ).grid( row=currentRow, column=1, sticky=W+E, padx=5, columnspan = 2 )
         currentRow += 1
+        Label( self, text="Adaptive Search Tolerance", width=self.labelWidth, anchor=W                            ).grid( row=currentRow, column=0, sticky=W,   padx=5 )
+        Entry( self, textvariable=self.master.variables['subpixel_II_adaptive_tolerance'], width=self.entryWidth ).grid( row=currentRow, column=1, sticky=W+E, padx=5, columnspan = 2 )
+        currentRow += 1
 
         Button(self,text="Close",command=self.destroy).grid( row=currentRow, column=1, sticky=E, padx=5, pady=(10,5) )
         currentRow += 1
\ No newline at end of file
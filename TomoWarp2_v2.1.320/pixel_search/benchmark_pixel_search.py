@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016, Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+# This file is part of TomoWarp2.
+#
+# TomoWarp2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TomoWarp2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TomoWarp2.  If not, see <http://www.gnu.org/licenses/>.
+
+# ===================================================================
+# ===========================  TomoWarp2  ===========================
+# ===================================================================
+
+# Authors: Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+"""
+Micro-benchmark of the integer pixel search engines on the examples/3D data.
+
+Nodes are taken at random in the Intact volume and searched in the Deformed volume,
+  each engine is timed on the same nodes and compared to the original C-code.
+
+Run from the TomoWarp2 directory:
+  python -m pixel_search.benchmark_pixel_search [ correlation_window [ search_window [ nNodes ] ] ]
+"""
+
+import os, sys, time
+import numpy
+
+from tools import tifffile
+from pixel_search.integer_pixel_search import integer_pixel_search, pruned_pixel_search
+
+
+def load_example_volume( directory ):
+    fileList = sorted( [ f for f in os.listdir( directory ) if f.endswith( ".tif" ) ] )
+    return numpy.array( [ tifffile.imread( os.path.join( directory, f ) ) for f in fileList ], dtype='<f4' )
+
+
+def benchmark_pixel_search( correlation_window=5, search_window=10, nNodes=200, engines=[ "direct", "sat", "pruned", "fft", "auto" ] ):
+
+    exampleDir = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), "..", "examples", "3D" )
+    im1Volume  = load_example_volume( os.path.join( exampleDir, "Intact" ) )
+    im2Volume  = load_example_volume( os.path.join( exampleDir, "Deformed" ) )
+
+    # Node positions far enough from the borders to have the full search window
+    margin = correlation_window + search_window
+    shape  = numpy.minimum( im1Volume.shape, im2Volume.shape )
+    if any( shape <= 2*margin ):
+        raise Exception( "benchmark_pixel_search(): correlation_window + search_window too big for the example volume" )
+
+    numpy.random.seed( 0 )
+    nodes = numpy.array( [ numpy.random.randint( margin, n - margin, nNodes ) for n in shape ] ).T
+
+    windows = []
+    for z, y, x in nodes:
+        im1 = im1Volume[ z-correlation_window:z+correlation_window+1, y-correlation_window:y+correlation_window+1, x-correlation_window:x+correlation_window+1 ].copy()
+        im2 = im2Volume[ z-margin:z+margin+1, y-margin:y+margin+1, x-margin:x+margin+1 ].copy()
+        windows.append( [ im1, im2 ] )
+
+    print "Correlation window: %i, search window: +-%i, %i nodes"%( correlation_window, search_window, nNodes )
+
+    results = {}
+    for engine in engines:
+        timeA = time.time()
+        results[ engine ] = numpy.array( [ integer_pixel_search( im1, im2, engine ) for im1, im2 in windows ] )
+        timeB = time.time()
+        print "\t%-8s %8.3f ms/node"%( engine, 1000 * ( timeB - timeA ) / float( nNodes ) ),
+
+        if engine != engines[0]:
+            sameMax = numpy.all( results[ engine ][ :, 0:3 ] == results[ engines[0] ][ :, 0:3 ], axis=1 ).sum()
+            ccDiff  = numpy.abs( results[ engine ][ :, 3 ] - results[ engines[0] ][ :, 3 ] ).max()
+            print "  same maximum as %s: %i/%i, max CC difference: %g"%( engines[0], sameMax, nNodes, ccDiff )
+        else:
+            print
+
+    # Fraction of the positions abandoned by the "pruned" search
+    if "pruned" in engines:
+        nPositions = 0
+        nPruned    = 0
+        for im1, im2 in windows:
+            nPositions += numpy.prod( numpy.array( im2.shape ) - numpy.array( im1.shape ) + 1 )
+            nPruned    += pruned_pixel_search( im1, im2 )[1]
+        print "\tpruned: %i/%i positions abandoned ( %2.1f %% )"%( nPruned, nPositions, 100 * nPruned / float( nPositions ) )
+
+    return results
+
+
+if __name__ == "__main__":
+    arguments = [ int( a ) for a in sys.argv[1:] ]
+    benchmark_pixel_search( *arguments )
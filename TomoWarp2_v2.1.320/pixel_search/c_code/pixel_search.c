@@ -1,4 +1,5 @@
 #include <stdio.h>
+#include <stdlib.h>
 #include <math.h>
 #include "pixel_search.h"
 
@@ -118,3 +119,550 @@ void pixel_search(  int slic1, int rows1, int cols1, float* im1,\
 //     return cc_max;
 }
 
+
+
+/* Integral volume (summed-area table) of im2, one voxel bigger in each direction with zeros on
+ *   the first plane, row and column:
+ *      sat[k+1, j+1, i+1] = sum over [0..k, 0..j, 0..i] of
+ *                              im2^2                                     if countNonFinite is 0
+ *                              1 for each non-finite (NaN or inf) voxel  otherwise
+ *   The non-finite voxels are counted as 0 in the sum of im2^2, so that a single NaN (e.g., a missing
+ *   slice) does not spread to all the entries after it: the windows that contain one are found with
+ *   the second table instead.
+ *   Returns the number of non-finite voxels of im2.
+ */
+static int integral_volume( int slic2, int rows2, int cols2, float* im2, int countNonFinite, double* sat )
+{
+    int index, k, j, i;
+    int satRows, satCols;
+    int nNonFinite;
+    float im2px;
+    double value;
+
+    satRows = rows2+1;
+    satCols = cols2+1;
+    nNonFinite = 0;
+
+    for (index=0; index<satRows*satCols; index++ ) sat[ index ] = 0;
+    for (k=0; k<slic2; k++ )
+    {
+      for (i=0; i<satCols; i++ ) sat[ (k+1)*satRows*satCols + i ] = 0;
+      for (j=0; j<rows2; j++ )
+      {
+        sat[ (k+1)*satRows*satCols + (j+1)*satCols ] = 0;
+        for (i=0; i<cols2; i++ )
+        {
+          im2px = im2[ k*rows2*cols2 + j*cols2 + i ];
+
+          // im2px - im2px is NaN for both NaN and inf (no isfinite() in old MSVC)
+          if ( im2px - im2px == 0 )
+            value = ( countNonFinite ? 0 : im2px * im2px );
+          else
+          {
+            value = ( countNonFinite ? 1 : 0 );
+            nNonFinite++;
+          }
+
+          sat[ (k+1)*satRows*satCols + (j+1)*satCols + (i+1) ] = value
+                + sat[ (k  )*satRows*satCols + (j+1)*satCols + (i+1) ]
+                + sat[ (k+1)*satRows*satCols + (j  )*satCols + (i+1) ]
+                + sat[ (k+1)*satRows*satCols + (j+1)*satCols + (i  ) ]
+                - sat[ (k  )*satRows*satCols + (j  )*satCols + (i+1) ]
+                - sat[ (k  )*satRows*satCols + (j+1)*satCols + (i  ) ]
+                - sat[ (k+1)*satRows*satCols + (j  )*satCols + (i  ) ]
+                + sat[ (k  )*satRows*satCols + (j  )*satCols + (i  ) ];
+        }
+      }
+    }
+
+    return nNonFinite;
+}
+
+
+/* Sum of the integral volume sat (see integral_volume()) over the box [z..z+slic1-1, y..y+rows1-1, x..x+cols1-1] */
+static double box_sum( double* sat, int rows2, int cols2,\
+                       int z, int y, int x, int slic1, int rows1, int cols1 )
+{
+    int satRows, satCols;
+
+    satRows = rows2+1;
+    satCols = cols2+1;
+
+    return   sat[ (z+slic1)*satRows*satCols + (y+rows1)*satCols + (x+cols1) ]
+           - sat[ (z      )*satRows*satCols + (y+rows1)*satCols + (x+cols1) ]
+           - sat[ (z+slic1)*satRows*satCols + (y      )*satCols + (x+cols1) ]
+           - sat[ (z+slic1)*satRows*satCols + (y+rows1)*satCols + (x      ) ]
+           + sat[ (z      )*satRows*satCols + (y      )*satCols + (x+cols1) ]
+           + sat[ (z      )*satRows*satCols + (y+rows1)*satCols + (x      ) ]
+           + sat[ (z+slic1)*satRows*satCols + (y      )*satCols + (x      ) ]
+           - sat[ (z      )*satRows*satCols + (y      )*satCols + (x      ) ];
+}
+
+
+/* Same search as pixel_search() above, but the two energy terms are not recalculated for every
+ *   position of the window:
+ *    - b = sum( im1^2 ) does not depend on the position, it is calculated once
+ *    - c = sum( im2^2 ) under the window is read from an integral volume (summed-area table)
+ *        of im2^2, built once for the node.
+ *   Only the cross term a = sum( im1 * im2 ) is left in the inner loop.
+ *
+ * If ccMap is not NULL the CC of every position is also written into it
+ *   (dimensions slic2-slic1+1, rows2-rows1+1, cols2-cols1+1).
+ */
+static void sat_search( int slic1, int rows1, int cols1, float* im1,\
+                        int slic2, int rows2, int cols2, float* im2,\
+                        float* ccMap, float* argoutdata )
+{
+    // int variable to build index to 1D-images from x,y,z coordinates
+    int index1, index2;
+
+    // loop variables for 3D search range
+    int z, y, x;
+
+    // loop variables for 3D CC calculation
+    int k, j, i;
+
+    // three components to our NCC calculation
+    double a,b,c;
+
+    // empty variables for each pixel of our 3D image
+    float im1px;
+
+    // Variable to assemble NCC into.
+    float cc;
+
+    // Maximum variables, for tracking the best NCC so far...
+    int z_max, y_max, x_max;
+    float cc_max;
+
+    // Integral volumes of im2^2 and of the non-finite voxels of im2 (see integral_volume()),
+    //   the second one is only built if im2 has non-finite voxels
+    double* sat;
+    double* nonFinite;
+    int satRows, satCols;
+    int satSize;
+
+    // Initialization AFTER declaration for MSVC great compiler
+    a = b = c = 0;
+    z_max = y_max = x_max = 0;
+    cc_max = 0;
+    nonFinite = NULL;
+
+    satRows = rows2+1;
+    satCols = cols2+1;
+    satSize = (slic2+1)*satRows*satCols;
+
+    sat = (double*) malloc( satSize*sizeof(double) );
+    if ( sat == NULL )
+    {
+        // Not enough memory for the integral volume, do the search the old way
+        //   (the map cannot be filled in this case, it is left as it is)
+        pixel_search( slic1, rows1, cols1, im1, slic2, rows2, cols2, im2, 4, argoutdata );
+        return;
+    }
+
+    /* --- Build the integral volume of im2^2, and the one of the non-finite voxels if there are any --- */
+    if ( integral_volume( slic2, rows2, cols2, im2, 0, sat ) > 0 )
+    {
+        nonFinite = (double*) malloc( satSize*sizeof(double) );
+        if ( nonFinite == NULL )
+        {
+            free( sat );
+            pixel_search( slic1, rows1, cols1, im1, slic2, rows2, cols2, im2, 4, argoutdata );
+            return;
+        }
+        integral_volume( slic2, rows2, cols2, im2, 1, nonFinite );
+    }
+
+    // --- b is constant, same loop order as pixel_search() ---
+    for (index1=0; index1<slic1*rows1*cols1; index1++ )
+    {
+      im1px = im1[ index1 ];
+      b = b + im1px * im1px;
+    }
+
+    for (z=0; z<=slic2-slic1; z++ )
+    {
+      for (y=0; y<=rows2-rows1; y++ )
+      {
+        for (x=0; x<=cols2-cols1; x++ )
+        {
+          // reset calculations
+          a = 0;
+
+          // Cross term only
+          for (k=0; k<slic1; k++ )
+          {
+            for (j=0; j<rows1; j++ )
+            {
+              index1 =   k  *rows1*cols1 +   j  *cols1;
+              index2 = (k+z)*rows2*cols2 + (j+y)*cols2 + x;
+              for (i=0; i<cols1; i++ )
+              {
+                a = a + im1[ index1+i ] * im2[ index2+i ];
+              }
+            }
+          }
+
+          // c from the integral volume, box [z..z+slic1-1, y..y+rows1-1, x..x+cols1-1]
+          c =   sat[ (z+slic1)*satRows*satCols + (y+rows1)*satCols + (x+cols1) ]
+              - sat[ (z      )*satRows*satCols + (y+rows1)*satCols + (x+cols1) ]
+              - sat[ (z+slic1)*satRows*satCols + (y      )*satCols + (x+cols1) ]
+              - sat[ (z+slic1)*satRows*satCols + (y+rows1)*satCols + (x      ) ]
+              + sat[ (z      )*satRows*satCols + (y      )*satCols + (x+cols1) ]
+              + sat[ (z      )*satRows*satCols + (y+rows1)*satCols + (x      ) ]
+              + sat[ (z+slic1)*satRows*satCols + (y      )*satCols + (x      ) ]
+              - sat[ (z      )*satRows*satCols + (y      )*satCols + (x      ) ];
+
+          // The differences can go slightly negative by rounding when im2 is (close to) zero
+          if ( c < 0 ) c = 0;
+
+          // Window with a NaN or inf: as in pixel_search() the CC is not a number, so the position is never the maximum
+          if ( nonFinite != NULL && box_sum( nonFinite, rows2, cols2, z, y, x, slic1, rows1, cols1 ) > 0.5 ) c = HUGE_VAL;
+
+          cc = a / sqrt( b * c);
+
+          if ( ccMap != NULL ) ccMap[ z*(rows2-rows1+1)*(cols2-cols1+1) + y*(cols2-cols1+1) + x ] = cc;
+
+          // If this cc is higher than the previous best, update our best...
+          if ( cc > cc_max )
+          {
+            x_max   = x;
+            y_max   = y;
+            z_max   = z;
+            cc_max  = cc;
+          }
+        }
+      }
+    }
+
+    free( sat );
+    free( nonFinite );
+
+    argoutdata[ 0 ] = (float) z_max;
+    argoutdata[ 1 ] = (float) y_max;
+    argoutdata[ 2 ] = (float) x_max;
+    argoutdata[ 3 ] = cc_max;
+}
+
+
+/* Summed-area-table search, same inputs and returns as pixel_search() */
+void pixel_search_sat(  int slic1, int rows1, int cols1, float* im1,\
+                        int slic2, int rows2, int cols2, float* im2,\
+                        int n1, float* argoutdata )
+{
+    sat_search( slic1, rows1, cols1, im1, slic2, rows2, cols2, im2, NULL, argoutdata );
+}
+
+
+/* Summed-area-table search which also returns the CC of every position in ccMap
+ *   (a 3D numpy array prepared on the python side, that has to have the dimensions
+ *    of the search range, otherwise it is not filled)
+ */
+void pixel_search_sat_map(  int slic1, int rows1, int cols1, float* im1,\
+                            int slic2, int rows2, int cols2, float* im2,\
+                            int slicm, int rowsm, int colsm, float* ccMap,\
+                            int n1, float* argoutdata )
+{
+    if ( slicm != slic2-slic1+1 || rowsm != rows2-rows1+1 || colsm != cols2-cols1+1 )
+        ccMap = NULL;
+
+    sat_search( slic1, rows1, cols1, im1, slic2, rows2, cols2, im2, ccMap, argoutdata );
+}
+
+
+/* Same search as pixel_search() above, with early termination of the hopeless positions.
+ *
+ *   After the first k z-planes of the window, the cross term of the remaining planes is bounded
+ *   by Cauchy-Schwarz:  a_rest <= sqrt( b_rest * c_rest ), where b_rest = sum( im1^2 ) and
+ *   c_rest = sum( im2^2 ) over the remaining planes (c_rest is read from an integral volume of im2^2).
+ *   So the CC of this position cannot be more than ( a_k + sqrt( b_rest * c_rest ) ) / sqrt( b * c ),
+ *   and if this is below the best CC so far the position is abandoned.
+ *
+ *   The positions that are not abandoned are calculated exactly as in pixel_search(), and
+ *   the bound is only trusted with a small relative margin (PRUNING_MARGIN) for rounding,
+ *   so the result is identical to the exhaustive search.
+ *
+ *   Returns the number of positions abandoned, -1 if the integral volume could not be allocated
+ *   (in which case the exhaustive search is done).
+ */
+#define PRUNING_MARGIN 1e-6
+
+static int pruned_search( int slic1, int rows1, int cols1, float* im1,\
+                          int slic2, int rows2, int cols2, float* im2,\
+                          float* argoutdata )
+{
+    int index1, index2;
+    int z, y, x;
+    int k, j, i;
+    double a,b,c;
+    float im1px, im2px;
+    float cc;
+    int z_max, y_max, x_max;
+    float cc_max;
+
+    // Integral volume of im2^2 (see sat_search()) and sum( im1^2 ) of the planes k..slic1-1 of im1
+    double* sat;
+    double* bRest;
+    int satRows, satCols;
+    int satSize;
+    double cRest, denominator;
+    int pruned, nPruned;
+
+    a = b = c = 0;
+    z_max = y_max = x_max = 0;
+    cc_max = 0;
+    nPruned = 0;
+
+    satRows = rows2+1;
+    satCols = cols2+1;
+    satSize = (slic2+1)*satRows*satCols;
+
+    sat   = (double*) malloc( satSize*sizeof(double) );
+    bRest = (double*) malloc( (slic1+1)*sizeof(double) );
+    if ( sat == NULL || bRest == NULL )
+    {
+        free( sat );
+        free( bRest );
+        pixel_search( slic1, rows1, cols1, im1, slic2, rows2, cols2, im2, 4, argoutdata );
+        return -1;
+    }
+
+    /* The non-finite voxels of im2 are counted as 0 here: the windows that contain one have a cross term
+         that is not a number, so they are never abandoned, and never the maximum, as in pixel_search() */
+    integral_volume( slic2, rows2, cols2, im2, 0, sat );
+
+    // b in the same order as pixel_search(), so that it is exactly the same value
+    for (index1=0; index1<slic1*rows1*cols1; index1++ )
+    {
+      im1px = im1[ index1 ];
+      b = b + im1px * im1px;
+    }
+
+    bRest[ slic1 ] = 0;
+    for (k=slic1-1; k>=0; k-- )
+    {
+      bRest[ k ] = bRest[ k+1 ];
+      for (index1=k*rows1*cols1; index1<(k+1)*rows1*cols1; index1++ )
+        bRest[ k ] = bRest[ k ] + im1[ index1 ] * im1[ index1 ];
+    }
+
+    for (z=0; z<=slic2-slic1; z++ )
+    {
+      for (y=0; y<=rows2-rows1; y++ )
+      {
+        for (x=0; x<=cols2-cols1; x++ )
+        {
+          a = c = 0;
+          pruned = 0;
+
+          // c of the whole window, used for the denominator of the bound
+          denominator =   sat[ (z+slic1)*satRows*satCols + (y+rows1)*satCols + (x+cols1) ]
+                        - sat[ (z      )*satRows*satCols + (y+rows1)*satCols + (x+cols1) ]
+                        - sat[ (z+slic1)*satRows*satCols + (y      )*satCols + (x+cols1) ]
+                        - sat[ (z+slic1)*satRows*satCols + (y+rows1)*satCols + (x      ) ]
+                        + sat[ (z      )*satRows*satCols + (y      )*satCols + (x+cols1) ]
+                        + sat[ (z      )*satRows*satCols + (y+rows1)*satCols + (x      ) ]
+                        + sat[ (z+slic1)*satRows*satCols + (y      )*satCols + (x      ) ]
+                        - sat[ (z      )*satRows*satCols + (y      )*satCols + (x      ) ];
+          if ( denominator < 0 ) denominator = 0;
+          denominator = sqrt( b * denominator );
+
+          for (k=0; k<slic1; k++ )
+          {
+            // Bound on the CC with the planes 0..k-1 done (nothing to gain before the first plane, or if cc_max is 0)
+            if ( k > 0 && cc_max > 0 && denominator > 0 )
+            {
+              cRest =   sat[ (z+slic1)*satRows*satCols + (y+rows1)*satCols + (x+cols1) ]
+                      - sat[ (z+k    )*satRows*satCols + (y+rows1)*satCols + (x+cols1) ]
+                      - sat[ (z+slic1)*satRows*satCols + (y      )*satCols + (x+cols1) ]
+                      - sat[ (z+slic1)*satRows*satCols + (y+rows1)*satCols + (x      ) ]
+                      + sat[ (z+k    )*satRows*satCols + (y      )*satCols + (x+cols1) ]
+                      + sat[ (z+k    )*satRows*satCols + (y+rows1)*satCols + (x      ) ]
+                      + sat[ (z+slic1)*satRows*satCols + (y      )*satCols + (x      ) ]
+                      - sat[ (z+k    )*satRows*satCols + (y      )*satCols + (x      ) ];
+              if ( cRest < 0 ) cRest = 0;
+
+              if ( ( a + sqrt( bRest[ k ] * cRest ) ) / denominator * ( 1 + PRUNING_MARGIN ) < cc_max )
+              {
+                pruned = 1;
+                break;
+              }
+            }
+
+            for (j=0; j<rows1; j++ )
+            {
+              for (i=0; i<cols1; i++ )
+              {
+                index1 =   k  *rows1*cols1 +   j  *cols1 +   i;
+                index2 = (k+z)*rows2*cols2 + (j+y)*cols2 + (i+x);
+
+                im1px = im1[ index1 ];
+                im2px = im2[ index2 ];
+
+                a = a +    im1px * im2px;
+                c = c +    im2px * im2px;
+              }
+            }
+          }
+
+          if ( pruned )
+          {
+            nPruned++;
+            continue;
+          }
+
+          cc = a / sqrt( b * c);
+
+          if ( cc > cc_max )
+          {
+            x_max   = x;
+            y_max   = y;
+            z_max   = z;
+            cc_max  = cc;
+          }
+        }
+      }
+    }
+
+    free( sat );
+    free( bRest );
+
+    argoutdata[ 0 ] = (float) z_max;
+    argoutdata[ 1 ] = (float) y_max;
+    argoutdata[ 2 ] = (float) x_max;
+    argoutdata[ 3 ] = cc_max;
+
+    return nPruned;
+}
+
+
+/* Search with early termination (see pruned_search()), same inputs and returns as pixel_search(),
+ *   plus the number of positions abandoned in argoutdata[ 4 ] if n1 >= 5
+ */
+void pixel_search_pruned(  int slic1, int rows1, int cols1, float* im1,\
+                           int slic2, int rows2, int cols2, float* im2,\
+                           int n1, float* argoutdata )
+{
+    int nPruned;
+
+    nPruned = pruned_search( slic1, rows1, cols1, im1, slic2, rows2, cols2, im2, argoutdata );
+
+    if ( n1 >= 5 ) argoutdata[ 4 ] = (float) nPruned;
+}
+
+
+/* CC of im1 with the window of im2 at offset z, y, x, calculated exactly as in pixel_search().
+ *   Returns 0 if the window does not fit in im2.
+ */
+static float window_cc( int slic1, int rows1, int cols1, float* im1,\
+                        int slic2, int rows2, int cols2, float* im2,\
+                        int z, int y, int x )
+{
+    int index1, index2;
+    int k, j, i;
+    double a,b,c;
+    float im1px, im2px;
+
+    if ( z < 0 || y < 0 || x < 0 || z > slic2-slic1 || y > rows2-rows1 || x > cols2-cols1 )
+        return 0;
+
+    a = b = c = 0;
+    for (k=0; k<slic1; k++ )
+    {
+      for (j=0; j<rows1; j++ )
+      {
+        for (i=0; i<cols1; i++ )
+        {
+          index1 =   k  *rows1*cols1 +   j  *cols1 +   i;
+          index2 = (k+z)*rows2*cols2 + (j+y)*cols2 + (i+x);
+
+          im1px = im1[ index1 ];
+          im2px = im2[ index2 ];
+
+          a = a +    im1px * im2px;
+          b = b +    im1px * im1px;
+          c = c +    im2px * im2px;
+        }
+      }
+    }
+
+    return (float) ( a / sqrt( b * c) );
+}
+
+
+/* Pixel search of N nodes in one call.
+ *
+ * Inputs (python side):
+ *    - im1Stack (1D numpy array) -- all the im1 of the nodes one after the other
+ *    - im2Stack (1D numpy array) -- all the im2 of the nodes one after the other
+ *    - offsets  (2D numpy int array, N x 8) -- for each node:
+ *         [ start of im1 in im1Stack, slic1, rows1, cols1, start of im2 in im2Stack, slic2, rows2, cols2 ]
+ *    - neighbourhoods (2D numpy array, N x 27) -- filled with the 3x3x3 CC values around the maximum
+ *         of each node (0 where the position is outside the search range). Not filled if the
+ *         dimensions are not N x 27.
+ *    - searchMode: 0 for the direct search, 1 for the summed-area-table search, 2 for the search
+ *        with early termination
+ *    - n1 = 4*N
+ *
+ * Returns:
+ *    - z, y, x, cc of each node one after the other, as for pixel_search(). A node with
+ *        inconsistent offsets (window outside of the stacks) returns 0, 0, 0, 0.
+ */
+void pixel_search_batch(  int n1a, float* im1Stack,\
+                          int n2a, float* im2Stack,\
+                          int nNodes, int nFields, int* offsets,\
+                          int nNodesNb, int nFieldsNb, float* neighbourhoods,\
+                          int searchMode,\
+                          int n1, float* argoutdata )
+{
+    int node, field;
+    int start1, slic1, rows1, cols1;
+    int start2, slic2, rows2, cols2;
+    int z, y, x;
+    float* returns;
+    float* neighbourhood;
+
+    if ( nNodesNb != nNodes || nFieldsNb != 27 ) neighbourhoods = NULL;
+
+    for ( node=0; node<n1/4; node++ )
+    {
+      returns = argoutdata + 4*node;
+      for ( field=0; field<4; field++ ) returns[ field ] = 0;
+
+      if ( nFields != 8 || node >= nNodes ) continue;
+
+      start1 = offsets[ 8*node     ];
+      slic1  = offsets[ 8*node + 1 ];
+      rows1  = offsets[ 8*node + 2 ];
+      cols1  = offsets[ 8*node + 3 ];
+      start2 = offsets[ 8*node + 4 ];
+      slic2  = offsets[ 8*node + 5 ];
+      rows2  = offsets[ 8*node + 6 ];
+      cols2  = offsets[ 8*node + 7 ];
+
+      // Check that both windows are inside the stacks, and that im1 fits in im2
+      if ( start1 < 0 || start2 < 0 || slic1 < 1 || rows1 < 1 || cols1 < 1 ||
+           start1 + slic1*rows1*cols1 > n1a || start2 + slic2*rows2*cols2 > n2a ||
+           slic2 < slic1 || rows2 < rows1 || cols2 < cols1 )
+        continue;
+
+      if ( searchMode == 1 )
+        sat_search(   slic1, rows1, cols1, im1Stack + start1, slic2, rows2, cols2, im2Stack + start2, NULL, returns );
+      else if ( searchMode == 2 )
+        pruned_search( slic1, rows1, cols1, im1Stack + start1, slic2, rows2, cols2, im2Stack + start2, returns );
+      else
+        pixel_search( slic1, rows1, cols1, im1Stack + start1, slic2, rows2, cols2, im2Stack + start2, 4, returns );
+
+      if ( neighbourhoods != NULL )
+      {
+        neighbourhood = neighbourhoods + 27*node;
+        for ( z=-1; z<=1; z++ )
+          for ( y=-1; y<=1; y++ )
+            for ( x=-1; x<=1; x++ )
+              neighbourhood[ (z+1)*9 + (y+1)*3 + (x+1) ] = window_cc( slic1, rows1, cols1, im1Stack + start1,\
+                                                                      slic2, rows2, cols2, im2Stack + start2,\
+                                                                      (int) returns[0] + z, (int) returns[1] + y, (int) returns[2] + x );
+      }
+    }
+}
@@ -1,2 +1,6 @@
 
 void pixel_search(int h1, int w1, int d1, float* im1, int h2, int w2, int d2, float* im2, int n1, float* argoutdata );
+void pixel_search_sat(int h1, int w1, int d1, float* im1, int h2, int w2, int d2, float* im2, int n1, float* argoutdata );
+void pixel_search_sat_map(int h1, int w1, int d1, float* im1, int h2, int w2, int d2, float* im2, int h3, int w3, int d3, float* ccMap, int n1, float* argoutdata );
+void pixel_search_pruned(int h1, int w1, int d1, float* im1, int h2, int w2, int d2, float* im2, int n1, float* argoutdata );
+void pixel_search_batch(int n1a, float* im1Stack, int n2a, float* im2Stack, int nNodes, int nFields, int* offsets, int nNodesNb, int nFieldsNb, float* neighbourhoods, int searchMode, int n1, float* argoutdata );
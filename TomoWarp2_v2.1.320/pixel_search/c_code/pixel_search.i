@@ -12,8 +12,21 @@
 import_array();
 %}
 
+/* The C functions do not touch any python object, so the GIL is released while they run:
+     the threads of a DIC_worker (threadsPerWorker) can then search in parallel */
+%exception {
+    Py_BEGIN_ALLOW_THREADS
+    $action
+    Py_END_ALLOW_THREADS
+}
+
 %apply (int DIM1, int DIM2, int DIM3, float* IN_ARRAY3) {(int h1, int w1, int d1, float *im1)};
 %apply (int DIM1, int DIM2, int DIM3, float* IN_ARRAY3) {(int h2, int w2, int d2, float *im2)};
+%apply (int DIM1, int DIM2, int DIM3, float* INPLACE_ARRAY3) {(int h3, int w3, int d3, float *ccMap)};
+%apply (int DIM1, float* IN_ARRAY1) {(int n1a, float *im1Stack)};
+%apply (int DIM1, float* IN_ARRAY1) {(int n2a, float *im2Stack)};
+%apply (int DIM1, int DIM2, int* IN_ARRAY2) {(int nNodes, int nFields, int *offsets)};
+%apply (int DIM1, int DIM2, float* INPLACE_ARRAY2) {(int nNodesNb, int nFieldsNb, float *neighbourhoods)};
 %apply (int DIM1, float* ARGOUT_ARRAY1) {(int n1, float *argoutdata)};
 
 %include "pixel_search.h"
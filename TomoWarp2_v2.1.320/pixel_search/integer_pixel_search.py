@@ -0,0 +1,496 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016, Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+# This file is part of TomoWarp2.
+#
+# TomoWarp2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TomoWarp2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TomoWarp2.  If not, see <http://www.gnu.org/licenses/>.
+
+# ===================================================================
+# ===========================  TomoWarp2  ===========================
+# ===================================================================
+
+# Authors: Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+"""
+Integer pixel search with a selectable engine.
+
+  - "direct": the brute-force C-code in pixel_search.c, which is O( window * search )
+  - "sat":    the same search in C, but sum( im1**2 ) is calculated once and
+              sum( im2**2 ) under the window is read from an integral volume
+              (summed-area table), so only the cross term is left for each position
+  - "fft":    the whole NCC map is calculated in one pass, the numerator
+              sum( im1 * im2 ) from a product in the frequency domain and the
+              energy term sum( im2**2 ) under every position of the window from
+              running sums along each axis
+  - "pruned": the "direct" search, but each position is abandoned as soon as a Cauchy-Schwarz
+              bound on its CC (checked after each z-plane of the window) falls below the best
+              CC so far. The result is identical to "direct", and the C-code also gives the
+              number of positions abandoned (see pruned_pixel_search())
+  - "auto":   "fft" when the number of positions to test is large compared to
+              the size of the correlation window, "sat" otherwise
+
+The NCC is the same as in the C-code (not zero-mean):
+  cc = sum( im1 * im2 ) / sqrt( sum( im1**2 ) * sum( im2**2 ) )
+
+INPUTS:
+- im1 (3D numpy array) -- Reference Image -- small
+- im2 (3D numpy array) -- Search range of other image -- should be at least as big as im1
+- engine
+
+OUTPUTS:
+- [ z, y, x, cc ] of the maximum, as for pixel_search.pixel_search()
+  z, y, x are the offsets of the window in im2 (0, 0, 0 is the top corner of im2)
+- optionally the 3x3x3 (3x3 in 2D) CC values around the maximum, which are used
+  directly by the CC interpolation instead of recalculating them. They come from the CC map
+  for "fft" and "sat", and are calculated around the maximum found by the engine otherwise
+
+pyramid_pixel_search() does the same search coarse-to-fine: im1 and im2 are binned 2x
+  for each level, the whole search range is only tested on the coarsest images, and each
+  finer level only looks at +-PYRAMID_MARGIN pixels around the upscaled maxima of the
+  level above. The PYRAMID_CANDIDATES highest peaks of the coarsest level are followed down to the
+  full resolution, and the one with the highest CC there is kept.
+
+batch_integer_pixel_search() does the search for a list of nodes at once: for the "direct",
+  "sat" and "pruned" engines all the windows are put one after the other in two contiguous buffers and
+  searched in one call to the C-code (pixel_search_batch), which saves the python/C round
+  trip of each node when the windows are small.
+"""
+
+import numpy
+
+# This is our pixel_search C-code
+from pixel_search.c_code import pixel_search
+
+try:
+    from scipy.fftpack import next_fast_len
+except ImportError:
+    next_fast_len = None
+
+
+# Rough cost of the FFT engine, measured against one multiply-add of the "sat" search
+#   (see benchmark_pixel_search.py): a fixed cost for the python calls and allocations
+#   plus a cost per ( voxel of im2 * log2( voxels of im2 ) ). Used by "auto" only.
+FFT_COST_OFFSET = 2.0e5
+FFT_COST_FACTOR = 5.0
+
+# Half-size (in pixels of the finer level) of the search around the upscaled maximum of the
+#   coarser level. With a binning of 2 the coarse maximum is known within +-1 pixel, plus one
+#   pixel so that a maximum on the border of the refined search is a sign of disagreement.
+PYRAMID_MARGIN = 2
+
+# Number of peaks of the CC map of the coarsest level which are refined down to the full resolution.
+#   The maximum of the coarsest level is not always the right one: if another candidate ends with a higher CC
+#   it is taken instead, and the node is flagged.
+PYRAMID_CANDIDATES = 3
+
+# Engines that can be done by pixel_search_batch(), with the corresponding searchMode of the C-code
+BATCH_SEARCH_MODES = { "direct": 0, "sat": 1, "pruned": 2 }
+
+
+def select_pixel_search_engine( engine, im1Shape, im2Shape ):
+    # Decide which engine is used when "auto" is asked, comparing the cost of the direct (sat) search
+    #   (one multiply-add per voxel of the window and per position) with the cost of the FFTs
+    if engine != "auto":
+        return engine
+
+    im1Size    = numpy.prod( im1Shape )
+    im2Size    = numpy.prod( im2Shape )
+    nPositions = numpy.prod( numpy.array( im2Shape ) - numpy.array( im1Shape ) + 1 )
+
+    if im1Size * nPositions > FFT_COST_OFFSET + FFT_COST_FACTOR * im2Size * numpy.log2( max( im2Size, 2 ) ):
+        return "fft"
+    else:
+        return "sat"
+
+
+def _fft_shape( shape ):
+    if next_fast_len is None:
+        return tuple( shape )
+    return tuple( [ next_fast_len( int( n ) ) for n in shape ] )
+
+
+def window_sums( volume, windowShape ):
+    # Sum of "volume" under every position of a window of size windowShape which fits completely inside
+    #   "volume". This is done with a running sum (cumulative sum) along each axis in turn.
+    for axis, windowLength in enumerate( windowShape ):
+        cumulative = numpy.cumsum( volume, axis=axis )
+
+        padShape         = list( cumulative.shape )
+        padShape[ axis ] = 1
+        cumulative = numpy.concatenate( ( numpy.zeros( padShape, dtype=cumulative.dtype ), cumulative ), axis=axis )
+
+        upper = [ slice( None ) ] * cumulative.ndim
+        lower = [ slice( None ) ] * cumulative.ndim
+        upper[ axis ] = slice( windowLength, None )
+        lower[ axis ] = slice( None, -windowLength )
+        volume = cumulative[ tuple( upper ) ] - cumulative[ tuple( lower ) ]
+
+    return volume
+
+
+def fft_cc_map( im1, im2 ):
+    # Returns the NCC for every position of im1 inside im2
+    im1 = numpy.asarray( im1, dtype='<f8' )
+    im2 = numpy.asarray( im2, dtype='<f8' )
+
+    mapShape  = tuple( numpy.array( im2.shape ) - numpy.array( im1.shape ) + 1 )
+    fftShape  = _fft_shape( im2.shape )
+
+    # Numerator: correlation of im2 with im1 (im1 zero-padded to the size of im2).
+    #   Since im1 fits inside im2 the positions that we keep never wrap around.
+    numerator = numpy.fft.irfftn( numpy.fft.rfftn( im2, fftShape ) * numpy.conj( numpy.fft.rfftn( im1, fftShape ) ), fftShape )
+    numerator = numerator[ :mapShape[0], :mapShape[1], :mapShape[2] ]
+
+    # Energy term of im2 under each position of the window, and of im1 (constant)
+    im2Energy = numpy.maximum( window_sums( im2 * im2, im1.shape ), 0 )
+    im1Energy = ( im1 * im1 ).sum()
+
+    denominator = numpy.sqrt( im1Energy * im2Energy )
+
+    ccMap = numpy.zeros( mapShape, dtype='<f8' )
+    numpy.divide( numerator, denominator, out=ccMap, where=denominator > 0 )
+
+    return ccMap
+
+
+def max_of_cc_map( ccMap ):
+    returns = numpy.zeros( 4, dtype='<f4' )
+
+    # Like the C-code: the first strict maximum (z-first) above 0, otherwise 0, 0, 0, 0
+    maxIndex = numpy.argmax( ccMap )
+    if ccMap.flat[ maxIndex ] > 0:
+        returns[0:3] = numpy.unravel_index( maxIndex, ccMap.shape )
+        returns[3]   = ccMap.flat[ maxIndex ]
+
+    return returns
+
+
+def fft_pixel_search( im1, im2 ):
+    # NaNs (e.g., missing slices) would spread over the whole map in the FFT, while
+    #   the C-code just skips the positions concerned. Leave these cases to the C-code.
+    if not ( numpy.isfinite( im1 ).all() and numpy.isfinite( im2 ).all() ):
+        return pixel_search.pixel_search( im1, im2, 4 )
+
+    return max_of_cc_map( fft_cc_map( im1, im2 ) )
+
+
+def pruned_pixel_search( im1, im2 ):
+    # Search with early termination, returns [ [ z, y, x, cc ], number of positions abandoned ]
+    #   (the number is -1 if the C-code could not allocate its integral volume and did the full search)
+    returns = pixel_search.pixel_search_pruned( im1, im2, 5 )
+    return [ returns[0:4], int( returns[4] ) ]
+
+
+def cc_map_pixel_search( im1, im2, engine ):
+    # Pixel search that also returns the CC of every position tested.
+    #   The map comes from the FFT for "fft", and from the summed-area-table C-code otherwise.
+    if engine == "fft" and numpy.isfinite( im1 ).all() and numpy.isfinite( im2 ).all():
+        ccMap = fft_cc_map( im1, im2 )
+        return max_of_cc_map( ccMap ), ccMap
+
+    ccMap   = numpy.zeros( tuple( numpy.array( im2.shape ) - numpy.array( im1.shape ) + 1 ), dtype='<f4' )
+    returns = pixel_search.pixel_search_sat_map( im1, im2, ccMap, 4 )
+
+    return returns, ccMap
+
+
+def cc_neighbourhood( ccMap, position, twoD=False ):
+    # 3x3x3 CC values around "position" in ccMap (3x3 in 2D).
+    #   None if the position is on the edge of the map, i.e., the neighbourhood is not complete.
+    position = numpy.array( position, dtype=int )
+
+    if twoD:
+        if any( position[1:3] < 1 ) or any( position[1:3] > numpy.array( ccMap.shape[1:3] ) - 2 ):
+            return None
+        return ccMap[ 0, position[1]-1:position[1]+2, position[2]-1:position[2]+2 ].astype( '<f8' )
+
+    if any( position < 1 ) or any( position > numpy.array( ccMap.shape ) - 2 ):
+        return None
+    return ccMap[ position[0]-1:position[0]+2, position[1]-1:position[1]+2, position[2]-1:position[2]+2 ].astype( '<f8' )
+
+
+def batch_neighbourhood( neighbourhood, position, im1Shape, im2Shape ):
+    # Same neighbourhood as cc_neighbourhood() would take from the CC map, from the 27 CC values
+    #   around the maximum calculated by pixel_search_batch()
+    mapShape = numpy.array( im2Shape ) - numpy.array( im1Shape ) + 1
+    twoD     = ( im1Shape[0] == 1 and im2Shape[0] == 1 )
+    position = numpy.array( position, dtype=int )
+    cube     = neighbourhood.reshape( 3, 3, 3 ).astype( '<f8' )
+
+    if twoD:
+        if any( position[1:3] < 1 ) or any( position[1:3] > mapShape[1:3] - 2 ):
+            return None
+        return cube[ 1 ]
+
+    if any( position < 1 ) or any( position > mapShape - 2 ):
+        return None
+    return cube
+
+
+def integer_pixel_search( im1, im2, engine="direct", returnNeighbourhood=False ):
+    # If returnNeighbourhood is set, returns [ [ z, y, x, cc ], neighbourhood ], where neighbourhood
+    #   is the 3x3x3 (or 3x3 in 2D) CC values around the maximum that can be given directly to the
+    #   CC interpolation, or None if the maximum is on the edge of the search range.
+
+    engine = select_pixel_search_engine( engine, im1.shape, im2.shape )
+
+    if returnNeighbourhood:
+        # The "fft" and "sat" engines calculate the whole CC map anyway, the neighbourhood is taken from it.
+        #   The other engines (and "fft" on images with NaNs, which is done by the direct C-code) do their own
+        #   search, and the CC of the 26 positions around the maximum is calculated as in pixel_search.c
+        if engine == "sat" or ( engine == "fft" and numpy.isfinite( im1 ).all() and numpy.isfinite( im2 ).all() ):
+            returns, ccMap = cc_map_pixel_search( im1, im2, engine )
+            twoD = ( im1.shape[0] == 1 and im2.shape[0] == 1 )
+            return [ returns, cc_neighbourhood( ccMap, returns[0:3], twoD ) ]
+
+        if engine == "fft":
+            engine = "direct"
+        elif engine not in BATCH_SEARCH_MODES:
+            raise Exception( "integer_pixel_search(): pixel search engine \"{}\" unknown".format( engine ) )
+
+        im1Stack, im2Stack, offsets = stack_windows( [ im1 ], [ im2 ] )
+        neighbourhoods = numpy.zeros( ( 1, 27 ), dtype='<f4' )
+        returns = pixel_search_batch( im1Stack, im2Stack, offsets, engine, neighbourhoods )[0]
+        return [ returns, batch_neighbourhood( neighbourhoods[0], returns[0:3], im1.shape, im2.shape ) ]
+
+    if engine == "fft":
+        return fft_pixel_search( im1, im2 )
+
+    elif engine == "sat":
+        return pixel_search.pixel_search_sat( im1, im2, 4 )
+
+    elif engine == "direct":
+        return pixel_search.pixel_search( im1, im2, 4 )
+
+    elif engine == "pruned":
+        return pruned_pixel_search( im1, im2 )[0]
+
+    else:
+        raise Exception( "integer_pixel_search(): pixel search engine \"{}\" unknown".format( engine ) )
+
+
+def bin_volume( volume, binning ):
+    # Average of blocks of binning[0] x binning[1] x binning[2] voxels, the leftovers at the end of each axis are dropped
+    binning = numpy.array( binning, dtype=int )
+    shape   = numpy.array( volume.shape ) // binning
+
+    volume = numpy.asarray( volume, dtype='<f4' )[ 0:shape[0]*binning[0], 0:shape[1]*binning[1], 0:shape[2]*binning[2] ]
+    volume = volume.reshape( shape[0], binning[0], shape[1], binning[1], shape[2], binning[2] )
+
+    return volume.mean( axis=( 1, 3, 5 ) ).astype( '<f4' )
+
+
+def pyramid_binning( im1Shape, im2Shape ):
+    # Only bin the axes on which the binned correlation window is still at least 2 pixels
+    #   (in 2D the z-axis is never binned)
+    im1Dim = numpy.array( im1Shape )
+    return numpy.where( ( im1Dim >= 4 ) & ( numpy.array( im2Shape ) - im1Dim >= 2 ), 2, 1 )
+
+
+def pyramid_candidates( ccMap, nCandidates ):
+    # Positions of the nCandidates highest maxima of ccMap above 0, best first. Each maximum hides the
+    #   positions within +-PYRAMID_MARGIN around it, so that the candidates are distinct peaks.
+    ccMap      = numpy.array( ccMap, dtype='<f8' )
+    ccMap[ ~numpy.isfinite( ccMap ) ] = 0
+    candidates = []
+
+    while len( candidates ) < nCandidates:
+        maxIndex = numpy.argmax( ccMap )
+        if ccMap.flat[ maxIndex ] <= 0:
+            break
+
+        position = numpy.array( numpy.unravel_index( maxIndex, ccMap.shape ) )
+        candidates.append( numpy.append( position, ccMap.flat[ maxIndex ] ).astype( '<f4' ) )
+
+        low  = numpy.maximum( position - PYRAMID_MARGIN, 0 )
+        high = position + PYRAMID_MARGIN + 1
+        ccMap[ low[0]:high[0], low[1]:high[1], low[2]:high[2] ] = 0
+
+    return candidates
+
+
+def bounded_pixel_search( im1, im2, centre, margin, engine, returnNeighbourhood=False ):
+    # Search of im1 in im2 only +-margin around centre, returns [ [ z, y, x, cc ] in im2, neighbourhood, onBorder ]
+    #   where onBorder is True if the maximum is on the border of the bounded search, but not on the border of im2
+    im1Dim    = numpy.array( im1.shape )
+    maxOffset = numpy.array( im2.shape ) - im1Dim
+    low       = numpy.clip( centre - margin, 0, maxOffset )
+    high      = numpy.clip( centre + margin, 0, maxOffset )
+
+    im2Local = im2[ low[0]:high[0]+im1Dim[0], low[1]:high[1]+im1Dim[1], low[2]:high[2]+im1Dim[2] ]
+
+    if returnNeighbourhood:
+        returns, neighbourhood = integer_pixel_search( im1, im2Local, engine, returnNeighbourhood=True )
+    else:
+        returns, neighbourhood = integer_pixel_search( im1, im2Local, engine ), None
+    returns = numpy.array( returns, dtype='<f4' )
+
+    onBorder = False
+    if returns[3] > 0:
+        position = numpy.array( returns[0:3], dtype=int ) + low
+        returns[0:3] = position
+        onBorder = bool( ( ( ( position == low ) & ( low > 0 ) ) | ( ( position == high ) & ( high < maxOffset ) ) ).any() )
+
+    return [ returns, neighbourhood, onBorder ]
+
+
+def pyramid_search_levels( im1, im2, levels, engine ):
+    # Candidates of the coarse-to-fine search at the resolution of im1 and im2, as a list of [ z, y, x, cc ]
+    #   (the first one is the refinement of the maximum of the coarsest level), and whether the refinement
+    #   of the first candidate ended on the border of its bounded search at any level
+    binning = pyramid_binning( im1.shape, im2.shape )
+
+    if levels <= 0 or not ( binning > 1 ).any():
+        returns, ccMap = cc_map_pixel_search( im1, im2, engine )
+        return pyramid_candidates( ccMap, PYRAMID_CANDIDATES ), False
+
+    coarseCandidates, disagreement = pyramid_search_levels( bin_volume( im1, binning ), bin_volume( im2, binning ), levels - 1, engine )
+
+    margin     = numpy.where( binning > 1, PYRAMID_MARGIN, 1 )
+    candidates = []
+    for n, coarse in enumerate( coarseCandidates ):
+        returns, _, onBorder = bounded_pixel_search( im1, im2, numpy.array( coarse[0:3], dtype=int ) * binning, margin, engine )
+        if n == 0:
+            disagreement = disagreement or onBorder
+        if returns[3] > 0:
+            candidates.append( returns )
+
+    return candidates, disagreement
+
+
+def pyramid_pixel_search( im1, im2, levels, engine="direct", returnNeighbourhood=False ):
+    # Coarse-to-fine integer pixel search with "levels" levels of 2x binning above the full resolution.
+    # Returns [ [ z, y, x, cc ], neighbourhood, disagreement ], where neighbourhood is as in
+    #   integer_pixel_search() (None if not asked) and disagreement is True if the coarse and the fine
+    #   maxima do not agree: either the maximum found at some level was on the border of the search
+    #   around the coarse maximum, or one of the other PYRAMID_CANDIDATES - 1 peaks of the coarsest level,
+    #   refined down to the full resolution, has a higher CC. The best of the candidates is returned.
+    #   Wrong peaks which were not among the coarse candidates are not seen, so the flag is not exhaustive.
+    binning = pyramid_binning( im1.shape, im2.shape )
+
+    if levels <= 0 or not ( binning > 1 ).any():
+        if returnNeighbourhood:
+            returns, neighbourhood = integer_pixel_search( im1, im2, engine, returnNeighbourhood=True )
+        else:
+            returns, neighbourhood = integer_pixel_search( im1, im2, engine ), None
+        return [ returns, neighbourhood, False ]
+
+    coarseCandidates, disagreement = pyramid_search_levels( bin_volume( im1, binning ), bin_volume( im2, binning ), levels - 1, engine )
+
+    # No maximum found on the binned images (e.g., NaNs), search the whole range at this level
+    if len( coarseCandidates ) == 0:
+        return pyramid_pixel_search( im1, im2, 0, engine, returnNeighbourhood )
+
+    # Bounded search at full resolution around each upscaled coarse candidate
+    margin = numpy.where( binning > 1, PYRAMID_MARGIN, 1 )
+    best   = None
+    for n, coarse in enumerate( coarseCandidates ):
+        returns, neighbourhood, onBorder = bounded_pixel_search( im1, im2, numpy.array( coarse[0:3], dtype=int ) * binning, margin, \
+                                                                 engine, returnNeighbourhood )
+        if n == 0:
+            disagreement = disagreement or onBorder
+            best = [ returns, neighbourhood ]
+        elif returns[3] > best[0][3]:
+            disagreement = True
+            best = [ returns, neighbourhood ]
+
+    return [ best[0], best[1], disagreement ]
+
+
+def stack_windows( im1List, im2List ):
+    # Put all the windows in two contiguous 1D buffers, and build the N x 8 offsets array
+    #   [ start of im1, im1 dimensions (3), start of im2, im2 dimensions (3) ] needed by pixel_search_batch()
+    nNodes  = len( im1List )
+    offsets = numpy.zeros( ( nNodes, 8 ), dtype=numpy.intc )
+
+    start1 = 0
+    start2 = 0
+    for node in range( nNodes ):
+        offsets[ node, 0 ]   = start1
+        offsets[ node, 1:4 ] = im1List[ node ].shape
+        offsets[ node, 4 ]   = start2
+        offsets[ node, 5:8 ] = im2List[ node ].shape
+        start1 += im1List[ node ].size
+        start2 += im2List[ node ].size
+
+    im1Stack = numpy.empty( start1, dtype='<f4' )
+    im2Stack = numpy.empty( start2, dtype='<f4' )
+    for node in range( nNodes ):
+        im1Stack[ offsets[ node, 0 ]:offsets[ node, 0 ]+im1List[ node ].size ] = im1List[ node ].ravel()
+        im2Stack[ offsets[ node, 4 ]:offsets[ node, 4 ]+im2List[ node ].size ] = im2List[ node ].ravel()
+
+    return im1Stack, im2Stack, offsets
+
+
+def pixel_search_batch( im1Stack, im2Stack, offsets, engine="direct", neighbourhoods=None ):
+    # Pixel search of N nodes in one call to the C-code, returns an N x 4 array of [ z, y, x, cc ].
+    #   If neighbourhoods (N x 27 float32) is given, it is filled with the 3x3x3 CC values around each maximum.
+    if engine not in BATCH_SEARCH_MODES:
+        raise Exception( "pixel_search_batch(): only the \"direct\", \"sat\" and \"pruned\" engines can be batched, got \"{}\"".format( engine ) )
+
+    offsets = numpy.ascontiguousarray( offsets, dtype=numpy.intc )
+    nNodes  = offsets.shape[0]
+
+    if neighbourhoods is None:
+        neighbourhoods = numpy.zeros( ( 0, 27 ), dtype='<f4' )
+
+    returns = pixel_search.pixel_search_batch( numpy.ascontiguousarray( im1Stack, dtype='<f4' ), \
+                                               numpy.ascontiguousarray( im2Stack, dtype='<f4' ), \
+                                               offsets, neighbourhoods, BATCH_SEARCH_MODES[ engine ], 4 * nNodes )
+
+    return returns.reshape( nNodes, 4 )
+
+
+def batch_integer_pixel_search( im1List, im2List, engine="direct", returnNeighbourhood=False ):
+    # integer_pixel_search() for a list of nodes, returns a list of [ [ z, y, x, cc ], neighbourhood ]
+    #   (neighbourhood is None if not asked, or if the maximum is on the edge of the search range).
+    #   With "auto" each node gets its own engine, the nodes for which "sat" is chosen are batched.
+    nNodes  = len( im1List )
+    results = [ None ] * nNodes
+
+    batchEngine = engine
+    if engine == "auto":
+        batchEngine = "sat"
+
+    batchNodes = []
+    if batchEngine in BATCH_SEARCH_MODES:
+        batchNodes = [ node for node in range( nNodes ) if select_pixel_search_engine( engine, im1List[ node ].shape, im2List[ node ].shape ) == batchEngine ]
+    batchNodeSet = set( batchNodes )
+
+    for node in range( nNodes ):
+        if node not in batchNodeSet:
+            if returnNeighbourhood:
+                results[ node ] = integer_pixel_search( im1List[ node ], im2List[ node ], engine, returnNeighbourhood=True )
+            else:
+                results[ node ] = [ integer_pixel_search( im1List[ node ], im2List[ node ], engine ), None ]
+
+    if len( batchNodes ) > 0:
+        im1Stack, im2Stack, offsets = stack_windows( [ im1List[ node ] for node in batchNodes ], [ im2List[ node ] for node in batchNodes ] )
+
+        neighbourhoods = None
+        if returnNeighbourhood:
+            neighbourhoods = numpy.zeros( ( len( batchNodes ), 27 ), dtype='<f4' )
+
+        returns = pixel_search_batch( im1Stack, im2Stack, offsets, batchEngine, neighbourhoods )
+
+        for i, node in enumerate( batchNodes ):
+            neighbourhood = None
+            if returnNeighbourhood:
+                neighbourhood = batch_neighbourhood( neighbourhoods[ i ], returns[ i, 0:3 ], im1List[ node ].shape, im2List[ node ].shape )
+
+            results[ node ] = [ returns[ i ], neighbourhood ]
+
+    return results
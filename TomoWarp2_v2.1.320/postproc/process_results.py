@@ -68,8 +68,11 @@ def construct_mask( kinematics, cc_threshold=None ):
         mask[ numpy.where( cc_field < cc_threshold ) ] = numpy.nan
 
     # add the nodes which are error nodes to the mask
-    mask[ numpy.where( kinematics[ :, 11 ] != 0 ) ] = numpy.inf
-    mask[ numpy.where( kinematics[ :, 11 ] > 2 ) ] = numpy.nan
+    #   (2048, the coarse and fine pyramid pixel searches disagree, is only an audit flag:
+    #    the full resolution result of these nodes is valid, so it is not masked)
+    errors = numpy.bitwise_and( kinematics[ :, 11 ].astype( int ), ~2048 )
+    mask[ numpy.where( errors != 0 ) ] = numpy.inf
+    mask[ numpy.where( errors > 2 ) ] = numpy.nan
      
     return mask
 
@@ -42,6 +42,11 @@ INPUTS:
 OUTPUTS:
  - subpixel x,y,z displacements
  - interpolated CC
+
+cc_interpolation_fit and cc_interpolation_fit_2D do the same starting directly from the
+  3x3x3 (3x3) CC values, when these are already known from the pixel search.
+cc_interpolation_fit_batch and cc_interpolation_fit_2D_batch do the fit of N nodes at once,
+  all their Newton's iterations being done together on arrays.
 """
 
 import numpy
@@ -52,6 +57,178 @@ import logging
 from pixel_search.c_code import pixel_search
 from tools.print_variable import pv
 
+def cc_polynomial_coefficients( CC ):
+        # Coefficients of the polynomial describing the CC volume around the maximum, from the 3x3x3 CC values
+        #   (CC can also be N x 3 x 3 x 3, for N nodes at once)
+        c1=2*CC[..., 1, 0, 0] - 0.5*CC[..., 2, 0, 0] - 1.5*CC[..., 0, 0, 0];
+        c2=0.5*CC[..., 0, 0, 0] - CC[..., 1, 0, 0] + 0.5*CC[..., 2, 0, 0];
+        b1=2*CC[..., 0, 1, 0] - 0.5*CC[..., 0, 2, 0] - 1.5*CC[..., 0, 0, 0];
+        b2=0.5*CC[..., 0, 0, 0] - CC[..., 0, 1, 0] + 0.5*CC[..., 0, 2, 0];
+        d1=2*CC[..., 0, 0, 1] - 0.5*CC[..., 0, 0, 2] - 1.5*CC[..., 0, 0, 0];
+        d2=0.5*CC[..., 0, 0, 0] - CC[..., 0, 0, 1] + 0.5*CC[..., 0, 0, 2];
+
+        e1=0.25*(CC[..., 2, 2, 0] - 4*CC[..., 2, 1, 0] - 4*CC[..., 1, 2, 0] + 16*CC[..., 1, 1, 0] - 9*CC[..., 0, 0, 0] - 6*b1 -6*c1);
+        e3=-0.25*(CC[..., 2, 2, 0] - 4*CC[..., 2, 1, 0] - 2*CC[..., 1, 2, 0] + 8*CC[..., 1, 1, 0] - 3*CC[..., 0, 0, 0] - 2*b1 +6*c2);
+        e2=0.5*(-0.5*CC[..., 2, 2, 0] + 2*CC[..., 1, 2, 0] + CC[..., 2, 1, 0] - 4*CC[..., 1, 1, 0] + 3*CC[..., 0, 0, 0]/2 - 3*b2+ c1);
+        e4=CC[..., 1, 1, 0]-CC[..., 0, 0, 0]-b1-b2-c1-c2-e1-e2-e3;
+
+        f1=0.25*(CC[..., 2, 0, 2] - 4*CC[..., 2, 0, 1] - 4*CC[..., 1, 0, 2] + 16*CC[..., 1, 0, 1] - 9*CC[..., 0, 0, 0] - 6*c1 -6*d1);
+        f3=-0.25*(CC[..., 2, 0, 2] - 4*CC[..., 2, 0, 1] - 2*CC[..., 1, 0, 2] + 8*CC[..., 1, 0, 1] - 3*CC[..., 0, 0, 0] - 2*d1 +6*c2);
+        f2=0.5*(-0.5*CC[..., 2, 0, 2] + 2*CC[..., 1, 0, 2] + CC[..., 2, 0, 1] - 4*CC[..., 1, 0, 1] + 3*CC[..., 0, 0, 0]/2 - 3*d2+ c1);
+        f4=CC[..., 1, 0, 1]-CC[..., 0, 0, 0]-c1-c2-d1-d2-f1-f2-f3;
+
+        g1=0.25*(CC[..., 0, 2, 2] - 4*CC[..., 0, 1, 2] - 4*CC[..., 0, 2, 1] + 16*CC[..., 0, 1, 1] - 9*CC[..., 0, 0, 0] - 6*b1 -6*d1);
+        g3=-0.25*(CC[..., 0, 2, 2] - 4*CC[..., 0, 2, 1] - 2*CC[..., 0, 1, 2] + 8*CC[..., 0, 1, 1] - 3*CC[..., 0, 0, 0] - 2*d1 +6*b2);
+        g2=0.5*(-0.5*CC[..., 0, 2, 2] + 2*CC[..., 0, 1, 2] + CC[..., 0, 2, 1] - 4*CC[..., 0, 1, 1] + 3*CC[..., 0, 0, 0]/2 - 3*d2+ b1);
+        g4=CC[..., 0, 1, 1]-CC[..., 0, 0, 0]-b1-b2-d1-d2-g1-g2-g3;
+
+        h1=-(CC[..., 2, 2, 2]-4*(CC[..., 2, 2, 1]+CC[..., 2, 1, 2]+CC[..., 1, 2, 2])+16*(CC[..., 2, 1, 1]+CC[..., 1, 2, 1]+CC[..., 1, 1, 2]) - 64*CC[..., 1, 1, 1] + 27*CC[..., 0, 0, 0] + 18*b1 + 18*c1 + 18*d1 + 12*e1 + 12*f1 + 12*g1)/8;
+        h4=(-CC[..., 2, 2, 2] - 32*CC[..., 1, 1, 1] + 8*CC[..., 1, 1, 2] + 4*CC[..., 2, 2, 1] + 21*CC[..., 0, 0, 0] + 18*b1 + 12*b2 + 18*c1 + 12*c2 + 14*d1 + 12*e1 - 24*e4 + 12*f1 + 8*f3 + 12*g1 + 8*g3 + 8*h1)/16;
+        k2=(-CC[..., 2, 2, 2] - 32*CC[..., 1, 1, 1] + 8*CC[..., 2, 1, 1] + 4*CC[..., 1, 2, 2] + 21*CC[..., 0, 0, 0] + 18*b1 +12*b2 + 14*c1 + 18*d1 + 12*d2 + 12*e1 + 8*e2 + 12*f1 + 8*f2 + 12*g1 -24*g4 +8*h1)/16;
+        k3=(-CC[..., 2, 2, 2] - 32*CC[..., 1, 1, 1] + 8*CC[..., 1, 2, 1] + 4*CC[..., 2, 1, 2] + 21*CC[..., 0, 0, 0] + 14*b1 +18*c1 + 12*c2 + 18*d1 + 12*d2 + 12*e1 + 8*e3 + 12*f1 -24*f4 + 12*g1 + 8*g2 +8*h1)/16;
+        k4= -(-CC[..., 2, 2, 2] + 16*CC[..., 1, 1, 1] -15*CC[..., 0, 0, 0] - 14*(b1+c1+d1) -12*(b2+c2+d2)-12*(e1+f1+g1) - 8*(e2+e3+f2+f3+g2+g3) -8*h1 +16*h4 +16*k2 +16*k3)/48;
+        k1 = (2*CC[..., 1, 1, 1] -0.25*CC[..., 2, 2, 1] - 7*CC[..., 0, 0, 0]/4 -3*(b1+c1)/2 -b2 -c2 - 7*(d1+d2)/4 - e1 + 2*e4 -3*(f1+f2)/2 -f3 -f4 -3*(g1+g2)/2 -g3 -g4 -h1 +2*h4 +2*k4);
+        h3 = (2*CC[..., 1, 1, 1] -0.5*CC[..., 1, 2, 1] - 3*CC[..., 0, 0, 0]/2 -b1 - 3*(c1+c2+d1+d2)/2 - e1 - e3 - 3*(f1+f2+f3+f4)/2 -g1-g2-h1-k1-k3);
+        h2 = (2*CC[..., 1, 1, 1] -0.5*CC[..., 2, 1, 1] - 3*CC[..., 0, 0, 0]/2 -c1 - 3*(b1+b2+d1+d2)/2 - e1 - e2 - 3*(g1+g2+g3+g4)/2 -f1-f2-h1-k1-k2);
+
+        return b1, b2, c1, c2, d1, d2, e1, e2, e3, e4, f1, f2, f3, f4, g1, g2, g3, g4, h1, h2, h3, h4, k1, k2, k3, k4
+
+
+def cc_newton_step( coefficients, rel_z_pos, rel_y_pos, rel_x_pos ):
+        # One step of Newton's method towards the maximum of the polynomial: first and second derivatives
+        #   and Jacobian at the current relative position, returns the steps in z, y and x
+        b1, b2, c1, c2, d1, d2, e1, e2, e3, e4, f1, f2, f3, f4, g1, g2, g3, g4, h1, h2, h3, h4, k1, k2, k3, k4 = coefficients
+
+        # Calculating the first derivative
+
+        dcc_x = c1 + 2*c2*rel_z_pos + e1*rel_y_pos + e2*rel_y_pos*rel_y_pos + 2*e3*rel_z_pos*rel_y_pos + 2*e4*rel_z_pos*rel_y_pos*rel_y_pos + \
+                f1*rel_x_pos + f2*rel_x_pos*rel_x_pos + 2*f3*rel_z_pos*rel_x_pos + 2*f4*rel_z_pos*rel_x_pos*rel_x_pos + h1*rel_y_pos*rel_x_pos + \
+                h2*rel_y_pos*rel_y_pos*rel_x_pos + 2*h3*rel_z_pos*rel_y_pos*rel_x_pos + 2*h4*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos + \
+                k1*rel_y_pos*rel_x_pos*rel_x_pos + k2*rel_y_pos*rel_y_pos*rel_x_pos*rel_x_pos + 2*k3*rel_z_pos*rel_y_pos*rel_x_pos*rel_x_pos + \
+                2*k4*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos*rel_x_pos;
+
+        dcc_y = b1 + 2*b2*rel_y_pos + e1*rel_z_pos + 2*e2*rel_z_pos*rel_y_pos + e3*rel_z_pos*rel_z_pos + 2*e4*rel_z_pos*rel_z_pos*rel_y_pos + \
+                g1*rel_x_pos + g2*rel_x_pos*rel_x_pos + 2*g3*rel_y_pos*rel_x_pos + 2*g4*rel_y_pos*rel_x_pos*rel_x_pos + h1*rel_z_pos*rel_x_pos + \
+                2*h2*rel_z_pos*rel_y_pos*rel_x_pos + h3*rel_z_pos*rel_z_pos*rel_x_pos + 2*h4*rel_z_pos*rel_z_pos*rel_y_pos*rel_x_pos + \
+                k1*rel_z_pos*rel_x_pos*rel_x_pos + 2*k2*rel_z_pos*rel_y_pos*rel_x_pos*rel_x_pos + k3*rel_z_pos*rel_z_pos*rel_x_pos*rel_x_pos + \
+                2*k4*rel_z_pos*rel_z_pos*rel_y_pos*rel_x_pos*rel_x_pos;
+
+        dcc_z = d1 + 2*d2*rel_x_pos + f1*rel_z_pos + 2*f2*rel_z_pos*rel_x_pos + f3*rel_z_pos*rel_z_pos + 2*f4*rel_z_pos*rel_z_pos*rel_x_pos + \
+                g1*rel_y_pos + 2*g2*rel_y_pos*rel_x_pos + g3*rel_y_pos*rel_y_pos + 2*g4*rel_y_pos*rel_y_pos*rel_x_pos + h1*rel_z_pos*rel_y_pos + \
+                h2*rel_z_pos*rel_y_pos*rel_y_pos + h3*rel_z_pos*rel_z_pos*rel_y_pos + h4*rel_z_pos*rel_z_pos*rel_y_pos*rel_y_pos + \
+                2*k1*rel_z_pos*rel_y_pos*rel_x_pos + 2*k2*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos + 2*k3*rel_z_pos*rel_z_pos*rel_y_pos*rel_x_pos + \
+                2*k4*rel_z_pos*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos;
+
+        # Calculating the second derivative
+
+        dcc_yy = 2*(b2 + e2*rel_z_pos + e4*rel_z_pos*rel_z_pos + g3*rel_x_pos + g4*rel_x_pos*rel_x_pos + h2*rel_z_pos*rel_x_pos + \
+                h4*rel_z_pos*rel_z_pos*rel_x_pos + k2*rel_z_pos*rel_x_pos*rel_x_pos + k4*rel_z_pos*rel_z_pos*rel_x_pos*rel_x_pos);
+
+        dcc_xx = 2*(c2 + e3*rel_y_pos + e4*rel_y_pos*rel_y_pos + f3*rel_x_pos + f4*rel_x_pos*rel_x_pos + h3*rel_y_pos*rel_x_pos + \
+                h4*rel_y_pos*rel_y_pos*rel_x_pos + k3*rel_y_pos*rel_x_pos*rel_x_pos + k4*rel_y_pos*rel_y_pos*rel_x_pos*rel_x_pos);
+
+        dcc_zz = 2*(d2 + f2*rel_z_pos + f4*rel_z_pos*rel_z_pos + g2*rel_y_pos + g4*rel_y_pos*rel_y_pos + k1*rel_z_pos*rel_y_pos + \
+                k2*rel_z_pos*rel_y_pos*rel_y_pos + k3*rel_z_pos*rel_z_pos*rel_y_pos + k4*rel_z_pos*rel_z_pos*rel_y_pos*rel_y_pos);
+
+        dcc_xy = e1 + 2*e2*rel_y_pos + 2*e3*rel_z_pos + 4*e4*rel_z_pos*rel_y_pos + h1*rel_x_pos + 2*h2*rel_y_pos*rel_x_pos + \
+                2*h3*rel_z_pos*rel_x_pos + 4*h4*rel_z_pos*rel_y_pos*rel_x_pos + k1*rel_x_pos*rel_x_pos + 2*k2*rel_y_pos*rel_x_pos*rel_x_pos + \
+                2*k3*rel_z_pos*rel_x_pos*rel_x_pos + 4*k4*rel_z_pos*rel_y_pos*rel_x_pos*rel_x_pos;
+
+        dcc_xz = f1 + 2*f2*rel_x_pos + 2*f3*rel_z_pos + 4*f4*rel_z_pos*rel_x_pos + h1*rel_y_pos + h2*rel_y_pos*rel_y_pos + \
+                2*h3*rel_z_pos*rel_y_pos + 2*h4*rel_z_pos*rel_y_pos*rel_y_pos + 2*k1*rel_y_pos*rel_x_pos + 2*k2*rel_y_pos*rel_y_pos*rel_x_pos + \
+                4*k3*rel_z_pos*rel_y_pos*rel_x_pos + 4*k4*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos;
+
+        dcc_yz = g1 + 2*g2*rel_x_pos + 2*g3*rel_y_pos + 4*g4*rel_y_pos*rel_x_pos + h1*rel_z_pos + 2*h2*rel_z_pos*rel_y_pos + \
+                h3*rel_z_pos*rel_z_pos + 2*h4*rel_z_pos*rel_z_pos*rel_y_pos + 2*k1*rel_z_pos*rel_x_pos + 4*k2*rel_z_pos*rel_y_pos*rel_x_pos + \
+                2*k3*rel_z_pos*rel_z_pos*rel_x_pos + 4*k4*rel_z_pos*rel_z_pos*rel_y_pos*rel_x_pos;
+
+        # Jacobian, for one node or for arrays of nodes
+        J = numpy.array( [ [ dcc_xx, dcc_xy, dcc_xz ],
+                           [ dcc_xy, dcc_yy, dcc_yz ],
+                           [ dcc_xz, dcc_yz, dcc_zz ] ] )
+
+        detJ = J[0, 0]*J[1, 1]*J[2, 2] - J[0, 0]*J[2, 1]*J[1, 2] - J[1, 0]*J[0, 1]*J[2, 2] + \
+              J[1, 0]*J[2, 1]*J[0, 2] + J[2, 0]*J[0, 1]*J[1, 2] - J[2, 0]*J[1, 1]*J[0, 2];
+
+        dx = -((J[1, 1]*J[2, 2]-J[2, 1]*J[1, 2])*dcc_x + (J[0, 2]*J[2, 1]-(J[2, 2]*J[0, 1]))*dcc_y + \
+              (J[0, 1]*J[1, 2]-(J[1, 1]*J[0, 2]))*dcc_z)/detJ;
+
+        dy = -((J[1, 2]*J[2, 0]-J[2, 2]*J[1, 0])*dcc_x + (J[0, 0]*J[2, 2]-(J[2, 0]*J[0, 2]))*dcc_y + \
+              (J[0, 2]*J[1, 0]-(J[1, 0]*J[1, 2]))*dcc_z)/detJ;
+
+        dz = -((J[1, 0]*J[2, 1]-J[2, 0]*J[1, 1])*dcc_x + (J[0, 1]*J[2, 0]-(J[2, 1]*J[0, 0]))*dcc_y + \
+              (J[0, 0]*J[1, 1]-(J[0, 1]*J[1, 0]))*dcc_z)/detJ;
+
+        return dx, dy, dz
+
+
+def cc_polynomial_value( CC, coefficients, rel_z_pos, rel_y_pos, rel_x_pos ):
+        # Value of the polynomial (interpolated CC) at the relative position
+        b1, b2, c1, c2, d1, d2, e1, e2, e3, e4, f1, f2, f3, f4, g1, g2, g3, g4, h1, h2, h3, h4, k1, k2, k3, k4 = coefficients
+
+        ncc = CC[..., 0, 0, 0] + b1*rel_y_pos + b2*rel_y_pos*rel_y_pos + c1*rel_z_pos + c2*rel_z_pos*rel_z_pos + d1*rel_x_pos + \
+              d2*rel_x_pos*rel_x_pos + e1*rel_z_pos*rel_y_pos + e2*rel_z_pos*rel_y_pos*rel_y_pos + e3*rel_z_pos*rel_z_pos*rel_y_pos + \
+              e4*rel_z_pos*rel_z_pos*rel_y_pos*rel_y_pos + f1*rel_z_pos*rel_x_pos + f2*rel_z_pos*rel_x_pos*rel_x_pos + \
+              f3*rel_z_pos*rel_z_pos*rel_x_pos + f4*rel_z_pos*rel_z_pos*rel_x_pos*rel_x_pos + g1*rel_y_pos*rel_x_pos + \
+              g2*rel_y_pos*rel_x_pos*rel_x_pos + g3*rel_y_pos*rel_y_pos*rel_x_pos + g4*rel_y_pos*rel_y_pos*rel_x_pos*rel_x_pos + \
+              h1*rel_z_pos*rel_y_pos*rel_x_pos + h2*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos + h3*rel_z_pos*rel_z_pos*rel_y_pos*rel_x_pos + \
+              h4*rel_z_pos*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos + k1*rel_z_pos*rel_y_pos*rel_x_pos*rel_x_pos + \
+              k2*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos*rel_x_pos + k3*rel_z_pos*rel_z_pos*rel_y_pos*rel_x_pos*rel_x_pos + \
+              k4*rel_z_pos*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos*rel_x_pos;
+
+        return ncc
+
+
+def cc_polynomial_coefficients_2D( CC ):
+        # Coefficients of the polynomial describing the CC surface around the maximum, from the 3x3 CC values
+        #   (CC can also be N x 3 x 3, for N nodes at once)
+        b1 = 2.0*CC[..., 1, 0] - 0.5*CC[..., 2, 0] - 1.5*CC[..., 0, 0];
+        b2 = 2.0*CC[..., 0, 1] - 0.5*CC[..., 0, 2] - 1.5*CC[..., 0, 0];
+        c1 = 0.5*CC[..., 0, 0] + 0.5*CC[..., 2, 0] - CC[..., 1, 0];
+        c2 = 0.5*CC[..., 0, 0] + 0.5*CC[..., 0, 2] - CC[..., 0, 1];
+
+        d  = 0.25*( CC[..., 2, 2] - 4.0*CC[..., 2, 1] - 4.0*CC[..., 1, 2] + 16.0*CC[..., 1, 1] - 9.0*CC[..., 0, 0] - 6.0*b2 - 6.0*b1);
+        e1 = 0.25*(-CC[..., 2, 2] + 4.0*CC[..., 2, 1] + 2.0*CC[..., 1, 2] -  8.0*CC[..., 1, 1] + 3.0*CC[..., 0, 0] + 2.0*b2 - 6.0*c1);
+        e2 = 0.25*(-CC[..., 2, 2] + 4.0*CC[..., 1, 2] + 2.0*CC[..., 2, 1] -  8.0*CC[..., 1, 1] + 3.0*CC[..., 0, 0] + 2.0*b1 - 6.0*c2);
+        f  = CC[..., 1, 1]-CC[..., 0, 0]-b2-c2-b1-c1-d-e2-e1;
+
+        return b1, b2, c1, c2, d, e1, e2, f
+
+
+def cc_newton_step_2D( coefficients, rel_y_pos, rel_x_pos ):
+        # One step of Newton's method towards the maximum of the polynomial, returns the steps in y and x
+        b1, b2, c1, c2, d, e1, e2, f = coefficients
+
+        # Calculating the first derivative
+
+        dccy = b1 + 2.0*c1*rel_y_pos + d*rel_x_pos + 2.0*e1*rel_y_pos*rel_x_pos + e2*rel_x_pos*rel_x_pos + 2.0*f*rel_y_pos*rel_x_pos*rel_x_pos;
+        dccx = b2 + 2.0*c2*rel_x_pos + d*rel_y_pos + e1*rel_y_pos*rel_y_pos + 2.0*e2*rel_y_pos*rel_x_pos + 2.0*f*rel_y_pos*rel_y_pos*rel_x_pos;
+        dccyy = 2.0*c1 + 2.0*e1*rel_x_pos + 2.0*f*rel_x_pos*rel_x_pos;
+        dccxx = 2.0*c2 + 2.0*e2*rel_y_pos + 2.0*f*rel_y_pos*rel_y_pos;
+        dccyx = d + 2.0*e1*rel_y_pos + 2.0*e2*rel_x_pos + 4.0*f*rel_y_pos*rel_x_pos;
+
+        # Jacobian, for one node or for arrays of nodes
+        J = numpy.array( [ [ dccyy, dccyx ],
+                           [ dccyx, dccxx ] ] )
+
+        detJ= J[0][0]*J[1][1] - J[1][0]*J[0][1];
+
+        dy=-( J[1][1]*dccy - J[1][0]*dccx)/detJ;
+        dx=-(-J[0][1]*dccy + J[0][0]*dccx)/detJ;
+
+        return dy, dx
+
+
+def cc_polynomial_value_2D( CC, coefficients, rel_y_pos, rel_x_pos ):
+        # Value of the polynomial (interpolated CC) at the relative position
+        b1, b2, c1, c2, d, e1, e2, f = coefficients
+
+        ncc = CC[..., 0, 0] + b2*rel_x_pos + c2*rel_x_pos*rel_x_pos + b1*rel_y_pos + c1*rel_y_pos*rel_y_pos + d*rel_x_pos*rel_y_pos + e2*rel_x_pos*rel_x_pos*rel_y_pos + \
+        e1*rel_x_pos*rel_y_pos*rel_y_pos + f*rel_x_pos*rel_x_pos*rel_y_pos*rel_y_pos;
+
+        return ncc
+
+
 def cc_interpolation_local( im1, im2, refinement_step_threshold = 0.0001, max_refinement_iterations = 15, max_refinement_step = 2):
         # This is a "half wit" correlation window size in z,y,x directions.
 
@@ -72,6 +249,14 @@ def cc_interpolation_local( im1, im2, refinement_step_threshold = 0.0001, max_re
               #2015-12-20 ET: modify to take the correct size in each direction (important only if the CW has different size in the three directions)
               CC[ z, y, x ] = pixel_search.pixel_search( im1, im2[ z:z+im1.shape[0], y:y+im1.shape[1], x:x+im1.shape[2] ], 4 )[ 3 ]
 
+        return cc_interpolation_fit( CC, refinement_step_threshold, max_refinement_iterations, max_refinement_step )
+
+
+
+def cc_interpolation_fit( CC, refinement_step_threshold = 0.0001, max_refinement_iterations = 15, max_refinement_step = 2):
+        # Fit of the 3x3x3 matrix of CC values, either calculated above, or taken
+        #   directly from the CC map of the pixel search (see integer_pixel_search)
+
         # Make sure that our hypothesis that the highest CC is in the middle, this might not work if we have two equal maximum points
         # 2014-10-23 EA:
         #  numpy.where( CC == CC.max() ) returns a list of arrays of x, y, z positions, we're going to turn it into an array itself,
@@ -83,11 +268,11 @@ def cc_interpolation_local( im1, im2, refinement_step_threshold = 0.0001, max_re
         #                                   |  CCmaxPositions is 1   | | along x,y,z for all() | if ANY max position was at 1,1,1
         if not numpy.all( CCmaxPositions == numpy.array([1,1,1]).all(), axis=1                 ).any():
             try:
-              logging.log.warning("cc_interpolation_local(): Maximum of CC is not in the middle of the im2.")
-              logging.log.debug("cc_interpolation_local(): numpy.where( CC == CC.max() = {}".format(numpy.where( CC == CC.max() )))
+              logging.log.warning("cc_interpolation_fit(): Maximum of CC is not in the middle of the im2.")
+              logging.log.debug("cc_interpolation_fit(): numpy.where( CC == CC.max() = {}".format(numpy.where( CC == CC.max() )))
             except:
-              print "cc_interpolation_local(): Maximum of CC is not in the middle of the im2."
-              print "cc_interpolation_local(): numpy.where( CC == CC.max() = {}".format(numpy.where( CC == CC.max() ))
+              print "cc_interpolation_fit(): Maximum of CC is not in the middle of the im2."
+              print "cc_interpolation_fit(): numpy.where( CC == CC.max() = {}".format(numpy.where( CC == CC.max() ))
             return numpy.array( [ 0, 0, 0, 0, 0, 128] )
 
         ########################################################################
@@ -109,36 +294,7 @@ def cc_interpolation_local( im1, im2, refinement_step_threshold = 0.0001, max_re
         #-  Define quadratic coefficients describing CC volume*/              --
         #-----------------------------------------------------------------------
 
-        c1=2*CC[1, 0, 0] - 0.5*CC[2, 0, 0] - 1.5*CC[0, 0, 0];
-        c2=0.5*CC[0, 0, 0] - CC[1, 0, 0] + 0.5*CC[2, 0, 0];
-        b1=2*CC[0, 1, 0] - 0.5*CC[0, 2, 0] - 1.5*CC[0, 0, 0];
-        b2=0.5*CC[0, 0, 0] - CC[0, 1, 0] + 0.5*CC[0, 2, 0];
-        d1=2*CC[0, 0, 1] - 0.5*CC[0, 0, 2] - 1.5*CC[0, 0, 0];
-        d2=0.5*CC[0, 0, 0] - CC[0, 0, 1] + 0.5*CC[0, 0, 2];
-
-        e1=0.25*(CC[2, 2, 0] - 4*CC[2, 1, 0] - 4*CC[1, 2, 0] + 16*CC[1, 1, 0] - 9*CC[0, 0, 0] - 6*b1 -6*c1);
-        e3=-0.25*(CC[2, 2, 0] - 4*CC[2, 1, 0] - 2*CC[1, 2, 0] + 8*CC[1, 1, 0] - 3*CC[0, 0, 0] - 2*b1 +6*c2);
-        e2=0.5*(-0.5*CC[2, 2, 0] + 2*CC[1, 2, 0] + CC[2, 1, 0] - 4*CC[1, 1, 0] + 3*CC[0, 0, 0]/2 - 3*b2+ c1);
-        e4=CC[1, 1, 0]-CC[0, 0, 0]-b1-b2-c1-c2-e1-e2-e3;
-
-        f1=0.25*(CC[2, 0, 2] - 4*CC[2, 0, 1] - 4*CC[1, 0, 2] + 16*CC[1, 0, 1] - 9*CC[0, 0, 0] - 6*c1 -6*d1);
-        f3=-0.25*(CC[2, 0, 2] - 4*CC[2, 0, 1] - 2*CC[1, 0, 2] + 8*CC[1, 0, 1] - 3*CC[0, 0, 0] - 2*d1 +6*c2);
-        f2=0.5*(-0.5*CC[2, 0, 2] + 2*CC[1, 0, 2] + CC[2, 0, 1] - 4*CC[1, 0, 1] + 3*CC[0, 0, 0]/2 - 3*d2+ c1);
-        f4=CC[1, 0, 1]-CC[0, 0, 0]-c1-c2-d1-d2-f1-f2-f3;
-
-        g1=0.25*(CC[0, 2, 2] - 4*CC[0, 1, 2] - 4*CC[0, 2, 1] + 16*CC[0, 1, 1] - 9*CC[0, 0, 0] - 6*b1 -6*d1);
-        g3=-0.25*(CC[0, 2, 2] - 4*CC[0, 2, 1] - 2*CC[0, 1, 2] + 8*CC[0, 1, 1] - 3*CC[0, 0, 0] - 2*d1 +6*b2);
-        g2=0.5*(-0.5*CC[0, 2, 2] + 2*CC[0, 1, 2] + CC[0, 2, 1] - 4*CC[0, 1, 1] + 3*CC[0, 0, 0]/2 - 3*d2+ b1);
-        g4=CC[0, 1, 1]-CC[0, 0, 0]-b1-b2-d1-d2-g1-g2-g3;
-
-        h1=-(CC[2, 2, 2]-4*(CC[2, 2, 1]+CC[2, 1, 2]+CC[1, 2, 2])+16*(CC[2, 1, 1]+CC[1, 2, 1]+CC[1, 1, 2]) - 64*CC[1, 1, 1] + 27*CC[0, 0, 0] + 18*b1 + 18*c1 + 18*d1 + 12*e1 + 12*f1 + 12*g1)/8;
-        h4=(-CC[2, 2, 2] - 32*CC[1, 1, 1] + 8*CC[1, 1, 2] + 4*CC[2, 2, 1] + 21*CC[0, 0, 0] + 18*b1 + 12*b2 + 18*c1 + 12*c2 + 14*d1 + 12*e1 - 24*e4 + 12*f1 + 8*f3 + 12*g1 + 8*g3 + 8*h1)/16;
-        k2=(-CC[2, 2, 2] - 32*CC[1, 1, 1] + 8*CC[2, 1, 1] + 4*CC[1, 2, 2] + 21*CC[0, 0, 0] + 18*b1 +12*b2 + 14*c1 + 18*d1 + 12*d2 + 12*e1 + 8*e2 + 12*f1 + 8*f2 + 12*g1 -24*g4 +8*h1)/16;
-        k3=(-CC[2, 2, 2] - 32*CC[1, 1, 1] + 8*CC[1, 2, 1] + 4*CC[2, 1, 2] + 21*CC[0, 0, 0] + 14*b1 +18*c1 + 12*c2 + 18*d1 + 12*d2 + 12*e1 + 8*e3 + 12*f1 -24*f4 + 12*g1 + 8*g2 +8*h1)/16;
-        k4= -(-CC[2, 2, 2] + 16*CC[1, 1, 1] -15*CC[0, 0, 0] - 14*(b1+c1+d1) -12*(b2+c2+d2)-12*(e1+f1+g1) - 8*(e2+e3+f2+f3+g2+g3) -8*h1 +16*h4 +16*k2 +16*k3)/48;
-        k1 = (2*CC[1, 1, 1] -0.25*CC[2, 2, 1] - 7*CC[0, 0, 0]/4 -3*(b1+c1)/2 -b2 -c2 - 7*(d1+d2)/4 - e1 + 2*e4 -3*(f1+f2)/2 -f3 -f4 -3*(g1+g2)/2 -g3 -g4 -h1 +2*h4 +2*k4);
-        h3 = (2*CC[1, 1, 1] -0.5*CC[1, 2, 1] - 3*CC[0, 0, 0]/2 -b1 - 3*(c1+c2+d1+d2)/2 - e1 - e3 - 3*(f1+f2+f3+f4)/2 -g1-g2-h1-k1-k3);
-        h2 = (2*CC[1, 1, 1] -0.5*CC[2, 1, 1] - 3*CC[0, 0, 0]/2 -c1 - 3*(b1+b2+d1+d2)/2 - e1 - e2 - 3*(g1+g2+g3+g4)/2 -f1-f2-h1-k1-k2);
+        coefficients = cc_polynomial_coefficients( CC )
 
 
         #-----------------------------------------------------------------------
@@ -160,8 +316,6 @@ def cc_interpolation_local( im1, im2, refinement_step_threshold = 0.0001, max_re
         dy=1.0;
         dz=1.0;
 
-        J = numpy.zeros((3, 3))
-
         threshold = refinement_step_threshold*refinement_step_threshold;
         iteration = 0;
 
@@ -177,70 +331,7 @@ def cc_interpolation_local( im1, im2, refinement_step_threshold = 0.0001, max_re
 
             iteration = iteration + 1
 
-            # Calculating the first derivative
-
-            dcc_x = c1 + 2*c2*rel_z_pos + e1*rel_y_pos + e2*rel_y_pos*rel_y_pos + 2*e3*rel_z_pos*rel_y_pos + 2*e4*rel_z_pos*rel_y_pos*rel_y_pos + \
-                    f1*rel_x_pos + f2*rel_x_pos*rel_x_pos + 2*f3*rel_z_pos*rel_x_pos + 2*f4*rel_z_pos*rel_x_pos*rel_x_pos + h1*rel_y_pos*rel_x_pos + \
-                    h2*rel_y_pos*rel_y_pos*rel_x_pos + 2*h3*rel_z_pos*rel_y_pos*rel_x_pos + 2*h4*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos + \
-                    k1*rel_y_pos*rel_x_pos*rel_x_pos + k2*rel_y_pos*rel_y_pos*rel_x_pos*rel_x_pos + 2*k3*rel_z_pos*rel_y_pos*rel_x_pos*rel_x_pos + \
-                    2*k4*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos*rel_x_pos;
-
-            dcc_y = b1 + 2*b2*rel_y_pos + e1*rel_z_pos + 2*e2*rel_z_pos*rel_y_pos + e3*rel_z_pos*rel_z_pos + 2*e4*rel_z_pos*rel_z_pos*rel_y_pos + \
-                    g1*rel_x_pos + g2*rel_x_pos*rel_x_pos + 2*g3*rel_y_pos*rel_x_pos + 2*g4*rel_y_pos*rel_x_pos*rel_x_pos + h1*rel_z_pos*rel_x_pos + \
-                    2*h2*rel_z_pos*rel_y_pos*rel_x_pos + h3*rel_z_pos*rel_z_pos*rel_x_pos + 2*h4*rel_z_pos*rel_z_pos*rel_y_pos*rel_x_pos + \
-                    k1*rel_z_pos*rel_x_pos*rel_x_pos + 2*k2*rel_z_pos*rel_y_pos*rel_x_pos*rel_x_pos + k3*rel_z_pos*rel_z_pos*rel_x_pos*rel_x_pos + \
-                    2*k4*rel_z_pos*rel_z_pos*rel_y_pos*rel_x_pos*rel_x_pos;
-
-            dcc_z = d1 + 2*d2*rel_x_pos + f1*rel_z_pos + 2*f2*rel_z_pos*rel_x_pos + f3*rel_z_pos*rel_z_pos + 2*f4*rel_z_pos*rel_z_pos*rel_x_pos + \
-                    g1*rel_y_pos + 2*g2*rel_y_pos*rel_x_pos + g3*rel_y_pos*rel_y_pos + 2*g4*rel_y_pos*rel_y_pos*rel_x_pos + h1*rel_z_pos*rel_y_pos + \
-                    h2*rel_z_pos*rel_y_pos*rel_y_pos + h3*rel_z_pos*rel_z_pos*rel_y_pos + h4*rel_z_pos*rel_z_pos*rel_y_pos*rel_y_pos + \
-                    2*k1*rel_z_pos*rel_y_pos*rel_x_pos + 2*k2*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos + 2*k3*rel_z_pos*rel_z_pos*rel_y_pos*rel_x_pos + \
-                    2*k4*rel_z_pos*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos;
-
-            # Calculating the second derivative
-
-            dcc_yy = 2*(b2 + e2*rel_z_pos + e4*rel_z_pos*rel_z_pos + g3*rel_x_pos + g4*rel_x_pos*rel_x_pos + h2*rel_z_pos*rel_x_pos + \
-                    h4*rel_z_pos*rel_z_pos*rel_x_pos + k2*rel_z_pos*rel_x_pos*rel_x_pos + k4*rel_z_pos*rel_z_pos*rel_x_pos*rel_x_pos);
-
-            dcc_xx = 2*(c2 + e3*rel_y_pos + e4*rel_y_pos*rel_y_pos + f3*rel_x_pos + f4*rel_x_pos*rel_x_pos + h3*rel_y_pos*rel_x_pos + \
-                    h4*rel_y_pos*rel_y_pos*rel_x_pos + k3*rel_y_pos*rel_x_pos*rel_x_pos + k4*rel_y_pos*rel_y_pos*rel_x_pos*rel_x_pos);
-
-            dcc_zz = 2*(d2 + f2*rel_z_pos + f4*rel_z_pos*rel_z_pos + g2*rel_y_pos + g4*rel_y_pos*rel_y_pos + k1*rel_z_pos*rel_y_pos + \
-                    k2*rel_z_pos*rel_y_pos*rel_y_pos + k3*rel_z_pos*rel_z_pos*rel_y_pos + k4*rel_z_pos*rel_z_pos*rel_y_pos*rel_y_pos);
-
-            dcc_xy = e1 + 2*e2*rel_y_pos + 2*e3*rel_z_pos + 4*e4*rel_z_pos*rel_y_pos + h1*rel_x_pos + 2*h2*rel_y_pos*rel_x_pos + \
-                    2*h3*rel_z_pos*rel_x_pos + 4*h4*rel_z_pos*rel_y_pos*rel_x_pos + k1*rel_x_pos*rel_x_pos + 2*k2*rel_y_pos*rel_x_pos*rel_x_pos + \
-                    2*k3*rel_z_pos*rel_x_pos*rel_x_pos + 4*k4*rel_z_pos*rel_y_pos*rel_x_pos*rel_x_pos;
-
-            dcc_xz = f1 + 2*f2*rel_x_pos + 2*f3*rel_z_pos + 4*f4*rel_z_pos*rel_x_pos + h1*rel_y_pos + h2*rel_y_pos*rel_y_pos + \
-                    2*h3*rel_z_pos*rel_y_pos + 2*h4*rel_z_pos*rel_y_pos*rel_y_pos + 2*k1*rel_y_pos*rel_x_pos + 2*k2*rel_y_pos*rel_y_pos*rel_x_pos + \
-                    4*k3*rel_z_pos*rel_y_pos*rel_x_pos + 4*k4*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos;
-
-            dcc_yz = g1 + 2*g2*rel_x_pos + 2*g3*rel_y_pos + 4*g4*rel_y_pos*rel_x_pos + h1*rel_z_pos + 2*h2*rel_z_pos*rel_y_pos + \
-                    h3*rel_z_pos*rel_z_pos + 2*h4*rel_z_pos*rel_z_pos*rel_y_pos + 2*k1*rel_z_pos*rel_x_pos + 4*k2*rel_z_pos*rel_y_pos*rel_x_pos + \
-                    2*k3*rel_z_pos*rel_z_pos*rel_x_pos + 4*k4*rel_z_pos*rel_z_pos*rel_y_pos*rel_x_pos;
-
-            J[0, 0] = dcc_xx;
-            J[1, 1] = dcc_yy;
-            J[2, 2] = dcc_zz;
-            J[0, 1] = dcc_xy;
-            J[1, 0] = dcc_xy;
-            J[0, 2] = dcc_xz;
-            J[2, 0] = dcc_xz;
-            J[1, 2] = dcc_yz;
-            J[2, 1] = dcc_yz;
-
-            detJ = J[0, 0]*J[1, 1]*J[2, 2] - J[0, 0]*J[2, 1]*J[1, 2] - J[1, 0]*J[0, 1]*J[2, 2] + \
-                  J[1, 0]*J[2, 1]*J[0, 2] + J[2, 0]*J[0, 1]*J[1, 2] - J[2, 0]*J[1, 1]*J[0, 2];
-
-            dx = -((J[1, 1]*J[2, 2]-J[2, 1]*J[1, 2])*dcc_x + (J[0, 2]*J[2, 1]-(J[2, 2]*J[0, 1]))*dcc_y + \
-                  (J[0, 1]*J[1, 2]-(J[1, 1]*J[0, 2]))*dcc_z)/detJ;
-
-            dy = -((J[1, 2]*J[2, 0]-J[2, 2]*J[1, 0])*dcc_x + (J[0, 0]*J[2, 2]-(J[2, 0]*J[0, 2]))*dcc_y + \
-                  (J[0, 2]*J[1, 0]-(J[1, 0]*J[1, 2]))*dcc_z)/detJ;
-
-            dz = -((J[1, 0]*J[2, 1]-J[2, 0]*J[1, 1])*dcc_x + (J[0, 1]*J[2, 0]-(J[2, 1]*J[0, 0]))*dcc_y + \
-                  (J[0, 0]*J[1, 1]-(J[0, 1]*J[1, 0]))*dcc_z)/detJ;
+            dx, dy, dz = cc_newton_step( coefficients, rel_z_pos, rel_y_pos, rel_x_pos )
 
             rel_z_pos = rel_z_pos + dx;
             rel_y_pos = rel_y_pos + dy;
@@ -249,15 +340,7 @@ def cc_interpolation_local( im1, im2, refinement_step_threshold = 0.0001, max_re
 
         if ( abs(rel_z_pos) <= max_refinement_step and abs(rel_y_pos) <= max_refinement_step and abs(rel_x_pos) <= max_refinement_step):
 
-            ncc = CC[0, 0, 0] + b1*rel_y_pos + b2*rel_y_pos*rel_y_pos + c1*rel_z_pos + c2*rel_z_pos*rel_z_pos + d1*rel_x_pos + \
-                  d2*rel_x_pos*rel_x_pos + e1*rel_z_pos*rel_y_pos + e2*rel_z_pos*rel_y_pos*rel_y_pos + e3*rel_z_pos*rel_z_pos*rel_y_pos + \
-                  e4*rel_z_pos*rel_z_pos*rel_y_pos*rel_y_pos + f1*rel_z_pos*rel_x_pos + f2*rel_z_pos*rel_x_pos*rel_x_pos + \
-                  f3*rel_z_pos*rel_z_pos*rel_x_pos + f4*rel_z_pos*rel_z_pos*rel_x_pos*rel_x_pos + g1*rel_y_pos*rel_x_pos + \
-                  g2*rel_y_pos*rel_x_pos*rel_x_pos + g3*rel_y_pos*rel_y_pos*rel_x_pos + g4*rel_y_pos*rel_y_pos*rel_x_pos*rel_x_pos + \
-                  h1*rel_z_pos*rel_y_pos*rel_x_pos + h2*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos + h3*rel_z_pos*rel_z_pos*rel_y_pos*rel_x_pos + \
-                  h4*rel_z_pos*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos + k1*rel_z_pos*rel_y_pos*rel_x_pos*rel_x_pos + \
-                  k2*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos*rel_x_pos + k3*rel_z_pos*rel_z_pos*rel_y_pos*rel_x_pos*rel_x_pos + \
-                  k4*rel_z_pos*rel_z_pos*rel_y_pos*rel_y_pos*rel_x_pos*rel_x_pos;
+            ncc = cc_polynomial_value( CC, coefficients, rel_z_pos, rel_y_pos, rel_x_pos )
 
             return numpy.array( [ rel_z_pos - 1, rel_y_pos - 1, rel_x_pos - 1, ncc, iteration, 0] )
 
@@ -285,7 +368,15 @@ def cc_interpolation_local_2D( im1, im2,    refinement_step_threshold = 0.0001,
           for x in range( 3 ):
             # Calculate the CC just for these two identically sized images.
             CC[ y, x ] = pixel_search.pixel_search( im1, im2[ :, y:y+im1.shape[1], x:x+im1.shape[2] ], 4 )[ 3 ]
-            
+
+        return cc_interpolation_fit_2D( CC, refinement_step_threshold, max_refinement_iterations, max_refinement_step )
+
+
+
+def cc_interpolation_fit_2D( CC, refinement_step_threshold = 0.0001, max_refinement_iterations = 15, max_refinement_step = 2):
+        # Fit of the 3x3 matrix of CC values, either calculated above, or taken
+        #   directly from the CC map of the pixel search (see integer_pixel_search)
+
         # Make sure that our hypothesis that the highest CC is in the middle, this might not work if we have two equal maximum points
         # 2014-10-23 EA:
         #  numpy.where( CC == CC.max() ) returns a list of arrays of x, y, z positions, we're going to turn it into an array itself,
@@ -297,11 +388,11 @@ def cc_interpolation_local_2D( im1, im2,    refinement_step_threshold = 0.0001,
         #                                   |  CCmaxPositions is 1   | | along x,y,z for all() | if ANY max position was at 1,1,1
         if not numpy.all( CCmaxPositions == numpy.array([1,1]).all(), axis=1                 ).any():
             try:
-              logging.log.warning("cc_interpolation_local_2D(): Maximum of CC is not in the middle of the im2.")
-              logging.log.debug("cc_interpolation_local_2D(): numpy.where( CC == CC.max() = {}".format(numpy.where( CC == CC.max() )))
+              logging.log.warning("cc_interpolation_fit_2D(): Maximum of CC is not in the middle of the im2.")
+              logging.log.debug("cc_interpolation_fit_2D(): numpy.where( CC == CC.max() = {}".format(numpy.where( CC == CC.max() )))
             except:
-              print "cc_interpolation_local_2D(): Maximum of CC is not in the middle of the im2."
-              print "cc_interpolation_local_2D(): numpy.where( CC == CC.max() = {}".format(numpy.where( CC == CC.max() ))
+              print "cc_interpolation_fit_2D(): Maximum of CC is not in the middle of the im2."
+              print "cc_interpolation_fit_2D(): numpy.where( CC == CC.max() = {}".format(numpy.where( CC == CC.max() ))
             return numpy.array( [ 0, 0, 0, 0, 0, 128] )
 
         ########################################################################
@@ -324,15 +415,7 @@ def cc_interpolation_local_2D( im1, im2,    refinement_step_threshold = 0.0001,
         #-  cc = a + b1*y + b2*x + c1*y^2 + c2*x^2 + d*y*x + e1*y^2*x + e2*y*x^2 + f* y^2*x^2 --
         #---------------------------------------------------------------------------------------
 
-        b1 = 2.0*CC[1][0] - 0.5*CC[2][0] - 1.5*CC[0][0];
-        b2 = 2.0*CC[0][1] - 0.5*CC[0][2] - 1.5*CC[0][0];
-        c1 = 0.5*CC[0][0] + 0.5*CC[2][0] - CC[1][0];
-        c2 = 0.5*CC[0][0] + 0.5*CC[0][2] - CC[0][1];
-
-        d  = 0.25*( CC[2][2] - 4.0*CC[2][1] - 4.0*CC[1][2] + 16.0*CC[1][1] - 9.0*CC[0][0] - 6.0*b2 - 6.0*b1);
-        e1 = 0.25*(-CC[2][2] + 4.0*CC[2][1] + 2.0*CC[1][2] -  8.0*CC[1][1] + 3.0*CC[0][0] + 2.0*b2 - 6.0*c1);
-        e2 = 0.25*(-CC[2][2] + 4.0*CC[1][2] + 2.0*CC[2][1] -  8.0*CC[1][1] + 3.0*CC[0][0] + 2.0*b1 - 6.0*c2);
-        f  = CC[1][1]-CC[0][0]-b2-c2-b1-c1-d-e2-e1;
+        coefficients = cc_polynomial_coefficients_2D( CC )
 
         #-----------------------------------------------------------------------
         #-  Iteration loop for Newton's method to determine local maximum in  --
@@ -351,8 +434,6 @@ def cc_interpolation_local_2D( im1, im2,    refinement_step_threshold = 0.0001,
         dy=1.0;
         dx=1.0;
 
-        J = numpy.zeros((2, 2))
-
         threshold = refinement_step_threshold*refinement_step_threshold;
         iteration = 0;
 
@@ -368,33 +449,130 @@ def cc_interpolation_local_2D( im1, im2,    refinement_step_threshold = 0.0001,
 
             iteration = iteration + 1
 
-            # Calculating the first derivative
-
-            dccy = b1 + 2.0*c1*rel_y_pos + d*rel_x_pos + 2.0*e1*rel_y_pos*rel_x_pos + e2*rel_x_pos*rel_x_pos + 2.0*f*rel_y_pos*rel_x_pos*rel_x_pos;
-            dccx = b2 + 2.0*c2*rel_x_pos + d*rel_y_pos + e1*rel_y_pos*rel_y_pos + 2.0*e2*rel_y_pos*rel_x_pos + 2.0*f*rel_y_pos*rel_y_pos*rel_x_pos;
-            dccyy = 2.0*c1 + 2.0*e1*rel_x_pos + 2.0*f*rel_x_pos*rel_x_pos;
-            dccxx = 2.0*c2 + 2.0*e2*rel_y_pos + 2.0*f*rel_y_pos*rel_y_pos;
-            dccyx = d + 2.0*e1*rel_y_pos + 2.0*e2*rel_x_pos + 4.0*f*rel_y_pos*rel_x_pos;
-
-            J[0][0]=dccyy;
-            J[1][1]=dccxx;
-            J[0][1]=dccyx;
-            J[1][0]=dccyx;
-
-            detJ= J[0][0]*J[1][1] - J[1][0]*J[0][1];
-
-            #pv([J,detJ])
-
-            dy=-( J[1][1]*dccy - J[1][0]*dccx)/detJ;
-            dx=-(-J[0][1]*dccy + J[0][0]*dccx)/detJ;
+            dy, dx = cc_newton_step_2D( coefficients, rel_y_pos, rel_x_pos )
 
             rel_y_pos = rel_y_pos + dy;
             rel_x_pos = rel_x_pos + dx;
 
-            ncc = CC[0][0] + b2*rel_x_pos + c2*rel_x_pos*rel_x_pos + b1*rel_y_pos + c1*rel_y_pos*rel_y_pos + d*rel_x_pos*rel_y_pos + e2*rel_x_pos*rel_x_pos*rel_y_pos + \
-            e1*rel_x_pos*rel_y_pos*rel_y_pos + f*rel_x_pos*rel_x_pos*rel_y_pos*rel_y_pos;
+            ncc = cc_polynomial_value_2D( CC, coefficients, rel_y_pos, rel_x_pos )
 
         if ( abs(rel_y_pos) <= max_refinement_step and abs(rel_x_pos) <= max_refinement_step):
             return numpy.array( [ 0, rel_y_pos - 1, rel_x_pos - 1, ncc, iteration, 0] )
         else:
-            return numpy.array( [ 0, rel_y_pos - 1, rel_x_pos - 1, 0, iteration, 8 ] )
\ No newline at end of file
+            return numpy.array( [ 0, rel_y_pos - 1, rel_x_pos - 1, 0, iteration, 8 ] )
+
+
+def cc_interpolation_fit_batch( CC, refinement_step_threshold = 0.0001, max_refinement_iterations = 15, max_refinement_step = 2):
+        # cc_interpolation_fit for N nodes at once, CC is N x 3 x 3 x 3.
+        #   The Newton's iterations of all the nodes are done together on arrays, each node leaving the loop
+        #   (as in cc_interpolation_fit) when its steps are below the threshold, when it has done
+        #   max_refinement_iterations or when it has gone further than 2 times max_refinement_step.
+        #   Returns N rows [ z, y, x, ncc, iterations, error ], the same as cc_interpolation_fit for each node
+        CC = numpy.asarray( CC ).reshape( -1, 3, 3, 3 )
+        nNodes = CC.shape[0]
+        fits = numpy.zeros( ( nNodes, 6 ) )
+
+        # Same hypothesis as cc_interpolation_fit: (one of) the highest CC is in the middle
+        centred = CC[ :, 1, 1, 1 ] == CC.reshape( nNodes, -1 ).max( axis=1 )
+        if not centred.all():
+            try: logging.log.warning("cc_interpolation_fit_batch(): Maximum of CC is not in the middle of the im2 for {} nodes.".format( ( ~centred ).sum() ))
+            except: print "cc_interpolation_fit_batch(): Maximum of CC is not in the middle of the im2 for {} nodes.".format( ( ~centred ).sum() )
+        fits[ ~centred, 5 ] = 128
+
+        # A singular Jacobian gives NaN steps and positions, the node then leaves the loop with error 8 as in cc_interpolation_fit
+        with numpy.errstate( divide='ignore', invalid='ignore' ):
+
+            coefficients = cc_polynomial_coefficients( CC )
+
+            # Starting relative position is taken close to the centre, steps set to 1 to enter the loop
+            rel_z_pos = numpy.ones( nNodes ) * 1.1
+            rel_y_pos = numpy.ones( nNodes ) * 1.1
+            rel_x_pos = numpy.ones( nNodes ) * 1.1
+            dx = numpy.ones( nNodes )
+            dy = numpy.ones( nNodes )
+            dz = numpy.ones( nNodes )
+
+            threshold = refinement_step_threshold*refinement_step_threshold
+            iteration = numpy.zeros( nNodes, dtype=int )
+
+            active = centred.copy()
+            while True:
+                active &= ( iteration < max_refinement_iterations ) & \
+                          numpy.logical_not( ( dx*dx < threshold ) & ( dy*dy < threshold ) & ( dz*dz < threshold ) ) & \
+                          ( abs( rel_z_pos ) <= 2*max_refinement_step ) & ( abs( rel_y_pos ) <= 2*max_refinement_step ) & ( abs( rel_x_pos ) <= 2*max_refinement_step )
+                nodes = numpy.where( active )[0]
+                if len( nodes ) == 0: break
+
+                iteration[ nodes ] += 1
+
+                dx[ nodes ], dy[ nodes ], dz[ nodes ] = cc_newton_step( [ coefficient[ nodes ] for coefficient in coefficients ], \
+                                                                        rel_z_pos[ nodes ], rel_y_pos[ nodes ], rel_x_pos[ nodes ] )
+
+                rel_z_pos[ nodes ] += dx[ nodes ]
+                rel_y_pos[ nodes ] += dy[ nodes ]
+                rel_x_pos[ nodes ] += dz[ nodes ]
+
+            inside = centred & ( abs( rel_z_pos ) <= max_refinement_step ) & ( abs( rel_y_pos ) <= max_refinement_step ) & ( abs( rel_x_pos ) <= max_refinement_step )
+            ncc    = cc_polynomial_value( CC, coefficients, rel_z_pos, rel_y_pos, rel_x_pos )
+
+        fits[ centred, 0 ] = rel_z_pos[ centred ] - 1
+        fits[ centred, 1 ] = rel_y_pos[ centred ] - 1
+        fits[ centred, 2 ] = rel_x_pos[ centred ] - 1
+        fits[ centred, 4 ] = iteration[ centred ]
+        fits[ inside,  3 ] = ncc[ inside ]
+        fits[ centred & numpy.logical_not( inside ), 5 ] = 8
+
+        return fits
+
+
+
+def cc_interpolation_fit_2D_batch( CC, refinement_step_threshold = 0.0001, max_refinement_iterations = 15, max_refinement_step = 2):
+        # cc_interpolation_fit_2D for N nodes at once, CC is N x 3 x 3, as cc_interpolation_fit_batch.
+        #   Returns N rows [ 0, y, x, ncc, iterations, error ], the same as cc_interpolation_fit_2D for each node
+        CC = numpy.asarray( CC ).reshape( -1, 3, 3 )
+        nNodes = CC.shape[0]
+        fits = numpy.zeros( ( nNodes, 6 ) )
+
+        centred = CC[ :, 1, 1 ] == CC.reshape( nNodes, -1 ).max( axis=1 )
+        if not centred.all():
+            try: logging.log.warning("cc_interpolation_fit_2D_batch(): Maximum of CC is not in the middle of the im2 for {} nodes.".format( ( ~centred ).sum() ))
+            except: print "cc_interpolation_fit_2D_batch(): Maximum of CC is not in the middle of the im2 for {} nodes.".format( ( ~centred ).sum() )
+        fits[ ~centred, 5 ] = 128
+
+        with numpy.errstate( divide='ignore', invalid='ignore' ):
+
+            coefficients = cc_polynomial_coefficients_2D( CC )
+
+            rel_y_pos = numpy.ones( nNodes ) * 1.1
+            rel_x_pos = numpy.ones( nNodes ) * 1.1
+            dy = numpy.ones( nNodes )
+            dx = numpy.ones( nNodes )
+
+            threshold = refinement_step_threshold*refinement_step_threshold
+            iteration = numpy.zeros( nNodes, dtype=int )
+
+            active = centred.copy()
+            while True:
+                active &= ( iteration < max_refinement_iterations ) & \
+                          numpy.logical_not( ( dx*dx < threshold ) & ( dy*dy < threshold ) ) & \
+                          ( abs( rel_y_pos ) <= 2*max_refinement_step ) & ( abs( rel_x_pos ) <= 2*max_refinement_step )
+                nodes = numpy.where( active )[0]
+                if len( nodes ) == 0: break
+
+                iteration[ nodes ] += 1
+
+                dy[ nodes ], dx[ nodes ] = cc_newton_step_2D( [ coefficient[ nodes ] for coefficient in coefficients ], rel_y_pos[ nodes ], rel_x_pos[ nodes ] )
+
+                rel_y_pos[ nodes ] += dy[ nodes ]
+                rel_x_pos[ nodes ] += dx[ nodes ]
+
+            inside = centred & ( abs( rel_y_pos ) <= max_refinement_step ) & ( abs( rel_x_pos ) <= max_refinement_step )
+            ncc    = cc_polynomial_value_2D( CC, coefficients, rel_y_pos, rel_x_pos )
+
+        fits[ centred, 1 ] = rel_y_pos[ centred ] - 1
+        fits[ centred, 2 ] = rel_x_pos[ centred ] - 1
+        fits[ centred, 4 ] = iteration[ centred ]
+        fits[ inside,  3 ] = ncc[ inside ]
+        fits[ centred & numpy.logical_not( inside ), 5 ] = 8
+
+        return fits
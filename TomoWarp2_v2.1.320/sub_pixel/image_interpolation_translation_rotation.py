@@ -42,12 +42,17 @@ INPUTS:
   im1 will stay still and im2 will be translated +- 1 pixel using an optimisation approach.
 - translation initial guess ( z,y,x )
 - INTERPOLATION describing the type of interpolation to use (nearest neighbour, tri-linear, tri-cubic)
+- optimisation mode: one of the methods of scipy.optimize.minimize, "subPixelSearch", "Gauss-Newton"
+  for the inverse-compositional Gauss-Newton of gauss_newton_translation_rotation(), or "adaptiveSubPixelSearch"
+  for the coarse-to-fine grid search of adaptive_sub_pixel_search()
+- adaptiveTolerance: relative gain of 1 - NCC below which adaptive_sub_pixel_search() stops refining
 
 OUTPUTS:
  1. list with subpixel displacements and NCC
 """
 
 import numpy
+import logging
 
 # Why this function and not the pixel_search in C?
 from tools.calculate_cc import calculate_ncc
@@ -66,6 +71,10 @@ interpolationMode = "map_coordinates"
 global I
 I = 0
 
+# Coordinates of im1 (relative to its middle) and middle, for each shape of im1 and corner offset.
+#   They are the same for all the nodes, so each worker builds them once
+coordinatesCache = {}
+
 def normalise( vector ):
     norm = numpy.linalg.norm( vector )
     if norm > 0:
@@ -97,7 +106,63 @@ def axis_and_angle_to_rotation_matrix_3d( rot_ax, rot_ang_rad ):
 
 
 
-def translation_rotation_to_ncc( x0, im1, im2, coordinates, coordinatesMiddle, interpolationMode, interpolationOrder):
+def rotation_matrix_to_rotation_vector( R ):
+    # Inverse of axis_and_angle_to_rotation_matrix_3d: the rotation vector (axis times angle) of a rotation matrix
+    rot_ang_rad = numpy.arccos( numpy.clip( ( numpy.trace( R ) - 1 ) / 2.0, -1, 1 ) )
+
+    if rot_ang_rad < 0.0001:
+      return numpy.array( [ 0.0, 0.0, 0.0 ] )
+
+    rot_ax = numpy.array( [ R[2,1] - R[1,2], R[0,2] - R[2,0], R[1,0] - R[0,1] ] ) / ( 2 * numpy.sin( rot_ang_rad ) )
+
+    return rot_ax * rot_ang_rad
+
+
+
+def window_coordinates( im1Dim, cornerOffset ):
+    # Coordinates of the voxels of im1 in im2 relative to the middle of im1 ( 3 x number of voxels ), and the middle,
+    #   taken from coordinatesCache if this shape and corner offset have already been seen. They are read-only.
+    key = ( tuple( [ int( n ) for n in im1Dim ] ), float( cornerOffset ) )
+
+    if key not in coordinatesCache:
+        im1Dim = numpy.array( key[0] )
+
+        coordinatesInitial = numpy.zeros( ( 3, im1Dim[0] *  im1Dim[1] *  im1Dim[2] ), dtype='<f4' )
+
+        # Build an initial coordinates array aligned with im1, which means
+        #   a) of dimensions of im1
+        #   b) starting from the corner offset
+        coordinates_mgrid = numpy.mgrid[  cornerOffset:im1Dim[0]+cornerOffset,\
+                                          cornerOffset:im1Dim[1]+cornerOffset,\
+                                          cornerOffset:im1Dim[2]+cornerOffset ]
+
+        # In order to facilitate rotation calculation, put the origin in the middle of the volume
+        # 1. calculate the offset:
+        coordinatesMiddle = numpy.floor( im1Dim / 2.0 ) + cornerOffset
+
+        # 2. subtract from coordinates (it will be added back in translation_rotation_to_ncc)
+        coordinatesInitial[0,:] =  coordinates_mgrid[0].flat - coordinatesMiddle[0]
+        coordinatesInitial[1,:] =  coordinates_mgrid[1].flat - coordinatesMiddle[1]
+        coordinatesInitial[2,:] =  coordinates_mgrid[2].flat - coordinatesMiddle[2]
+
+        coordinatesInitial.flags.writeable = False
+        coordinatesMiddle.flags.writeable  = False
+        coordinatesCache[ key ] = [ coordinatesInitial, coordinatesMiddle ]
+
+    return coordinatesCache[ key ]
+
+
+def buffer( buffers, name, shape, dtype ):
+    # Array "name" of the dictionary buffers, allocated the first time it is asked for
+    #   (a new array each time if there is no dictionary)
+    if buffers is None:
+        return numpy.empty( shape, dtype=dtype )
+    if name not in buffers:
+        buffers[ name ] = numpy.empty( shape, dtype=dtype )
+    return buffers[ name ]
+
+
+def translation_rotation_to_ncc( x0, im1, im2, coordinates, coordinatesMiddle, interpolationMode, interpolationOrder, buffers=None ):
     ## 2012.02.29 - big function which takes an interpolated reference image,
     ##   a deformed image volume, a translation and a rotation (defines as 3 angles).
     ##
@@ -105,15 +170,16 @@ def translation_rotation_to_ncc( x0, im1, im2, coordinates, coordinatesMiddle, i
     ##       2. transform coodinate system
     ##       3. look up interploated image with new coordinate system
     ##       4. calculate ncc between ref_deformed and def
-
-    newCoordinates = coordinates.copy()
+    ##
+    ## buffers is a dictionary in which the arrays of the transformed coordinates and of the interpolated im2
+    ##   are kept from one call to the next for the same node, instead of being allocated at each call
 
     if len( x0 ) == 2:
         Rot = False
         # add back in the third, false, z dimension
         x0 = numpy.array( [ 0, x0[0], x0[1] ] )
         dimension = 2
-    if len( x0 ) == 3:
+    elif len( x0 ) == 3:
         # In the future, for rotation in 2D this will also be three components, so we'll have to pass a dimensionality, or a more general description of the deformation to apply
         Rot = False
         dimension = 3
@@ -123,6 +189,10 @@ def translation_rotation_to_ncc( x0, im1, im2, coordinates, coordinatesMiddle, i
 
     displacementVector = numpy.array( x0[0:3] )
 
+    if not Rot:
+        newCoordinates = buffer( buffers, "translation", coordinates.shape, coordinates.dtype )
+        newCoordinates[...] = coordinates
+
     if Rot:
         rotationVector     = numpy.array( x0[3:6] )
 
@@ -133,7 +203,9 @@ def translation_rotation_to_ncc( x0, im1, im2, coordinates, coordinatesMiddle, i
         rotationAxis   = normalise( rotationVector )
 
         ## Rotate each point
-        newCoordinates = numpy.dot(  axis_and_angle_to_rotation_matrix_3d( rotationAxis, rotationAngle ), coordinates )
+        rotationMatrix = axis_and_angle_to_rotation_matrix_3d( rotationAxis, rotationAngle )
+        newCoordinates = buffer( buffers, "rotation", coordinates.shape, numpy.result_type( rotationMatrix, coordinates ) )
+        numpy.dot(  rotationMatrix, coordinates, out=newCoordinates )
 
     ## Move origin back + displacement.
     newCoordinates[0,:] += coordinatesMiddle[0] + displacementVector[0]
@@ -150,10 +222,12 @@ def translation_rotation_to_ncc( x0, im1, im2, coordinates, coordinatesMiddle, i
             im2deformed[n] = im2.ip( coord  )
 
     if interpolationMode == "map_coordinates":
+        # im2 is already spline filtered for orders higher than 1, see image_interpolation_translation_rotation()
+        im2deformed = buffer( buffers, "deformed", coordinates.shape[1:], im2.dtype )
         if dimension == 2:
-            im2deformed = scipy.ndimage.map_coordinates( im2[0], newCoordinates[1:3], order=interpolationOrder, prefilter=False )
+            scipy.ndimage.map_coordinates( im2[0], newCoordinates[1:3], output=im2deformed, order=interpolationOrder, prefilter=False )
         else:
-            im2deformed = scipy.ndimage.map_coordinates( im2, newCoordinates, order=interpolationOrder, prefilter=False )
+            scipy.ndimage.map_coordinates( im2, newCoordinates, output=im2deformed, order=interpolationOrder, prefilter=False )
 
     global I
 
@@ -165,7 +239,153 @@ def translation_rotation_to_ncc( x0, im1, im2, coordinates, coordinatesMiddle, i
 
 
 
-def image_interpolation_translation_rotation( im1, im2, initialGuess=None, cornerOffset=numpy.nan, interpolationMode="map_coordinates", interpolationOrder=3, optimisationMode="Powell" ):
+def gauss_newton_translation_rotation( im1, im2, initialGuess, coordinates, coordinatesMiddle, interpolationOrder, maxIterations=50, tolerance=0.0001 ):
+    ## Inverse-compositional Gauss-Newton, for a translation (2D or 3D) or a translation and a rotation (3D, 6 components):
+    ##   minimises the sum of the squared differences between im1 and the interpolated im2, each normalised
+    ##   by its norm, which is 2 ( 1 - NCC ) with the NCC of translation_rotation_to_ncc.
+    ##
+    ## Plan: 1. gradient of the normalised im1, steepest descent images and Hessian, once for the node
+    ##       2. at each iteration interpolate im2 once with the current transformation and find the
+    ##            increment of the transformation of im1 that best explains the difference
+    ##       3. compose the current transformation with the inverse of the increment, until the
+    ##            increment is smaller than tolerance
+    ##
+    ## Returns [ x, ncc, iterations, error ] as image_interpolation_translation_rotation,
+    ##   error is 8 if the transformation takes im1 out of im2 or if it can not be found (flat im1)
+
+    twoD     = ( im1.shape[0] == 1 and im2.shape[0] == 1 )
+    Rot      = ( len( initialGuess ) == 6 )
+    # Dimensions that are transformed
+    if twoD: axes = [ 1, 2 ]
+    else:    axes = [ 0, 1, 2 ]
+
+    def result( x, ncc, iterations, error ):
+        if twoD: return [ [ 0, x[0], x[1] ], ncc, iterations, error ]
+        else:    return [                x, ncc, iterations, error ]
+
+    coordinates = numpy.asarray( coordinates, dtype='<f8' )
+    im1         = numpy.asarray( im1, dtype='<f8' )
+    im1Norm     = numpy.sqrt( ( im1**2 ).sum() )
+    if im1Norm == 0:
+        return result( numpy.array( initialGuess, dtype='<f8' ), 0.0, 0, 8 )
+    template    = im1.ravel() / im1Norm
+
+    # === Step 1: steepest descent images and Hessian, at the identity transformation of im1 ===
+    if twoD: gradient = numpy.array( numpy.gradient( im1[0] / im1Norm ) ).reshape( 2, -1 )
+    else:    gradient = numpy.array( numpy.gradient( im1 / im1Norm ) ).reshape( 3, -1 )
+
+    # d( R x ) / d( rotation vector ) = - [x]x, so the rotation columns are x ^ gradient
+    if Rot: steepestDescent = numpy.vstack( ( gradient, numpy.cross( coordinates.T, gradient.T ).T ) )
+    else:   steepestDescent = gradient
+
+    # Derivative of the normalised im1: the component along im1 is removed, it only changes its norm
+    steepestDescent = steepestDescent - numpy.outer( numpy.dot( steepestDescent, template ), template )
+
+    hessian = numpy.dot( steepestDescent, steepestDescent.T )
+
+    # Current transformation: im1 coordinate x (relative to the middle) goes to R x + middle + translation in im2
+    translation    = numpy.array( initialGuess[ 0:len( axes ) ], dtype='<f8' )
+    rotationMatrix = numpy.eye( 3 )
+    if Rot:
+        rotationVector = numpy.array( initialGuess[ 3:6 ], dtype='<f8' )
+        rotationMatrix = axis_and_angle_to_rotation_matrix_3d( normalise( rotationVector ), numpy.sqrt( numpy.vdot( rotationVector, rotationVector ) ) )
+
+    def interpolate_im2( ):
+        # im2 interpolated at the transformed coordinates of im1, None if they are not all inside im2
+        newCoordinates = numpy.dot( rotationMatrix, coordinates )[ axes ]
+        for n, axis in enumerate( axes ):
+            newCoordinates[n] += coordinatesMiddle[ axis ] + translation[n]
+            if newCoordinates[n].min() < 0 or newCoordinates[n].max() > im2.shape[ axis ] - 1:
+                return None
+        if twoD: return scipy.ndimage.map_coordinates( im2[0], newCoordinates, order=interpolationOrder, prefilter=False )
+        else:    return scipy.ndimage.map_coordinates( im2,    newCoordinates, order=interpolationOrder, prefilter=False )
+
+    def parameters( ):
+        if Rot: return numpy.hstack( ( translation, rotation_matrix_to_rotation_vector( rotationMatrix ) ) )
+        else:   return translation.copy()
+
+    # === Step 2 and 3: iterations ===
+    iteration = 0
+    while iteration < maxIterations:
+        iteration += 1
+
+        im2Deformed = interpolate_im2( )
+        if im2Deformed is None:
+            return result( parameters(), 0.0, iteration, 8 )
+
+        im2Norm = numpy.sqrt( ( im2Deformed**2 ).sum() )
+        if im2Norm == 0:
+            return result( parameters(), 0.0, iteration, 8 )
+
+        try:
+            increment = numpy.linalg.solve( hessian, numpy.dot( steepestDescent, im2Deformed / im2Norm - template ) )
+        except numpy.linalg.LinAlgError:
+            return result( parameters(), 0.0, iteration, 8 )
+
+        # Inverse composition: x -> R ( Rinc^T ( x - tinc ) ) + t
+        if Rot:
+            rotationMatrix = numpy.dot( rotationMatrix, axis_and_angle_to_rotation_matrix_3d( normalise( increment[3:6] ), numpy.sqrt( numpy.vdot( increment[3:6], increment[3:6] ) ) ).T )
+            translation    = translation - numpy.dot( rotationMatrix, increment[0:3] )
+        else:
+            translation    = translation - increment
+
+        if numpy.abs( increment ).max() < tolerance:
+            break
+
+    # NCC at the final transformation, the same as the other optimisation modes
+    im2Deformed = interpolate_im2( )
+    if im2Deformed is None:
+        return result( parameters(), 0.0, iteration, 8 )
+
+    return result( parameters(), calculate_ncc( im1.ravel(), im2Deformed ), iteration, 0 )
+
+
+
+def adaptive_sub_pixel_search( oneMinusNCC, nDimensions, searchRange=1.0, startStep=0.5, resolution=0.01, relativeTolerance=0.001 ):
+    ## Coarse-to-fine grid search of the translation that minimises oneMinusNCC( translation ), within +- searchRange:
+    ##   a grid of startStep over the whole range, then grids of +- one step around the best point, halving the step,
+    ##   until the step is smaller than resolution, or until two levels in a row improve 1 - NCC by less than
+    ##   relativeTolerance of its value (a single level often does not improve at all, when the best point is
+    ##   still the centre of the finer grid). The points already evaluated are not evaluated again.
+    ##
+    ## Returns [ best translation, its 1 - NCC, number of evaluations ]
+
+    evaluations = {}
+
+    def best_of( points ):
+        for point in points:
+            # the points of the grids are sums of powers of 2, rounding only merges identical points
+            key = tuple( numpy.round( point, 9 ) )
+            if key not in evaluations and numpy.all( numpy.abs( point ) <= searchRange ):
+                evaluations[ key ] = oneMinusNCC( numpy.array( point ) )
+        key = min( evaluations, key=evaluations.get )
+        return numpy.array( key ), evaluations[ key ]
+
+    def grid( centre, step, halfWidth ):
+        offsets = numpy.mgrid[ [ slice( -halfWidth, halfWidth + 1 ) ] * nDimensions ].reshape( nDimensions, -1 ).T
+        return centre + step * offsets
+
+    step = float( startStep )
+    best, bestValue = best_of( grid( numpy.zeros( nDimensions ), step, int( round( searchRange / step ) ) ) )
+
+    smallGains = 0
+    while step > resolution:
+        step = step / 2.0
+        previousValue = bestValue
+        best, bestValue = best_of( grid( best, step, 1 ) )
+
+        if previousValue - bestValue < relativeTolerance * previousValue:
+            smallGains += 1
+            if smallGains == 2:
+                break
+        else:
+            smallGains = 0
+
+    return [ best, bestValue, len( evaluations ) ]
+
+
+
+def image_interpolation_translation_rotation( im1, im2, initialGuess=None, cornerOffset=numpy.nan, interpolationMode="map_coordinates", interpolationOrder=3, optimisationMode="Powell", adaptiveTolerance=0.001 ):
       # === Step 1: Measure the dimensions of image 1 ===
       im1Dim = numpy.array( im1.shape )
       im2Dim = numpy.array( im2.shape )
@@ -179,42 +399,37 @@ def image_interpolation_translation_rotation( im1, im2, initialGuess=None, corne
           else:
               boundaryLimits  = ( ( -1, 1 ), ( -1, 1 ), ( -1, 1 ) )
       else:
+          Rot = True
           boundaryLimits = ( ( -1, 1 ), ( -1, 1 ), ( -1, 1 ), ( -numpy.pi, numpy.pi ), ( -numpy.pi, numpy.pi ), ( -numpy.pi, numpy.pi ) )
 
       # 2015-12-17 EA: case condition for 2D
       if not ( im1Dim[0] == 1 and im2Dim[0] == 1 and ( im2Dim[1] - im1Dim[1] ) == 2*cornerOffset and ( im2Dim[2] - im1Dim[2] ) == 2*cornerOffset ) and not all( ( im2Dim - im1Dim ) == 2*cornerOffset ):
-          loging.log.warning("image_interpolation_translation_rotation(): (im2Dim - im1Dim) should be 2*cornerOffset but it is {}".format((im2Dim - im1Dim)))
+          try: logging.log.warning("image_interpolation_translation_rotation(): (im2Dim - im1Dim) should be 2*cornerOffset but it is {}".format((im2Dim - im1Dim)))
+          except: print "image_interpolation_translation_rotation(): (im2Dim - im1Dim) should be 2*cornerOffset but it is {}".format((im2Dim - im1Dim))
           if Rot:
               return [ [ 0.0, 0.0, 0.0, 0.0, 0.0, 0.0 ], 0.0, numpy.NaN, 32 ]
           else:
               return [ [ 0.0, 0.0, 0.0 ], 0.0, numpy.NaN, 32 ]
 
-      # === Step 2: Generate the list of coordinates for im1 ===
-      # This commented block should make you a "coordinates" array given the size of the image.
-      coordinatesInitial = numpy.zeros( ( 3, im1Dim[0] *  im1Dim[1] *  im1Dim[2] ), dtype='<f4' )
-
-      # Build an initial coordinates array aligned with im1, which means
-      #   a) of dimensions of im1
-      #   b) starting from the corner offset
-      coordinates_mgrid = numpy.mgrid[  cornerOffset:im1Dim[0]+cornerOffset,\
-                                        cornerOffset:im1Dim[1]+cornerOffset,\
-                                        cornerOffset:im1Dim[2]+cornerOffset ]
-
-      # In order to facilitate rotation calculation, put the origin in the middle of the volume
-      # 1. calculate the offset:
-      coordinatesMiddle = numpy.floor( im1Dim / 2.0 ) + cornerOffset
+      # === Step 2: Get the list of coordinates for im1 ===
+      coordinatesInitial, coordinatesMiddle = window_coordinates( im1Dim, cornerOffset )
 
-      # 2. subtract from coordinates (it will be added back in the function above)
-      coordinatesInitial[0,:] =  coordinates_mgrid[0].flat - coordinatesMiddle[0]
-      coordinatesInitial[1,:] =  coordinates_mgrid[1].flat - coordinatesMiddle[1]
-      coordinatesInitial[2,:] =  coordinates_mgrid[2].flat - coordinatesMiddle[2]
-
-      del coordinates_mgrid
+      # Arrays of translation_rotation_to_ncc, reused by all its evaluations for this node
+      buffers = {}
+      im1Flat = im1.ravel()
 
       if interpolationMode == "pytricubic":
           # float is required for passage to C++ boost libs
           im2 = tricubic.tricubic( list(im2.astype('float')), list(im2Dim) )
 
+      elif interpolationOrder > 1:
+          # map_coordinates is called with prefilter=False, so the spline coefficients of im2 are computed
+          #   once here for all the interpolations of this node (in 2D only along y and x)
+          if im1Dim[0] == 1 and im2Dim[0] == 1:
+              im2 = scipy.ndimage.spline_filter( im2[0], order=interpolationOrder )[ numpy.newaxis ]
+          else:
+              im2 = scipy.ndimage.spline_filter( im2, order=interpolationOrder )
+
       if optimisationMode in [ "Nelder-Mead", "Powell", "CG", "BFGS", "Newton-CG", "L-BFGS-B", "TNC", "COBYLA", "SLSQP", "dogleg", "trust-ncg" ]:
           if optimisationMode == 'BFGS':
               myOptions = {'maxiter': 256, 'disp': False, 'eps': 0.25 }
@@ -225,7 +440,7 @@ def image_interpolation_translation_rotation( im1, im2, initialGuess=None, corne
               myOptions = {'maxiter': 256, 'disp': False }
           returns = scipy.optimize.minimize(  translation_rotation_to_ncc,    \
                                               initialGuess,                   \
-                                              args    = ( im1.flat, im2, coordinatesInitial, coordinatesMiddle, interpolationMode, interpolationOrder ),\
+                                              args    = ( im1Flat, im2, coordinatesInitial, coordinatesMiddle, interpolationMode, interpolationOrder, buffers ),\
                                               method  = optimisationMode,     \
                                               bounds  = boundaryLimits,       \
                                               tol     = 0.0001,               \
@@ -245,23 +460,47 @@ def image_interpolation_translation_rotation( im1, im2, initialGuess=None, corne
               else:
                   return [                        returns.x, 1 - returns.fun, None, 0 ]
 
+      elif optimisationMode == "Gauss-Newton":
+          # Only with map_coordinates interpolation
+          return gauss_newton_translation_rotation( im1, im2, initialGuess, coordinatesInitial, coordinatesMiddle, interpolationOrder )
+
       elif optimisationMode == "subPixelSearch":
           subPixelSearchRange = numpy.arange( -1,1.1,0.1 )
           ccMatrix = numpy.zeros( ( len(subPixelSearchRange), len(subPixelSearchRange), len(subPixelSearchRange) ) )
           for nz, dz in enumerate( subPixelSearchRange ) :
             for ny, dy in enumerate( subPixelSearchRange ) :
               for nx, dx in enumerate( subPixelSearchRange ) :
-                ccMatrix[ nz, ny, nx ] = translation_rotation_to_ncc( [ dz, dy, dx ], im1.flat, im2, coordinatesInitial, coordinatesMiddle, interpolationMode, interpolationOrder)
+                ccMatrix[ nz, ny, nx ] = translation_rotation_to_ncc( [ dz, dy, dx ], im1Flat, im2, coordinatesInitial, coordinatesMiddle, interpolationMode, interpolationOrder, buffers )
 
           cc = 1 - ccMatrix.min()
           z  = subPixelSearchRange[ numpy.where( ccMatrix == ccMatrix.min() )[0] ][0]
           y  = subPixelSearchRange[ numpy.where( ccMatrix == ccMatrix.min() )[1] ][0]
           x  = subPixelSearchRange[ numpy.where( ccMatrix == ccMatrix.min() )[2] ][0]
-          loging.log.debug( "image_interpolation_translation_rotation: subPixelSearch: Min CC: {}".format(cc))
-          loging.log.debug( "image_interpolation_translation_rotation: subPixelSearch: Min CC location: {} {} {}".format(x, y, z) ) 
+          try:
+              logging.log.debug( "image_interpolation_translation_rotation: subPixelSearch: Min CC: {}".format(cc))
+              logging.log.debug( "image_interpolation_translation_rotation: subPixelSearch: Min CC location: {} {} {}".format(x, y, z) )
+          except: pass
 
           return [ [ z, y, x,0,0,0 ], cc, len(subPixelSearchRange)**3, 0 ]
 
+      elif optimisationMode == "adaptiveSubPixelSearch":
+          # Translation only, the rotation (if any) stays the one of the initial guess
+          if Rot:
+              rotationGuess = numpy.array( initialGuess[3:6], dtype='<f8' )
+              oneMinusNCC   = lambda translation: translation_rotation_to_ncc( numpy.hstack( ( translation, rotationGuess ) ), im1Flat, im2, coordinatesInitial, coordinatesMiddle, interpolationMode, interpolationOrder, buffers )
+          else:
+              oneMinusNCC   = lambda translation: translation_rotation_to_ncc( translation, im1Flat, im2, coordinatesInitial, coordinatesMiddle, interpolationMode, interpolationOrder, buffers )
+
+          translation, oneMinusCC, evaluations = adaptive_sub_pixel_search( oneMinusNCC, len( initialGuess[0:3] ), relativeTolerance=adaptiveTolerance )
+
+          # Same components as the other optimisation modes
+          if im1Dim[0] == 1 and im2Dim[0] == 1:
+              return [ [ 0, translation[0], translation[1] ], 1 - oneMinusCC, evaluations, 0 ]
+          elif Rot:
+              return [ numpy.hstack( ( translation, rotationGuess ) ), 1 - oneMinusCC, evaluations, 0 ]
+          else:
+              return [ translation, 1 - oneMinusCC, evaluations, 0 ]
+
       else:
           try: logging.log.error("image_interpolation_translation_rotation: optimisation mode \"{}\" unknown".format( optimisationMode ) )
           except: print "image_interpolation_translation_rotation: optimisation mode \"{}\" unknown".format( optimisationMode ) 
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016, Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+# This file is part of TomoWarp2.
+#
+# TomoWarp2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TomoWarp2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TomoWarp2.  If not, see <http://www.gnu.org/licenses/>.
+
+# ===================================================================
+# ===========================  TomoWarp2  ===========================
+# ===================================================================
+
+# Authors: Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+"""
+Regression tests of TomoWarp2, run from the TomoWarp2 directory with:
+  python -m unittest discover -s tests -t .
+
+The tests only use small synthetic images (and temporary files), not the examples.
+"""
+
+import logging
+
+# The modules log through logging.log as in TomoWarp2.py, keep the tests quiet
+logging.log = logging.getLogger( 'info' )
+logging.log.addHandler( logging.NullHandler() )
+logging.log.propagate = False
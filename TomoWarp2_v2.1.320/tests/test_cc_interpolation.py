@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016, Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+# This file is part of TomoWarp2.
+#
+# TomoWarp2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TomoWarp2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TomoWarp2.  If not, see <http://www.gnu.org/licenses/>.
+
+# ===================================================================
+# ===========================  TomoWarp2  ===========================
+# ===================================================================
+
+# Authors: Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+"""
+The CC interpolation of N nodes at once (cc_interpolation_fit_batch) gives the same result as
+  cc_interpolation_fit node by node, including the nodes with errors 8 and 128
+"""
+
+import unittest
+import numpy
+
+from sub_pixel.cc_interpolation import cc_interpolation_fit, cc_interpolation_fit_batch, \
+                                       cc_interpolation_fit_2D, cc_interpolation_fit_2D_batch
+
+
+def quadratic_peak( offset, curvature=0.05 ):
+    # CC values around a quadratic peak at offset from the centre of the 3x3x3 (or 3x3) neighbourhood
+    grid = numpy.indices( ( 3, ) * len( offset ) ) - 1.0
+    return 0.9 - curvature * sum( [ ( grid[i] - offset[i] )**2 for i in range( len( offset ) ) ] )
+
+
+def neighbourhoods( nDimensions, seed=0 ):
+    # Quadratic peaks, whose fit is exact, and random neighbourhoods, most of them with the maximum
+    #   in the middle (some giving error 8) and the others not (error 128)
+    numpy.random.seed( seed )
+    shape  = ( 3, ) * nDimensions
+    peaks  = [ quadratic_peak( numpy.random.uniform( -0.45, 0.45, nDimensions ) ) for n in range( 20 ) ]
+    random = numpy.random.rand( 300, *shape )
+    middle = ( slice( 0, 200 ), ) + ( 1, ) * nDimensions
+    random[ middle ] = random[ :200 ].reshape( 200, -1 ).max( axis=1 ) + 0.01
+    return numpy.concatenate( ( numpy.array( peaks ), random ) )
+
+
+class TestCCInterpolationBatch( unittest.TestCase ):
+
+    def check_batch( self, CC, fit, fitBatch ):
+        fits = numpy.array( [ fit( neighbourhood ) for neighbourhood in CC ] )
+
+        # All the paths are tested
+        self.assertTrue( ( fits[:,5] == 0 ).any() )
+        self.assertTrue( ( fits[:,5] == 8 ).any() )
+        self.assertTrue( ( fits[:,5] == 128 ).any() )
+
+        numpy.testing.assert_allclose( fitBatch( CC ), fits, rtol=1e-10, atol=1e-12 )
+
+    def test_batch_3D( self ):
+        self.check_batch( neighbourhoods( 3 ), cc_interpolation_fit, cc_interpolation_fit_batch )
+
+    def test_batch_2D( self ):
+        self.check_batch( neighbourhoods( 2 ), cc_interpolation_fit_2D, cc_interpolation_fit_2D_batch )
+
+    def test_quadratic_peak( self ):
+        # The fit of a quadratic peak is its position
+        offset = numpy.array( [ 0.3, -0.2, 0.1 ] )
+        fits   = cc_interpolation_fit_batch( quadratic_peak( offset )[ numpy.newaxis ] )
+        numpy.testing.assert_allclose( fits[ 0, 0:3 ], offset, atol=1e-4 )
+        self.assertAlmostEqual( fits[ 0, 3 ], 0.9, places=6 )
+        self.assertEqual( fits[ 0, 5 ], 0 )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016, Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+# This file is part of TomoWarp2.
+#
+# TomoWarp2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TomoWarp2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TomoWarp2.  If not, see <http://www.gnu.org/licenses/>.
+
+# ===================================================================
+# ===========================  TomoWarp2  ===========================
+# ===================================================================
+
+# Authors: Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+"""
+The chunked volumes (tools/chunked_volume.py): any extent read with read_chunked_extent() is the same
+  as in the images they were converted from, across the boundaries of the blocks
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import itertools
+import numpy
+
+from tools.chunked_volume import convert_to_chunked
+from tools.read_images import read_chunked_extent, read_chunked_3D, read_chunked_index, chunked_block_name
+
+
+class TestChunkedVolume( unittest.TestCase ):
+
+    def setUp( self ):
+        # RAW volume of 13 x 9 x 10 voxels, slices 3 to 12 converted in blocks of 4^3 (the last blocks are not full)
+        self.directory = tempfile.mkdtemp()
+        self.volume    = numpy.arange( 13 * 9 * 10, dtype='<u2' ).reshape( 13, 9, 10 )
+        self.volume.tofile( os.path.join( self.directory, "volume.raw" ) )
+        self.chunked   = os.path.join( self.directory, "volume.twc" )
+        convert_to_chunked( '<u2', "RAW", [ 13, 9, 10 ], self.directory, "volume", 0, ".raw", [ 3, 12 ], self.chunked, chunkSize=4 )
+
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+
+    def test_index( self ):
+        index = read_chunked_index( self.chunked )
+        self.assertEqual( index[ "shape" ], [ 10, 9, 10 ] )
+        self.assertEqual( index[ "chunkShape" ], [ 4, 4, 4 ] )
+        self.assertEqual( index[ "firstSlice" ], 3 )
+
+    def test_block_boundaries( self ):
+        # Extents starting and ending on each side of the boundaries of the blocks (slice numbers of the stack in z)
+        zLimits = [ 3, 6, 7, 12 ]
+        yLimits = [ 0, 3, 4, 8 ]
+        xLimits = [ 0, 7, 8, 9 ]
+        for zTop, zBottom in itertools.combinations_with_replacement( zLimits, 2 ):
+            for yTop, yBottom in itertools.combinations_with_replacement( yLimits, 2 ):
+                for xTop, xBottom in itertools.combinations_with_replacement( xLimits, 2 ):
+                    extent = [ [ zTop, yTop, xTop ], [ zBottom, yBottom, xBottom ] ]
+                    numpy.testing.assert_array_equal( read_chunked_extent( self.chunked, extent ), \
+                                                      self.volume[ zTop:zBottom + 1, yTop:yBottom + 1, xTop:xBottom + 1 ], err_msg=str( extent ) )
+
+    def test_outside( self ):
+        # The voxels outside the volume are NaN
+        extent = read_chunked_extent( self.chunked, [ [ 1, -2, 7 ], [ 5, 3, 11 ] ] )
+        self.assertEqual( extent.shape, ( 5, 6, 5 ) )
+        self.assertTrue( numpy.isnan( extent[ 0:2 ] ).all() )
+        self.assertTrue( numpy.isnan( extent[ :, 0:2 ] ).all() )
+        self.assertTrue( numpy.isnan( extent[ :, :, 3:5 ] ).all() )
+        numpy.testing.assert_array_equal( extent[ 2:5, 2:6, 0:3 ], self.volume[ 3:6, 0:4, 7:10 ] )
+
+    def test_missing_block( self ):
+        os.remove( os.path.join( self.chunked, chunked_block_name( [ 0, 1, 0 ] ) ) )
+        extent = read_chunked_extent( self.chunked, [ [ 3, 2, 2 ], [ 8, 6, 5 ] ] )
+        self.assertTrue( numpy.isnan( extent[ 0:4, 2:5, 0:2 ] ).all() )
+        numpy.testing.assert_array_equal( extent[ 0:4, 0:2, : ], self.volume[ 3:7, 2:4, 2:6 ] )
+        numpy.testing.assert_array_equal( extent[ 4:6 ], self.volume[ 7:9, 2:7, 2:6 ] )
+
+    def test_read_chunked_3D( self ):
+        # As read_images reads it: a range of slices cropped to the ROI corners
+        slices = read_chunked_3D( '<u2', self.directory, "volume", ".twc", [ 5, 9 ], [ [ 5, 2, 1 ], [ 9, 7, 8 ] ] )
+        numpy.testing.assert_array_equal( slices, self.volume[ 5:10, 2:8, 1:9 ] )
+
+
+if __name__ == "__main__":
+    unittest.main()
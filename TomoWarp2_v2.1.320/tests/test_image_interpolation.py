@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016, Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+# This file is part of TomoWarp2.
+#
+# TomoWarp2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TomoWarp2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TomoWarp2.  If not, see <http://www.gnu.org/licenses/>.
+
+# ===================================================================
+# ===========================  TomoWarp2  ===========================
+# ===================================================================
+
+# Authors: Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+"""
+The image interpolation: the Gauss-Newton optimisation finds the same sub-pixel translation
+  (and rotation) as Powell, in 2D and 3D
+"""
+
+import unittest
+import warnings
+import numpy
+import scipy.ndimage
+
+from sub_pixel.image_interpolation_translation_rotation import image_interpolation_translation_rotation
+
+
+def shifted_windows( shift, twoD=False, halfWindow=6 ):
+    # im1 from a smooth random volume, im2 from the same volume shifted by "shift", 1 pixel larger on each side
+    numpy.random.seed( 0 )
+    volume  = scipy.ndimage.gaussian_filter( numpy.random.rand( 40, 40, 40 ), 2 )
+    centre  = 20
+    inner   = slice( centre - halfWindow, centre + halfWindow + 1 )
+    outer   = slice( centre - halfWindow - 1, centre + halfWindow + 2 )
+    if twoD:
+        image   = volume[ centre ]
+        shifted = scipy.ndimage.shift( image, shift[1:3], order=3 )
+        return image[ numpy.newaxis, inner, inner ].astype( '<f4' ), shifted[ numpy.newaxis, outer, outer ].astype( '<f4' )
+
+    shifted = scipy.ndimage.shift( volume, shift, order=3 )
+    return volume[ inner, inner, inner ].astype( '<f4' ), shifted[ outer, outer, outer ].astype( '<f4' )
+
+
+class TestGaussNewton( unittest.TestCase ):
+
+    def compare( self, im1, im2, initialGuess, shift ):
+        results = {}
+        with warnings.catch_warnings():
+            # Powell does not use the bounds
+            warnings.simplefilter( "ignore" )
+            for optimisationMode in [ "Powell", "Gauss-Newton" ]:
+                results[ optimisationMode ] = image_interpolation_translation_rotation( im1, im2, numpy.array( initialGuess, dtype=float ), 1, \
+                                                                                        "map_coordinates", 3, optimisationMode )
+
+        for optimisationMode, ( x, cc, iterations, error ) in results.items():
+            self.assertEqual( error, 0, msg=optimisationMode )
+            self.assertTrue( cc > 0.999, msg=optimisationMode )
+            numpy.testing.assert_allclose( x[0:3], shift, atol=0.03, err_msg=optimisationMode )
+
+        numpy.testing.assert_allclose( results[ "Gauss-Newton" ][0], results[ "Powell" ][0], atol=0.02 )
+        self.assertAlmostEqual( results[ "Gauss-Newton" ][1], results[ "Powell" ][1], places=4 )
+
+    def test_translation_3D( self ):
+        shift = [ 0.3, -0.2, 0.25 ]
+        self.compare( *( shifted_windows( shift ) + ( [ 0, 0, 0 ], shift ) ) )
+
+    def test_translation_rotation_3D( self ):
+        # No rotation to find, it has to stay close to 0
+        shift = [ -0.15, 0.35, -0.3 ]
+        self.compare( *( shifted_windows( shift ) + ( [ 0, 0, 0, 0, 0, 0 ], shift ) ) )
+
+    def test_translation_2D( self ):
+        shift = [ 0, -0.35, 0.15 ]
+        self.compare( *( shifted_windows( shift, twoD=True ) + ( [ 0, 0, 0 ], shift ) ) )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016, Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+# This file is part of TomoWarp2.
+#
+# TomoWarp2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TomoWarp2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TomoWarp2.  If not, see <http://www.gnu.org/licenses/>.
+
+# ===================================================================
+# ===========================  TomoWarp2  ===========================
+# ===================================================================
+
+# Authors: Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+"""
+The ring buffers of load_slices(): slices written at their absolute number modulo the capacity,
+  wrapping around the end of the buffer
+"""
+
+import unittest
+import numpy
+
+from tools.load_slices import ring_rows, write_ring
+
+
+class TestRingBuffer( unittest.TestCase ):
+
+    def test_ring_rows( self ):
+        # A slice when the slices do not wrap around, an index array when they do
+        self.assertEqual( ring_rows( 2, 5, 10 ), slice( 2, 6 ) )
+        self.assertEqual( ring_rows( 12, 19, 10 ), slice( 2, 10 ) )
+        numpy.testing.assert_array_equal( ring_rows( 7, 12, 10 ), [ 7, 8, 9, 0, 1, 2 ] )
+        self.assertEqual( ring_rows( 10, 19, 10 ), slice( 0, 10 ) )
+        numpy.testing.assert_array_equal( ring_rows( 5, 14, 10 ), [ 5, 6, 7, 8, 9, 0, 1, 2, 3, 4 ] )
+        self.assertEqual( ring_rows( 5, 4, 10 ), slice( 0, 0 ) )
+
+    def test_write_ring( self ):
+        # Slabs going down the volume: the slices kept from one slab to the next are still in place
+        capacity = 7
+        volume   = numpy.arange( 40 * 3 * 2, dtype='<u2' ).reshape( 40, 3, 2 )
+        ring     = None
+        previous = None
+        for top, bottom in [ [ 0, 6 ], [ 4, 10 ], [ 9, 13 ], [ 13, 19 ], [ 20, 26 ], [ 25, 31 ] ]:
+            zNew = top if previous is None else max( top, previous[1] + 1 )
+            ring = write_ring( ring, zNew, volume[ zNew:bottom + 1 ], capacity )
+            numpy.testing.assert_array_equal( ring[ ring_rows( top, bottom, capacity ) ], volume[ top:bottom + 1 ] )
+            previous = [ top, bottom ]
+
+        self.assertEqual( ring.shape, ( capacity, 3, 2 ) )
+        self.assertEqual( ring.dtype, numpy.dtype( '<u2' ) )
+
+    def test_write_ring_widens( self ):
+        # Slices with NaNs (missing slices) turn an integer ring into a float one, keeping what is in it
+        ring   = write_ring( None, 8, numpy.ones( ( 3, 2, 2 ), dtype='<u2' ), 5 )
+        nans   = numpy.empty( ( 2, 2, 2 ), dtype='<f4' )
+        nans[:] = numpy.nan
+        ring   = write_ring( ring, 11, nans, 5 )
+
+        self.assertEqual( ring.dtype.kind, 'f' )
+        numpy.testing.assert_array_equal( ring[ ring_rows( 8, 10, 5 ) ], 1 )
+        self.assertTrue( numpy.isnan( ring[ ring_rows( 11, 12, 5 ) ] ).all() )
+
+
+if __name__ == "__main__":
+    unittest.main()
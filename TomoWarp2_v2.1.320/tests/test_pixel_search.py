@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016, Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+# This file is part of TomoWarp2.
+#
+# TomoWarp2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TomoWarp2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TomoWarp2.  If not, see <http://www.gnu.org/licenses/>.
+
+# ===================================================================
+# ===========================  TomoWarp2  ===========================
+# ===================================================================
+
+# Authors: Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+"""
+The integer pixel search engines ("direct", "sat", "pruned", "fft" and the batch C-code) give the same
+  maximum and the same 3x3x3 CC neighbourhood, also on windows padded with NaNs (missing slices)
+"""
+
+import unittest
+import numpy
+
+from pixel_search.integer_pixel_search import integer_pixel_search, batch_integer_pixel_search, pyramid_pixel_search, \
+                                              pyramid_candidates
+
+ENGINES = [ "direct", "sat", "pruned", "fft" ]
+
+
+def smooth_volume( shape, seed ):
+    # Random volume smoothed a bit, so that the CC has a single clear peak
+    numpy.random.seed( seed )
+    volume = numpy.random.rand( *shape )
+    for axis in range( 3 ):
+        if shape[ axis ] > 2:
+            volume = ( volume + numpy.roll( volume, 1, axis=axis ) + numpy.roll( volume, -1, axis=axis ) ) / 3.0
+    return volume.astype( '<f4' ) + 1
+
+
+def windows( twoD=False, nanSlices=0, seed=0 ):
+    # im1 cut out of im2 (plus some noise) at a known position, the first nanSlices slices of im2 are NaN
+    if twoD:
+        im2      = smooth_volume( ( 1, 30, 30 ), seed )
+        position = numpy.array( [ 0, 12, 9 ] )
+        shape    = numpy.array( [ 1, 11, 11 ] )
+    else:
+        im2      = smooth_volume( ( 20, 20, 20 ), seed )
+        position = numpy.array( [ 6, 5, 4 ] )
+        shape    = numpy.array( [ 9, 9, 9 ] )
+
+    im1  = im2[ position[0]:position[0]+shape[0], position[1]:position[1]+shape[1], position[2]:position[2]+shape[2] ].copy()
+    im1 += 0.01 * numpy.random.rand( *im1.shape ).astype( '<f4' )
+    im2[ 0:nanSlices ] = numpy.nan
+
+    return im1, im2, position
+
+
+class TestIntegerPixelSearch( unittest.TestCase ):
+
+    def check_engines( self, im1, im2, position ):
+        reference, referenceNeighbourhood = integer_pixel_search( im1, im2, "direct", returnNeighbourhood=True )
+        numpy.testing.assert_array_equal( reference[0:3], position )
+        self.assertIsNotNone( referenceNeighbourhood )
+        self.assertEqual( numpy.unravel_index( numpy.argmax( referenceNeighbourhood ), referenceNeighbourhood.shape ), ( 1, ) * referenceNeighbourhood.ndim )
+
+        for engine in ENGINES:
+            returns = integer_pixel_search( im1, im2, engine )
+            numpy.testing.assert_array_equal( returns[0:3], reference[0:3], err_msg=engine )
+            self.assertAlmostEqual( returns[3], reference[3], places=4, msg=engine )
+
+            returns, neighbourhood = integer_pixel_search( im1, im2, engine, returnNeighbourhood=True )
+            numpy.testing.assert_array_equal( returns[0:3], reference[0:3], err_msg=engine )
+            numpy.testing.assert_allclose( neighbourhood, referenceNeighbourhood, atol=1e-4, err_msg=engine )
+
+    def test_engines_3D( self ):
+        self.check_engines( *windows() )
+
+    def test_engines_2D( self ):
+        self.check_engines( *windows( twoD=True ) )
+
+    def test_engines_nan_padded( self ):
+        self.check_engines( *windows( nanSlices=3 ) )
+
+    def test_batch( self ):
+        nodes = [ windows( seed=seed, nanSlices=2*( seed % 2 ) ) for seed in range( 6 ) ]
+        im1List = [ node[0] for node in nodes ]
+        im2List = [ node[1] for node in nodes ]
+
+        for engine in ENGINES + [ "auto" ]:
+            results = batch_integer_pixel_search( im1List, im2List, engine, returnNeighbourhood=True )
+            for ( im1, im2, position ), ( returns, neighbourhood ) in zip( nodes, results ):
+                reference, referenceNeighbourhood = integer_pixel_search( im1, im2, "direct", returnNeighbourhood=True )
+                numpy.testing.assert_array_equal( returns[0:3], position, err_msg=engine )
+                self.assertAlmostEqual( returns[3], reference[3], places=4, msg=engine )
+                numpy.testing.assert_allclose( neighbourhood, referenceNeighbourhood, atol=1e-4, err_msg=engine )
+
+    def test_neighbourhood_on_edge( self ):
+        # The maximum on the edge of the search range has no complete neighbourhood
+        im2 = smooth_volume( ( 16, 16, 16 ), 1 )
+        im1 = im2[ 0:9, 3:12, 4:13 ].copy()
+        for engine in ENGINES:
+            returns, neighbourhood = integer_pixel_search( im1, im2, engine, returnNeighbourhood=True )
+            numpy.testing.assert_array_equal( returns[0:3], [ 0, 3, 4 ], err_msg=engine )
+            self.assertIsNone( neighbourhood, msg=engine )
+
+
+class TestPyramidPixelSearch( unittest.TestCase ):
+
+    def test_same_as_full_search( self ):
+        im2      = smooth_volume( ( 32, 32, 32 ), 2 )
+        im1      = im2[ 13:25, 9:21, 6:18 ].copy()
+        for engine in ENGINES:
+            returns, neighbourhood, disagreement = pyramid_pixel_search( im1, im2, 1, engine, returnNeighbourhood=True )
+            numpy.testing.assert_array_equal( returns[0:3], [ 13, 9, 6 ], err_msg=engine )
+            self.assertIsNotNone( neighbourhood )
+
+    def test_no_levels( self ):
+        im1, im2, position = windows()
+        returns, neighbourhood, disagreement = pyramid_pixel_search( im1, im2, 0, "sat", returnNeighbourhood=True )
+        reference, referenceNeighbourhood    = integer_pixel_search( im1, im2, "sat", returnNeighbourhood=True )
+        numpy.testing.assert_array_equal( returns, reference )
+        numpy.testing.assert_array_equal( neighbourhood, referenceNeighbourhood )
+        self.assertFalse( disagreement )
+
+    def test_candidates( self ):
+        # Distinct peaks, best first, the NaNs and the CC <= 0 are not candidates
+        ccMap = numpy.zeros( ( 1, 20, 20 ) )
+        ccMap[ 0, 5, 5 ]   = 0.9
+        ccMap[ 0, 5, 6 ]   = 0.8
+        ccMap[ 0, 15, 15 ] = 0.7
+        ccMap[ 0, 10, 2 ]  = numpy.nan
+        candidates = pyramid_candidates( ccMap, 3 )
+        self.assertEqual( len( candidates ), 2 )
+        numpy.testing.assert_array_equal( candidates[0][0:3], [ 0, 5, 5 ] )
+        numpy.testing.assert_array_equal( candidates[1][0:3], [ 0, 15, 15 ] )
+
+
+if __name__ == "__main__":
+    unittest.main()
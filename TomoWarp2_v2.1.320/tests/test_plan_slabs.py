@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016, Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+# This file is part of TomoWarp2.
+#
+# TomoWarp2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TomoWarp2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TomoWarp2.  If not, see <http://www.gnu.org/licenses/>.
+
+# ===================================================================
+# ===========================  TomoWarp2  ===========================
+# ===================================================================
+
+# Authors: Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+"""
+The slab plan of plan_slabs() against the greedy plan of the earlier versions of DIC_setup
+"""
+
+import unittest
+import numpy
+
+import tools.plan_slabs as plan_slabs_module
+from tools.plan_slabs import plan_slabs, greedy_plan, plan_cost, slice_voxels, slices_read, log_slab_plan
+
+
+class Data:
+    # The fields of the data structure used by plan_slabs()
+    def __init__( self, memLimitSlices ):
+        self.memLimitSlices      = memLimitSlices
+        self.image_slices_extent = numpy.array( [ [ 0, 299 ], [ 0, 299 ] ] )
+        self.ROI_corners         = numpy.array( [ [ [ 0, 0, 0 ], [ 299, 39, 29 ] ], [ [ 0, 0, 0 ], [ 299, 39, 29 ] ] ] )
+        self.subpixel_mode       = [ False, False, False ]
+        self.correlation_window  = [ 5, 5, 5 ]
+        self.image_data_format   = '<u2'
+
+
+def node_extents( zPositions, correlationWindow=5, searchWindow=( -3, 4 ), nodesPerLevel=4 ):
+    # Extents ( node number, im_number 0,1, top/bottom, z/y/x ) of nodesPerLevel nodes at each z position
+    zPositions = numpy.repeat( numpy.array( zPositions, dtype=int ), nodesPerLevel )
+    extents    = numpy.zeros( ( len( zPositions ), 2, 2, 3 ), dtype=int )
+    extents[:,0,0,0] = zPositions - correlationWindow
+    extents[:,0,1,0] = zPositions + correlationWindow
+    extents[:,1,0,0] = zPositions - correlationWindow + searchWindow[0]
+    extents[:,1,1,0] = zPositions + correlationWindow + searchWindow[1]
+    extents[:,:,0,1:3] = 0
+    extents[:,:,1,1:3] = 20
+    return extents
+
+
+def z_extents( extents ):
+    return numpy.array( [ extents[:,0,0,0], extents[:,0,1,0], extents[:,1,0,0], extents[:,1,1,0] ] ).T
+
+
+class TestPlanSlabs( unittest.TestCase ):
+
+    def check_plan( self, plan, tooThick, extents, nodeDone, data ):
+        # Each node to do is in exactly one slab, which holds its extents and fits in memory
+        planned = numpy.concatenate( [ slab[2] for slab in plan ] ) if len( plan ) > 0 else numpy.array( [], dtype=int )
+        numpy.testing.assert_array_equal( numpy.sort( numpy.concatenate( ( planned, tooThick ) ) ), numpy.where( ~nodeDone )[0] )
+        self.assertEqual( len( numpy.unique( planned ) ), len( planned ) )
+
+        zExtents = z_extents( extents )
+        for slab in plan:
+            self.assertTrue( slab[0][1] - slab[0][0] <= data.memLimitSlices )
+            self.assertTrue( slab[1][1] - slab[1][0] <= data.memLimitSlices )
+            nodes = zExtents[ slab[2] ]
+            self.assertTrue( ( nodes[:,0] >= slab[0][0] ).all() and ( nodes[:,1] <= slab[0][1] ).all() )
+            self.assertTrue( ( nodes[:,2] >= slab[1][0] ).all() and ( nodes[:,3] <= slab[1][1] ).all() )
+
+    def test_grid_against_greedy( self ):
+        for memLimitSlices in [ 20, 37, 60, 100 ]:
+            data     = Data( memLimitSlices )
+            extents  = node_extents( range( 10, 290, 10 ) )
+            nodeDone = numpy.zeros( len( extents ), dtype=bool )
+
+            plan, tooThick = plan_slabs( extents, nodeDone, data )
+            self.check_plan( plan, tooThick, extents, nodeDone, data )
+            self.assertEqual( len( tooThick ), 0 )
+
+            greedy, greedyMissing = greedy_plan( z_extents( extents ), numpy.arange( len( extents ) ), memLimitSlices )
+            self.assertEqual( len( greedyMissing ), 0 )
+            self.assertTrue( plan_cost( plan, slice_voxels( data ) ) <= plan_cost( greedy, slice_voxels( data ) ) )
+
+    def test_irregular_nodes( self ):
+        numpy.random.seed( 0 )
+        data     = Data( 40 )
+        extents  = node_extents( numpy.random.randint( 10, 280, 150 ), nodesPerLevel=1 )
+        nodeDone = numpy.random.rand( len( extents ) ) < 0.2
+
+        plan, tooThick = plan_slabs( extents, nodeDone, data )
+        self.check_plan( plan, tooThick, extents, nodeDone, data )
+
+        greedy, greedyMissing = greedy_plan( z_extents( extents ), numpy.where( ~nodeDone )[0], data.memLimitSlices )
+        self.assertTrue( plan_cost( plan, slice_voxels( data ) ) <= plan_cost( greedy, slice_voxels( data ) ) )
+
+    def test_too_many_levels( self ):
+        # Above MAX_LEVELS levels the greedy plan is used
+        numpy.random.seed( 1 )
+        data     = Data( 40 )
+        extents  = node_extents( numpy.random.randint( 10, 280, 50 ), nodesPerLevel=1 )
+        nodeDone = numpy.zeros( len( extents ), dtype=bool )
+
+        maxLevels = plan_slabs_module.MAX_LEVELS
+        try:
+            plan_slabs_module.MAX_LEVELS = 5
+            plan, tooThick = plan_slabs( extents, nodeDone, data )
+        finally:
+            plan_slabs_module.MAX_LEVELS = maxLevels
+
+        self.check_plan( plan, tooThick, extents, nodeDone, data )
+        greedy, greedyMissing = greedy_plan( z_extents( extents ), numpy.arange( len( extents ) ), data.memLimitSlices )
+        self.assertEqual( [ slab[0:2] for slab in plan ], [ slab[0:2] for slab in greedy ] )
+
+    def test_one_slab( self ):
+        data     = Data( 299 )
+        extents  = node_extents( range( 10, 290, 10 ) )
+        nodeDone = numpy.zeros( len( extents ), dtype=bool )
+
+        plan, tooThick = plan_slabs( extents, nodeDone, data )
+        self.check_plan( plan, tooThick, extents, nodeDone, data )
+        self.assertEqual( len( plan ), 1 )
+        self.assertEqual( plan[0][0:2], [ [ 5, 285 ], [ 2, 289 ] ] )
+
+    def test_too_thick( self ):
+        # A node whose extents do not fit in a slab is left out, the others are planned
+        data     = Data( 20 )
+        extents  = node_extents( range( 10, 100, 10 ) )
+        extents[ 5, 1, 1, 0 ] += 30
+        nodeDone = numpy.zeros( len( extents ), dtype=bool )
+
+        plan, tooThick = plan_slabs( extents, nodeDone, data )
+        self.check_plan( plan, tooThick, extents, nodeDone, data )
+        numpy.testing.assert_array_equal( tooThick, [ 5 ] )
+
+    def test_log_slab_plan( self ):
+        # The data read is counted with the slices cropped to the ROI
+        data     = Data( 37 )
+        extents  = node_extents( range( 10, 290, 10 ) )
+        plan, tooThick = plan_slabs( extents, numpy.zeros( len( extents ), dtype=bool ), data )
+
+        bytesRead, bytesMinimum = log_slab_plan( plan, extents, data )
+        bytesSlice = 40 * 30 * 2
+        self.assertEqual( bytesRead, bytesSlice * ( slices_read( [ slab[0] for slab in plan ] ) + slices_read( [ slab[1] for slab in plan ] ) ) )
+        self.assertTrue( bytesMinimum <= bytesRead )
+
+
+if __name__ == "__main__":
+    unittest.main()
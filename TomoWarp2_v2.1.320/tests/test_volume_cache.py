@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016, Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+# This file is part of TomoWarp2.
+#
+# TomoWarp2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TomoWarp2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TomoWarp2.  If not, see <http://www.gnu.org/licenses/>.
+
+# ===================================================================
+# ===========================  TomoWarp2  ===========================
+# ===================================================================
+
+# Authors: Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+"""
+The on-disk cache of the decoded images (tools/volume_cache.py): the slices are only decoded once,
+  also from one run to the next, and the least recently used caches are deleted to stay under the limit
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+
+import tools.volume_cache as volume_cache
+from tools.volume_cache import read_images_cached, close_volume_caches, evict_caches
+
+
+class Data:
+    # The fields of the data structure used by read_images_cached(), for a 3D RAW volume
+    def __init__( self, directory, cacheDir ):
+        self.DIR_image           = [ directory, directory ]
+        self.image_prefix        = [ "volume", "volume" ]
+        self.image_digits        = [ 0, 0 ]
+        self.image_ext           = ".raw"
+        self.image_format        = "RAW"
+        self.image_data_format   = '<u2'
+        self.image_size          = numpy.array( [ [ 20, 8, 6 ], [ 20, 8, 6 ] ] )
+        self.image_slices_extent = numpy.array( [ [ 0, 19 ], [ 0, 19 ] ] )
+        self.ROI_corners         = numpy.array( [ [ [ 0, 1, 2 ], [ 19, 6, 4 ] ], [ [ 0, 0, 0 ], [ 19, 7, 5 ] ] ] )
+        self.ioThreads           = 1
+        self.volumeCacheDir      = cacheDir
+        self.volumeCacheLimitMB  = 1
+
+
+class TestVolumeCache( unittest.TestCase ):
+
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        self.volume    = numpy.arange( 20 * 8 * 6, dtype='<u2' ).reshape( 20, 8, 6 )
+        self.volume.tofile( os.path.join( self.directory, "volume.raw" ) )
+        self.data      = Data( self.directory, os.path.join( self.directory, "cache" ) )
+
+        # Count the slices decoded by read_images
+        self.decoded = []
+        def read_images( *args ):
+            self.decoded.append( list( args[8] ) )
+            return self.readImages( *args )
+        self.readImages = volume_cache.read_images
+        volume_cache.read_images = read_images
+
+        volume_cache.openCaches.clear()
+
+    def tearDown( self ):
+        close_volume_caches()
+        volume_cache.read_images = self.readImages
+        shutil.rmtree( self.directory )
+
+    def read( self, slices_range ):
+        return read_images_cached( self.data, 1, slices_range )
+
+    def roi( self, zTop, zBottom ):
+        return self.volume[ zTop:zBottom + 1, 1:7, 2:5 ]
+
+    def test_hit( self ):
+        numpy.testing.assert_array_equal( self.read( [ 2, 9 ] ), self.roi( 2, 9 ) )
+        self.assertEqual( self.decoded, [ [ 2, 9 ] ] )
+
+        # Only the slices that are not cached yet are decoded
+        numpy.testing.assert_array_equal( self.read( [ 4, 12 ] ), self.roi( 4, 12 ) )
+        numpy.testing.assert_array_equal( self.read( [ 3, 8 ] ), self.roi( 3, 8 ) )
+        self.assertEqual( self.decoded, [ [ 2, 9 ], [ 10, 12 ] ] )
+
+        # Next run: the cache is read again from disk, only the slices needed to find the shape of the slices are decoded
+        close_volume_caches()
+        self.decoded[:] = []
+        numpy.testing.assert_array_equal( self.read( [ 2, 5 ] ), self.roi( 2, 5 ) )
+        numpy.testing.assert_array_equal( self.read( [ 3, 12 ] ), self.roi( 3, 12 ) )
+        self.assertEqual( self.decoded, [ [ 2, 5 ] ] )
+
+    def test_other_roi( self ):
+        # The whole slices are cached, another ROI is read from the same cache
+        self.read( [ 0, 19 ] )
+        close_volume_caches()
+        self.decoded[:] = []
+
+        self.data.ROI_corners[0] = [ [ 0, 0, 0 ], [ 19, 3, 5 ] ]
+        numpy.testing.assert_array_equal( self.read( [ 5, 15 ] ), self.volume[ 5:16, 0:4, 0:6 ] )
+        self.assertEqual( len( os.listdir( self.data.volumeCacheDir ) ), 2 )
+
+    def test_outside( self ):
+        # The slices outside the image are NaN
+        images = self.read( [ -2, 3 ] )
+        self.assertTrue( numpy.isnan( images[ 0:2 ] ).all() )
+        numpy.testing.assert_array_equal( images[ 2:6 ], self.roi( 0, 3 ) )
+
+        images = self.read( [ 18, 22 ] )
+        numpy.testing.assert_array_equal( images[ 0:2 ], self.roi( 18, 19 ) )
+        self.assertTrue( numpy.isnan( images[ 2:5 ] ).all() )
+
+    def test_modified_image( self ):
+        # A modified image has another fingerprint, it is not read from the old cache
+        self.read( [ 0, 5 ] )
+        close_volume_caches()
+
+        self.volume += 1
+        self.volume.tofile( os.path.join( self.directory, "volume.raw" ) )
+        os.utime( os.path.join( self.directory, "volume.raw" ), ( 1, 1 ) )
+        volume_cache.openCaches.clear()
+
+        numpy.testing.assert_array_equal( self.read( [ 0, 5 ] ), self.roi( 0, 5 ) )
+
+    def test_eviction( self ):
+        cacheDir = self.data.volumeCacheDir
+        os.makedirs( cacheDir )
+        for lastUsed, fingerprint in enumerate( [ "a", "b", "c" ] ):
+            filename = os.path.join( cacheDir, fingerprint + ".volume.npy" )
+            with open( filename, 'w' ) as f:
+                f.write( "x" * 1000 )
+            os.utime( filename, ( lastUsed + 1, lastUsed + 1 ) )
+
+        # The least recently used ones go first, except the ones in use, which still count
+        self.assertTrue( evict_caches( cacheDir, 1000, 3000, keep=[ "a" ] ) )
+        self.assertEqual( sorted( os.listdir( cacheDir ) ), [ "a.volume.npy", "c.volume.npy" ] )
+
+        self.assertFalse( evict_caches( cacheDir, 1500, 2000, keep=[ "a", "c" ] ) )
+        self.assertEqual( sorted( os.listdir( cacheDir ) ), [ "a.volume.npy", "c.volume.npy" ] )
+
+        self.assertFalse( evict_caches( cacheDir, 5000, 3000 ) )
+
+    def test_too_big( self ):
+        # An image bigger than volumeCacheLimitMB is not cached, but still read
+        self.data.volumeCacheLimitMB = 0.001
+        numpy.testing.assert_array_equal( self.read( [ 2, 9 ] ), self.roi( 2, 9 ) )
+        numpy.testing.assert_array_equal( self.read( [ 2, 9 ] ), self.roi( 2, 9 ) )
+        self.assertEqual( len( self.decoded ), 2 )
+        self.assertEqual( os.listdir( self.data.volumeCacheDir ), [] )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -93,8 +93,11 @@ def tomowarp_runfile( data ):
     # This queue will contain requests for data extents from DIC workers to the data delivery worker
     q_data_requests = multiprocessing.Queue( )
 
+    # This queue will tell DIC_setup where the data delivery worker has shared each new slab
+    q_slab_ready    = multiprocessing.Queue( )
+
     # Launch a data_delivery_worker
-    ddw = multiprocessing.Process( target=data_delivery_worker, args=( q_data_requests , workerQueues, ) )
+    ddw = multiprocessing.Process( target=data_delivery_worker, args=( q_data_requests , workerQueues, q_slab_ready, ) )
     ddw.start()
     # -------------------------------------
     # ===============================================================
@@ -156,7 +159,7 @@ def tomowarp_runfile( data ):
 
     if nodesToProcess.shape[0] != 0:
       try:
-        kinematics[ nodesToProcess,: ] = DIC_setup( kinematics[ nodesToProcess,: ], data, q_data_requests , workerQueues )
+        kinematics[ nodesToProcess,: ] = DIC_setup( kinematics[ nodesToProcess,: ], data, q_data_requests , workerQueues, q_slab_ready )
       except Exception as exc:
         raise Exception(exc)
 
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016, Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+# This file is part of TomoWarp2.
+#
+# TomoWarp2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TomoWarp2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TomoWarp2.  If not, see <http://www.gnu.org/licenses/>.
+
+# ===================================================================
+# ===========================  TomoWarp2  ===========================
+# ===================================================================
+
+# Authors: Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+"""
+Conversion of TIFF, EDF and RAW images to the TomoWarp2 chunked volume format (image_format = "CHUNKED").
+
+A chunked volume is a directory ( name.twc ) with:
+- index.json: shape [z,y,x], chunkShape [z,y,x], dtype of the volume and firstSlice, the number
+    of its first slice in the images it was converted from
+- block_IZ_IY_IX.npy: the block of voxels starting at [ IZ, IY, IX ] * chunkShape,
+    the blocks on the far sides of the volume are smaller
+
+read_images.read_chunked_extent() reads any 3D extent by opening only the blocks it covers.
+  The slices keep the numbers they had in the stack (firstSlice to firstSlice + shape[0] - 1),
+  so that the ROI and the nodes of the stack are the same in the chunked volume.
+
+Run from the TomoWarp2 directory:
+  python -m tools.chunked_volume DIR_image output.twc [ chunkSize ]
+for a stack of TIFF or EDF slices or a 3D TIFF in DIR_image, RAW images have to be converted with convert_to_chunked()
+"""
+
+import os, sys, json
+import numpy
+import logging
+
+from read_images import read_images, chunked_block_name, CHUNKED_INDEX
+
+
+def write_chunked_blocks( directory, zTop, slices, chunkShape ):
+    # Write the blocks of the slices starting at slice zTop, which is a multiple of chunkShape[0]
+    for blockY in range( 0, slices.shape[1], chunkShape[1] ):
+        for blockX in range( 0, slices.shape[2], chunkShape[2] ):
+            blockNumber = [ zTop // chunkShape[0], blockY // chunkShape[1], blockX // chunkShape[2] ]
+            numpy.save( os.path.join( directory, chunked_block_name( blockNumber ) ), \
+                        numpy.ascontiguousarray( slices[ :, blockY:blockY + chunkShape[1], blockX:blockX + chunkShape[2] ] ) )
+
+
+def convert_to_chunked( image_data_format, image_format, image_size, base_dir, base_name, digits, extension, slices_extent, outputDirectory, chunkSize=64, ioThreads=1 ):
+    """
+    Convert the images read by read_images into a chunked volume of blocks of chunkSize^3 voxels
+
+    INPUTS:
+    - image_data_format, image_format, image_size, base_dir, base_name, digits, extension: as for read_images
+    - slices_extent       [ first slice, last slice ] of the images
+    - outputDirectory     chunked volume to create ( name.twc )
+    - chunkSize           size of the blocks
+    - ioThreads           number of slices read at the same time
+    """
+    chunkShape = [ int( chunkSize ) ] * 3
+
+    if os.path.exists( os.path.join( outputDirectory, CHUNKED_INDEX ) ):
+        raise Exception( "convert_to_chunked(): %s is already a chunked volume"%( outputDirectory ) )
+    if not os.path.isdir( outputDirectory ):
+        os.makedirs( outputDirectory )
+
+    # Full slices: the crop of read_images is inclusive for 3D volumes and exclusive for stacks of slices
+    corners = [ [ 0, 0, 0 ], [ slices_extent[1], image_size[-2], image_size[-1] ] ]
+
+    shape = None
+    for zTop in range( slices_extent[0], slices_extent[1] + 1, chunkShape[0] ):
+        zBottom = min( zTop + chunkShape[0] - 1, slices_extent[1] )
+        slices  = read_images( image_data_format, image_format, image_size, base_dir, base_name, digits, extension, corners, [ zTop, zBottom ], ioThreads )
+        if shape is None:
+            dtype = slices.dtype.str
+            shape = [ slices_extent[1] - slices_extent[0] + 1, slices.shape[1], slices.shape[2] ]
+        write_chunked_blocks( outputDirectory, zTop - slices_extent[0], slices.astype( dtype ), chunkShape )
+
+        try: logging.log.info( "convert_to_chunked(): slices %i to %i written"%( zTop, zBottom ) )
+        except: print "convert_to_chunked(): slices %i to %i written"%( zTop, zBottom )
+
+    # The index is written last, a volume without it is incomplete
+    with open( os.path.join( outputDirectory, CHUNKED_INDEX ), 'w' ) as f:
+        json.dump( { "format": "TomoWarp2 chunked volume", "version": 1, "shape": [ int( n ) for n in shape ], \
+                     "chunkShape": chunkShape, "dtype": dtype, "firstSlice": int( slices_extent[0] ) }, f, indent=2 )
+
+    return shape
+
+
+if __name__ == "__main__":
+    from tools.image_finder import image_finder
+    from tools import tifffile
+
+    if len( sys.argv ) < 3:
+        print __doc__
+        sys.exit( 1 )
+
+    directory       = sys.argv[1]
+    outputDirectory = sys.argv[2]
+    chunkSize       = int( sys.argv[3] ) if len( sys.argv ) > 3 else 64
+
+    prefix, digits, slices_extent, extension = image_finder( directory )
+
+    if extension.lower() in [ ".tif", ".tiff" ]:
+        image_format = "TIFF"
+        if digits == 0:
+            series = tifffile.TiffFile( "%s/%s%s"%( directory, prefix, extension ) ).series[0]
+            image_size, image_data_format = list( series.shape ), numpy.dtype( series.dtype ).str
+        else:
+            firstImage = tifffile.imread( "%s/%s%0*i%s"%( directory, prefix, int( digits ), slices_extent[0], extension ) )
+            image_size, image_data_format = list( firstImage.shape ), firstImage.dtype.str
+    elif extension.lower() == ".edf":
+        import EdfFile
+        image_format      = "EDF"
+        image_data_format = '<f4'
+        image_size        = list( numpy.array( EdfFile.EdfFile( "%s/%s%0*i%s"%( directory, prefix, int( digits ), slices_extent[0], extension ) ).GetData( 0 ) ).shape )
+    else:
+        raise Exception( "chunked_volume: only TIFF and EDF images can be converted from the command line, use convert_to_chunked()" )
+
+    if len( image_size ) == 3:
+        slices_extent = [ 0, image_size[0] - 1 ]
+    elif slices_extent is None:
+        slices_extent = [ 0, 0 ]
+
+    shape = convert_to_chunked( image_data_format, image_format, image_size, directory, prefix, digits, extension, slices_extent, outputDirectory, chunkSize )
+    print "chunked_volume: %s written, shape %s, blocks of %i^3"%( outputDirectory, shape, chunkSize )
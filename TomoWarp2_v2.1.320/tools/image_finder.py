@@ -43,18 +43,34 @@ OUTPUT:
 - extension
 
 image_finder_data uptdate the "data" structure
+
+The directory is listed once. What is found, and the image size and data format given by
+  image_size_and_type, is kept in a manifest ( image_manifest.json in DIR_out ) that is used
+  instead of listing the directory and opening the first images again, as long as the
+  modification time of the directory does not change.
 """
 
-import os, re, string
+import os, re, string, json
+import numpy
 import logging
 
 from print_variable import pv
 
 def image_finder( directory="./", nameFilter="", extension="", digits=None ):
 
+    entry = scan_images( directory, nameFilter, extension, digits )
+    log_images( directory, entry )
+
+    return entry["prefix"], entry["digits"], entry["slices_extent"], entry["extension"]
+
+
+def scan_images( directory="./", nameFilter="", extension="", digits=None ):
+    # One listing of the directory: prefix, digits, first and last file number, extension and missing file numbers
+    allFiles = os.listdir( directory )
+
     # Get a sorted list of files in the folder that match the name filter and the extension, if given.
     filePattern = re.compile( r"(.*)%s(.*)%s"%( nameFilter, extension ) )
-    fileList = sorted( [f for f in os.listdir( directory ) if filePattern.match(f)] )
+    fileList = sorted( [f for f in allFiles if filePattern.match(f)] )
 
     if fileList == []: raise Exception("\timage_finder(): No matching files found in %s"%(directory))
 
@@ -85,16 +101,7 @@ def image_finder( directory="./", nameFilter="", extension="", digits=None ):
 
         # setting this to None, so that the case of digits == 0 can be detected out of this function (in input_parameters.py)
         slices_extent = None
-        try:
-          logging.log.info( "**********************image_finder():***************************" )
-          logging.log.info( "In the directory: %s"%(directory)                                 )
-          logging.log.info( "I am working on a single file: %s%s "%(prefix, extension)         )
-          logging.log.info( "****************************************************************" )
-        except:
-          print "**********************image_finder():***************************" 
-          print "In the directory: %s"%(directory)                                 
-          print "I am working on a single file: %s%s "%(prefix, extension)         
-          print "****************************************************************" 
+        missing       = []
 
     else:
         # otherwise we're in the regular case of having a certain number of digits -- in this case continue
@@ -105,39 +112,141 @@ def image_finder( directory="./", nameFilter="", extension="", digits=None ):
         except ValueError:
           raise Exception('I can not read the digits in the filename. Please check number of digits of filename format')
 
-        # Get a sorted list of files in the folder that match the name prefix, number of digits and the extension.
-        filePattern = re.compile( r"%s\d{%i}%s"%( prefix, digits, extension ) )
-        fileList = sorted( [f for f in os.listdir( directory ) if filePattern.match(f)] )
+        # Numbers of the files in the same listing that match the name prefix, number of digits and the extension.
+        filePattern = re.compile( r"%s(\d{%i})%s"%( prefix, digits, extension ) )
+        numbers     = set( [ int( filePattern.match(f).group(1) ) for f in allFiles if filePattern.match(f) ] )
 
-        [ lastFileName, extension ] = os.path.splitext( os.path.basename(fileList[-1]) )
-        lastNumber = int(lastFileName[-digits::])
+        lastNumber    = max( numbers )
+        slices_extent = [firstNumber, lastNumber]
+        missing       = sorted( set( range( firstNumber, lastNumber ) ) - numbers )
 
+    return { "prefix": prefix, "digits": digits, "slices_extent": slices_extent, "extension": extension, "missing": missing }
+
+
+def log_images( directory, entry ):
+
+    prefix    = entry["prefix"]
+    digits    = entry["digits"]
+    extension = entry["extension"]
+
+    if digits == 0:
+        try:
+          logging.log.info( "**********************image_finder():***************************" )
+          logging.log.info( "In the directory: %s"%(directory)                                 )
+          logging.log.info( "I am working on a single file: %s%s "%(prefix, extension)         )
+          logging.log.info( "****************************************************************" )
+        except:
+          print "**********************image_finder():***************************"
+          print "In the directory: %s"%(directory)
+          print "I am working on a single file: %s%s "%(prefix, extension)
+          print "****************************************************************"
+
+    else:
+        firstNumber, lastNumber = entry["slices_extent"]
         try:
           logging.log.info( "**********************image_finder():***************************" )
           logging.log.info( "In the directory: %s"%(directory)                                 )
           logging.log.info( "I am matching files %s[%0*i to %0*i]"%(prefix, int(digits), firstNumber, int(digits), lastNumber) )
         except:
-          print "**********************image_finder():***************************" 
-          print "In the directory: %s"%(directory)                                 
-          print "I am matching files %s[%0*i to %0*i]"%(prefix, int(digits), firstNumber, int(digits), lastNumber) 
+          print "**********************image_finder():***************************"
+          print "In the directory: %s"%(directory)
+          print "I am matching files %s[%0*i to %0*i]"%(prefix, int(digits), firstNumber, int(digits), lastNumber)
 
-        for i in range(firstNumber,lastNumber):
+        for i in entry["missing"]:
             currentFile = "%s/%s%0*i%s"%( directory, prefix, int(digits), i, extension )
-            if not os.path.isfile(currentFile):
-              try: logging.log.warning( "I can not find file %s"%(currentFile) )
-              except: print  "I can not find file %s"%(currentFile) 
+            try: logging.log.warning( "I can not find file %s"%(currentFile) )
+            except: print  "I can not find file %s"%(currentFile)
 
         try: logging.log.info( "****************************************************************" )
-        except: print  "****************************************************************" 
-        slices_extent = [firstNumber, lastNumber]
+        except: print  "****************************************************************"
+
+
+# Manifest of this run: file, entries of the image directories and keys of the entries of image 1 and 2
+imageManifest = { "file": None, "entries": {}, "keys": [ None, None ] }
+
+def manifest_key( directory, nameFilter, extension, digits ):
+    return repr( [ os.path.abspath( directory ), nameFilter, extension, None if digits is None else int( digits ) ] )
 
-    return prefix, digits, slices_extent, extension
 
+def read_manifest( manifestFile ):
+    try:
+        with open( manifestFile ) as f:
+            return json.load( f )
+    except:
+        return {}
+
+
+def write_manifest( ):
+    # Write the manifest, keeping the entries of the other image directories already in it
+    if imageManifest["file"] is None: return
+    try:
+        manifest = read_manifest( imageManifest["file"] )
+        manifest.update( imageManifest["entries"] )
+        with open( imageManifest["file"], 'w' ) as f:
+            json.dump( manifest, f, indent=1 )
+    except Exception as e:
+        try: logging.log.warning( "image_finder(): Could not write the manifest %s: %s"%( imageManifest["file"], e ) )
+        except: print "image_finder(): Could not write the manifest %s: %s"%( imageManifest["file"], e )
 
 
 def image_finder_data( data ):
 
-    data.image_prefix[0], data.image_digits[0], data.image_slices_extent[0], data.image_ext = image_finder ( data.DIR_image[0], data.image_filter[0], data.image_ext, data.image_digits[0] )
-    data.image_prefix[1], data.image_digits[1], data.image_slices_extent[1], data.image_ext = image_finder ( data.DIR_image[1], data.image_filter[1], data.image_ext, data.image_digits[1] )
+    imageManifest["file"]    = os.path.join( data.DIR_out, "image_manifest.json" )
+    imageManifest["entries"] = {}
+    manifest = read_manifest( imageManifest["file"] )
+
+    for im in [ 0, 1 ]:
+        key   = manifest_key( data.DIR_image[im], data.image_filter[im], data.image_ext, data.image_digits[im] )
+        mtime = os.stat( data.DIR_image[im] ).st_mtime
+
+        # The manifest is used if no file was added, removed or renamed in the directory since it was written
+        if key in manifest and manifest[key]["mtime"] == mtime:
+            entry = manifest[key]
+            try: logging.log.info( "image_finder(): Using the manifest %s for %s"%( imageManifest["file"], data.DIR_image[im] ) )
+            except: print "image_finder(): Using the manifest %s for %s"%( imageManifest["file"], data.DIR_image[im] )
+        else:
+            entry = scan_images( data.DIR_image[im], data.image_filter[im], data.image_ext, data.image_digits[im] )
+            entry["mtime"] = mtime
+        log_images( data.DIR_image[im], entry )
+
+        imageManifest["entries"][key] = entry
+        imageManifest["keys"][im]     = key
+
+        data.image_prefix[im], data.image_digits[im], data.image_slices_extent[im], data.image_ext = \
+          str( entry["prefix"] ), entry["digits"], entry["slices_extent"], str( entry["extension"] )
+
+    write_manifest( )
 
     return data
+
+
+def manifest_image_properties( data ):
+    # Set the image_format, image_size and image_data_format of the manifest, if it has them for both images
+    #   and image_format was not set to something else. Returns False if it is not the case
+    entries = [ imageManifest["entries"].get( key, {} ) for key in imageManifest["keys"] ]
+
+    if not all( [ "image_size" in entry for entry in entries ] ):
+        return False
+    if entries[0]["image_format"] != entries[1]["image_format"] or data.image_format not in [ "auto", None, entries[0]["image_format"] ]:
+        return False
+
+    data.image_format      = str( entries[0]["image_format"] )
+    data.image_data_format = str( entries[0]["image_data_format"] )
+    data.image_size        = numpy.array( [ entries[0]["image_size"], entries[1]["image_size"] ] )
+
+    try: logging.log.info( "image_size_and_type(): Image size and format from the manifest" )
+    except: print "image_size_and_type(): Image size and format from the manifest"
+
+    return True
+
+
+def save_image_properties( data ):
+    # Add the image_format, image_size and image_data_format found by image_size_and_type to the manifest
+    if data.image_format == "RAW": return
+    for im in [ 0, 1 ]:
+        entry = imageManifest["entries"].get( imageManifest["keys"][im] )
+        if entry is not None:
+            entry["image_format"]      = data.image_format
+            entry["image_data_format"] = data.image_data_format
+            entry["image_size"]        = numpy.array( data.image_size[im] ).tolist()
+    write_manifest( )
@@ -34,6 +34,7 @@ images in the two folders and determine their size and type
 import tifffile, numpy, getopt, re, sys
 import logging
 from print_variable import pv
+from image_finder import manifest_image_properties, save_image_properties
 
 try:
   from PIL import Image
@@ -42,7 +43,11 @@ except:
 
 def image_size_and_type( data ):
 
-    if re.compile( r"\.[Tt][Ii][Ff]{1,2}" ).match(data.image_ext):
+    # Size and data format already found in a previous run (manifest of image_finder_data)
+    if data.image_format != "RAW" and manifest_image_properties( data ):
+        pass
+
+    elif re.compile( r"\.[Tt][Ii][Ff]{1,2}" ).match(data.image_ext):
         if data.image_format == "auto" or data.image_format == "TIFF":
           data.image_format = "TIFF"
 
@@ -138,9 +143,35 @@ def image_size_and_type( data ):
         else:
           raise Exception( "image_size_and_type(): image_format given in input (%s) does not match the extension found (%s)\nOmit image_format or define image_ext"%( data.image_format, data.image_ext ) )
 
+    # TomoWarp2 chunked volume (a directory, see tools/chunked_volume.py), its size and format are in its index
+    elif re.compile( r"\.[Tt][Ww][Cc]" ).match(data.image_ext):
+
+        from read_images import read_chunked_index
+
+        if data.image_format == "auto" or data.image_format == "CHUNKED":
+          data.image_format = "CHUNKED"
+          index1 = read_chunked_index( "%s/%s%s"%( data.DIR_image[0], data.image_prefix[0], data.image_ext ) )
+          index2 = read_chunked_index( "%s/%s%s"%( data.DIR_image[1], data.image_prefix[1], data.image_ext ) )
+
+          data.image_size        = numpy.array( [ index1[ "shape" ], index2[ "shape" ] ] )
+          data.image_data_format = numpy.dtype( index1[ "dtype" ] ).str
+
+          if index2[ "dtype" ] != index1[ "dtype" ]:
+              raise Exception("image_size_and_type(): The images seem to have different format. We can not deal with it now. Exiting")
+
+          # The slices keep the numbers of the stack they were converted from
+          for im, index in enumerate( [ index1, index2 ] ):
+              if any( x is None for x in data.image_slices_extent[im] ):
+                  data.image_slices_extent[im] = [ index[ "firstSlice" ], index[ "firstSlice" ] + index[ "shape" ][0] - 1 ]
+
+        else:
+          raise Exception( "image_size_and_type(): image_format given in input (%s) does not match the extension found (%s)\nOmit image_format or define image_ext"%( data.image_format, data.image_ext ) )
+
     elif data.image_format != "RAW":
         raise Exception("image_size_and_type(): image_format not recognised. Give it as input")
 
+    save_image_properties( data )
+
     # === Loop over image numbers 0 and 1 === #
     for im in [ 0, 1 ]:
           # === Check we're not operating on a single file, i.e., either a 3D volume or a single 2D image file === #
@@ -88,6 +88,16 @@ def default_parameters( data={} ):
 
     data['memLimitMB']               = None
     data['nWorkers']                 = "auto"
+    data['pixel_search_engine']      = "direct"        # "direct", "sat", "pruned", "fft" or "auto"
+    data['pyramid_levels']           = 0               # levels of 2x binning for a coarse-to-fine pixel search, 0 = off
+                                                       #   (error 2048 flags the nodes where the coarse and fine searches disagree;
+                                                       #    it is partial: a wrong peak not among the coarse candidates is not flagged)
+    data['nodeBatchSize']            = 8               # number of nodes sent at once to each DIC_worker (per thread)
+    data['threadsPerWorker']         = 1               # threads of each DIC_worker, only the pixel search runs in parallel in them
+    data['slabPrefetch']             = False           # load the next slices while the current ones are correlated (halves the slabs)
+    data['ioThreads']                = 1               # threads reading the slices of the images
+    data['volumeCacheDir']           = None            # directory of the cache of the decoded images, None = no cache
+    data['volumeCacheLimitMB']       = 20480           # maximum size of the cache directory
 
     data['cc_threshold']             = 0
     data['kinematics_median_filter'] = 0
@@ -119,6 +129,7 @@ def default_parameters( data={} ):
     data['subpixel_II_interpolationMode']         = "map_coordinates"
     data['subpixel_II_interpolation_order']       = 1
     data['subpixel_II_optimisation_mode']         = "Powell"
+    data['subpixel_II_adaptive_tolerance']        = 0.001   # relative gain of 1 - NCC to go on refining in "adaptiveSubPixelSearch"
 
     # The following parameters were used by TomoWarp 2.0 (not implemented yet in the last version)
     #data['new_node_spacing']         = None
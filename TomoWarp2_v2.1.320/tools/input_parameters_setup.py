@@ -93,6 +93,37 @@ def input_parameters_setup( data ):
       except NameError:
         raise  Exception( "parameters_definition(): \'image_format\' was set to \'RAW\', but \'image_data_format\' was not set." )
 
+    # Integer pixel search engine: "direct" (C-code), "sat" (C-code with integral volume), "pruned" (C-code with early termination),
+    #   "fft" or "auto" (chosen for each node)
+    if not data.pixel_search_engine in [ "direct", "sat", "pruned", "fft", "auto" ]:
+      raise Exception( "input_parameters_setup(): \'pixel_search_engine\' should be \"direct\", \"sat\", \"pruned\", \"fft\" or \"auto\", got \"%s\""%( data.pixel_search_engine ) )
+
+    # Coarse-to-fine pixel search: number of levels of 2x binning above the full resolution
+    if type( data.pyramid_levels ) != int or data.pyramid_levels < 0:
+      raise Exception( "input_parameters_setup(): \'pyramid_levels\' should be a positive integer (0 to switch it off), got \"%s\""%( data.pyramid_levels ) )
+
+    # Stopping rule of the "adaptiveSubPixelSearch" image interpolation, relative to 1 - NCC
+    if type( data.subpixel_II_adaptive_tolerance ) not in [ int, float ] or data.subpixel_II_adaptive_tolerance < 0:
+      raise Exception( "input_parameters_setup(): \'subpixel_II_adaptive_tolerance\' should be a number >= 0 (0 to always refine down to 0.01 px), got \"%s\""%( data.subpixel_II_adaptive_tolerance ) )
+
+    if type( data.nodeBatchSize ) != int or data.nodeBatchSize < 1:
+      raise Exception( "input_parameters_setup(): \'nodeBatchSize\' should be an integer >= 1, got \"%s\""%( data.nodeBatchSize ) )
+
+    if type( data.threadsPerWorker ) != int or data.threadsPerWorker < 1:
+      raise Exception( "input_parameters_setup(): \'threadsPerWorker\' should be an integer >= 1, got \"%s\""%( data.threadsPerWorker ) )
+
+    if type( data.slabPrefetch ) != bool:
+      raise Exception( "input_parameters_setup(): \'slabPrefetch\' should be True or False, got \"%s\""%( data.slabPrefetch ) )
+
+    if type( data.ioThreads ) != int or data.ioThreads < 1:
+      raise Exception( "input_parameters_setup(): \'ioThreads\' should be an integer >= 1, got \"%s\""%( data.ioThreads ) )
+
+    if data.volumeCacheDir is not None and type( data.volumeCacheDir ) != str:
+      raise Exception( "input_parameters_setup(): \'volumeCacheDir\' should be a directory or None, got \"%s\""%( data.volumeCacheDir ) )
+
+    if type( data.volumeCacheLimitMB ) not in [ int, float ] or data.volumeCacheLimitMB <= 0:
+      raise Exception( "input_parameters_setup(): \'volumeCacheLimitMB\' should be a positive number, got \"%s\""%( data.volumeCacheLimitMB ) )
+
     if data.image_1_size  == None: data.image_1_size  = [None, None]
     if data.image_2_size  == None: data.image_2_size  = [None, None]
     if data.ROI_corners   == None: data.ROI_corners = [[None,None,None],[None,None,None]]
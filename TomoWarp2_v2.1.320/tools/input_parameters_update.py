@@ -36,6 +36,7 @@ The input to this file must be the Packaged (in lists)version of data
 import numpy, logging
 
 from cpu_set import cpu_set_count
+from load_slices import slab_capacity
 
 def input_parameters_update( data ):
     # 2015-03-02 EA: Adding an automatic measurement of number of available CPUs
@@ -48,27 +49,55 @@ def input_parameters_update( data ):
         try: logging.log.info("input_parameters_setup(): Number of CPUs %i"%( numberOfCPUs ))
         except: print "input_parameters_setup(): Number of CPUs %i"%( numberOfCPUs )
 
-        data.nWorkers = max( 1, numberOfCPUs )
+        # Each worker runs threadsPerWorker threads, but only the pixel search runs in parallel in them:
+        #   with the image interpolation (which holds the GIL) there is still one worker per CPU
+        if data.threadsPerWorker > 1 and data.subpixel_mode[1]:
+            data.nWorkers = numberOfCPUs
+            try: logging.log.info("input_parameters_update(): only the pixel search runs on the threadsPerWorker threads, %i workers"%( data.nWorkers ))
+            except: print "input_parameters_update(): only the pixel search runs on the threadsPerWorker threads, %i workers"%( data.nWorkers )
+        else:
+            data.nWorkers = max( 1, numberOfCPUs // data.threadsPerWorker )
 
 
     # memLimitMB has to be checked here because if set to numpy.inf it will become inf during printing
     data.memLimitSlices = min(data.image_slices_extent[0,1], data.image_slices_extent[1,1] )
     if data.memLimitMB is not None:
-        # the images are converter in 32 bit in load_slices
-        memSlice1 = data.image_size[0,-2] * data.image_size[0,-1] * 4 
-        memSlice2 = data.image_size[1,-2] * data.image_size[1,-1] * 4 
-        #memSlice1 = data.image_size[0,-2] * data.image_size[0,-1] * int( data.image_data_format[-1] )
-        #memSlice2 = data.image_size[1,-2] * data.image_size[1,-1] * int( data.image_data_format[-1] )
-        data.memLimitSlices =  min( data.memLimitSlices, data.memLimitMB  * 1024 * 1024  / ( memSlice1 + memSlice2 ) )
+        # the images are kept in their own data type in load_slices (float 32b if the type is not known)
+        #   NOTE: integer slabs with a missing slice are converted to float 32b (see read_images.missing_slices_to_nan)
+        # Only the slabs are ever in memory (the RAW volumes are memory-mapped and only the slab is read from them),
+        #   and their slices are cropped to the ROI
+        if data.image_data_format is None: bytesPerVoxel = 4
+        else:                              bytesPerVoxel = numpy.dtype( data.image_data_format ).itemsize
+        memSlice1 = ( data.ROI_corners[0][1][1] - data.ROI_corners[0][0][1] + 1 ) * ( data.ROI_corners[0][1][2] - data.ROI_corners[0][0][2] + 1 ) * bytesPerVoxel
+        memSlice2 = ( data.ROI_corners[1][1][1] - data.ROI_corners[1][0][1] + 1 ) * ( data.ROI_corners[1][1][2] - data.ROI_corners[1][0][2] + 1 ) * bytesPerVoxel
+        slicesInMemory = int( data.memLimitMB  * 1024 * 1024  / ( memSlice1 + memSlice2 ) )
+
+        # With the prefetch there are two slabs of each image in memory, if the thickest node still fits in a half
+        #   (the extents of image 2 are the thickest), otherwise there is no prefetch
+        if data.slabPrefetch:
+            nodeSlices = 2 * data.correlation_window[0] + data.search_window[0][1] - data.search_window[0][0] + 1
+            if slicesInMemory // 2 >= nodeSlices:
+                slicesInMemory = slicesInMemory // 2
+            else:
+                data.slabPrefetch = False
+                try: logging.log.warning("input_parameters_update(): memLimitMB is too small for two slabs, no prefetch of the slabs")
+                except: print "input_parameters_update(): memLimitMB is too small for two slabs, no prefetch of the slabs"
+
+        # The slab extents include both ends, a slab has memLimitSlices + 1 slices
+        data.memLimitSlices =  min( data.memLimitSlices, slicesInMemory - 1 )
 
         try:
           logging.log.info("memory limit:                  %.1f MB"%(data.memLimitMB)        )
           logging.log.info("memory of one slice of image1: %.1f MB"%(memSlice1 / 1024 / 1024))
           logging.log.info("memory of one slice of image2: %.1f MB"%(memSlice2 / 1024 / 1024))
+          logging.log.info("slices per slab:               %i%s"%(data.memLimitSlices, " (x2 for the prefetch)" if data.slabPrefetch else ""))
+          logging.log.info("memory of the slabs:           %.1f MB"%(slab_capacity( data ) * ( memSlice1 + memSlice2 ) / 1024.0 / 1024.0))
         except:
           print "memory limit:                  %.1f MB"%(data.memLimitMB)        
           print "memory of one slice of image1: %.1f MB"%(memSlice1 / 1024 / 1024)
           print "memory of one slice of image2: %.1f MB"%(memSlice2 / 1024 / 1024)
+          print "slices per slab:               %i%s"%(data.memLimitSlices, " (x2 for the prefetch)" if data.slabPrefetch else "")
+          print "memory of the slabs:           %.1f MB"%(slab_capacity( data ) * ( memSlice1 + memSlice2 ) / 1024.0 / 1024.0)
 
 
     # grey thresholds -- update them if they're None.
@@ -26,89 +26,95 @@
 
 
 """ 
-Load only images that are not yet in memory and concatenate them
+Load only images that are not yet in memory, into a ring buffer of slices
+
+The slices are kept in a ring buffer with a fixed number of slices (its capacity): the absolute
+  slice z is at position z % capacity. Moving down the volume only reads the new slices and
+  writes them over the ones that are not needed any more, nothing is reallocated or copied
+  (except once if a slice comes in a wider data type, e.g. a missing slice filled with NaNs).
+  The windows of the nodes are taken out of it with ring_rows().
 
 INPUTS:
 - array of desired extent for the image
 - array of externt for the image currently in memory
-- image current in memory
+- ring buffer with the image currently in memory (None or [] if there is none)
 - imageNumber (indicating reference 0 or deformed 1 image)
 - data structure
+- capacity of the ring buffer, if it has to be created (default slab_capacity( data ))
 
 OUTPUTS:
 - new extent
-- new image
+- ring buffer with the new image
 """
 
 import numpy
 from read_images import read_images
+from volume_cache import read_images_cached
 
 
-def load_slices( zExtents, zExtents_prev, image, imageNumber, data):
+def slab_capacity( data ):
+    # Number of slices of the ring buffers: one slab of data.memLimitSlices (the extents include both ends),
+    #   or two with the prefetch of the next slab (memLimitSlices is then halved in input_parameters_update)
+    capacity = int( data.memLimitSlices ) + 1
+    if data.slabPrefetch and data.memLimitMB is not None:
+        capacity *= 2
+    return capacity
 
-        z_top = zExtents[0]
-        z_bot = zExtents[1]
-        z_top_prev = zExtents_prev[0]
-        z_bot_prev = zExtents_prev[1]
 
-        if (z_top >= z_top_prev):
+def ring_rows( zTop, zBot, capacity ):
+    # Positions in the ring buffer of the slices zTop to zBot (included): a slice if they do not wrap around, an index array otherwise
+    if zBot < zTop:
+        return slice( 0, 0 )
+    if zTop % capacity <= zBot % capacity and zBot - zTop < capacity:
+        return slice( zTop % capacity, zBot % capacity + 1 )
+    return numpy.arange( zTop, zBot + 1 ) % capacity
 
-          if (z_top <= z_bot_prev):
-          # this is the most common case: the two interval have an intersection
 
-            # eliminate the slices we don't need anymore
-            image = image[ (z_top - z_top_prev)::]
+def write_ring( ring, zTop, slices, capacity ):
+    # Write the slices starting at the absolute slice zTop in the ring buffer,
+    #   creating it, or widening its data type, if needed
+    if ring is None or len( ring ) == 0:
+        ring = numpy.empty( ( capacity, ) + slices.shape[1:], dtype=slices.dtype )
+    elif numpy.result_type( ring.dtype, slices.dtype ) != ring.dtype:
+        ring = ring.astype( numpy.result_type( ring.dtype, slices.dtype ) )
 
-          else:
-          # in this case the two interval have not intersection (for instance for large node spacing)
-
-            # set the images to an empty array
-            image = []
+    ring[ ring_rows( zTop, zTop + len( slices ) - 1, len( ring ) ) ] = slices
+    return ring
 
-        else:
-        # this is the case where the new intervall starts before the old one
 
-          if z_bot < z_top_prev:
-          # in this case the two interval have not intersection (but the new one starts before the old one: I wonder if it will ever happen)
+def load_slices( zExtents, zExtents_prev, image, imageNumber, data, capacity=None ):
 
-            # set the images to an empty array
-            image = []
+        z_top = zExtents[0]
+        z_bot = zExtents[1]
+        z_top_prev = zExtents_prev[0]
+        z_bot_prev = zExtents_prev[1]
 
-          elif z_bot < z_bot_prev:
+        if image is not None and len( image ) > 0:
+          capacity = len( image )
+        elif capacity is None:
+          capacity = slab_capacity( data )
 
-            # if the new z_bot is lower than before it keeps the extra slices and update the z_bot value
-            z_bot = z_bot_prev
+        if z_bot - z_top + 1 > capacity:
+          raise Exception( "load_slices(): slices %i to %i do not fit in the %i slices of the slab buffer"%( z_top, z_bot, capacity ) )
 
-          # load slices for this interval to fill the gap before the previous interval
-          try:
-            image_add = read_images( data.image_data_format, data.image_format, data.image_size[imageNumber-1], data.DIR_image[imageNumber-1], \
-              data.image_prefix[imageNumber-1], data.image_digits[imageNumber-1], data.image_ext, data.ROI_corners[imageNumber-1], [ z_top, min(z_bot, z_top_prev-1)]  )
-          except Exception as exc:
-            raise Exception(exc)
+        # Slices to read: all of them if there is nothing in memory or no intersection with what is in memory,
+        #   otherwise the ones before and after the previous interval
+        if image is None or len( image ) == 0 or z_bot < z_top_prev or z_top > z_bot_prev:
+          toRead = [ [ z_top, z_bot ] ]
+        else:
+          toRead = [ [ z_top, min( z_bot, z_top_prev-1 ) ], [ max( z_top, z_bot_prev+1 ), z_bot ] ]
 
-          # images have to be converted to float 32b
-          # to be investigated!
-          image_add = image_add.astype( '<f4' )
+        for z_read_top, z_read_bot in toRead:
+          if z_read_bot < z_read_top:
+            continue
 
-          if len(image) > 0:
-            image = numpy.concatenate((image_add, image))
+          if data.volumeCacheDir is not None:
+            image_add = read_images_cached( data, imageNumber, [ z_read_top, z_read_bot ] )
           else:
-            image = image_add.copy()
-
-
-        if z_bot > z_bot_prev:
-
-            # load slices for this interval to fill the gap after the previous interval
             image_add = read_images( data.image_data_format, data.image_format, data.image_size[imageNumber-1], data.DIR_image[imageNumber-1], \
-              data.image_prefix[imageNumber-1], data.image_digits[imageNumber-1], data.image_ext, data.ROI_corners[imageNumber-1], [ max(z_top,z_bot_prev+1), z_bot]  )
-
-            # images have to be converted to float 32b
-            # to be investigated!
-            image_add = image_add.astype( '<f4' )
+              data.image_prefix[imageNumber-1], data.image_digits[imageNumber-1], data.image_ext, data.ROI_corners[imageNumber-1], [ z_read_top, z_read_bot ], data.ioThreads )
 
-            if len(image) > 0:
-              image = numpy.concatenate((image, image_add))
-            else:
-              image = image_add.copy()
+          # images are kept in their own data type, they are converted to float 32b window by window in DIC_worker
+          image = write_ring( image, z_read_top, image_add, capacity )
 
-        return ( [ z_top, z_bot ], image )
\ No newline at end of file
+        return ( [ z_top, z_bot ], image )
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016, Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+# This file is part of TomoWarp2.
+#
+# TomoWarp2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TomoWarp2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TomoWarp2.  If not, see <http://www.gnu.org/licenses/>.
+
+# ===================================================================
+# ===========================  TomoWarp2  ===========================
+# ===================================================================
+
+# Authors: Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+"""
+Plan, before loading anything, the sequence of slabs (z-extents of image 1 and image 2)
+  that DIC_setup asks to data_delivery_worker, and the nodes treated in each of them.
+
+If all the nodes fit in one slab, that is the plan. Otherwise the nodes are grouped in levels: the nodes
+  with the same top slice in image 1 (a row of nodes of the grid), split when they do not fit together in
+  a slab. The levels are sorted by their top slice in image 1, and each slab takes a run of consecutive
+  levels, with the smallest z-extents that hold all their nodes and at most data.memLimitSlices thick.
+  Since load_slices only keeps the slices that the next slab shares with the current one, the data read
+  by a slab are its slices that were not in the slab before. The runs are chosen by dynamic programming
+  over the levels (the state is the last slab) to minimise the total data read, and then the number of
+  slabs. Each slab is then made thicker towards the next one when this is free, and takes the nodes of
+  later slabs that fit in it.
+
+This is the best plan in which a level is never split between slabs (up to the MAX_STATES slabs kept for
+  each level). The greedy plan of the earlier versions of DIC_setup (each slab starts at the top of the
+  nodes not done yet and is memLimitSlices thick) can split them, and is used instead when it reads no
+  more data with fewer slabs, or when there are more than MAX_LEVELS levels (nodes not on a grid), for
+  which the dynamic programming is too slow.
+
+INPUTS:
+- extents of the nodes ( node number, im_number 0,1, top/bottom, z/y/x )
+- nodeDoneTable (nodes already done or excluded are not planned)
+- data structure
+
+OUTPUTS:
+- plan: list of slabs [ [ top_im1, bottom_im1 ], [ top_im2, bottom_im2 ], node numbers ]
+- node numbers that could not be put in any slab
+"""
+
+import numpy
+import logging
+
+# Above this number of levels the dynamic programming takes too long, and the greedy plan is used
+MAX_LEVELS = 2000
+# Number of slabs ending with each level kept in the dynamic programming, the cheapest ones
+MAX_STATES = 8
+
+
+def rotation_padding( data ):
+    # Voxels needed by the image interpolation with rotation on each side of the window of image 2 of a node,
+    #   the cornerOffsetRot of DIC_worker. They are delivered with the window (see node_data()), 0 without rotation
+    if not ( data.subpixel_mode[1] and data.subpixel_mode[2] ):
+        return 0
+    windowSize = max( [ 2*halfWindow + 1 for halfWindow in data.correlation_window ] )
+    return int( ( ( numpy.sqrt(3) * windowSize ) - windowSize + 1 ) / 2.0 )
+
+
+def slice_voxels( data ):
+    # Number of voxels of a slice of each image as load_slices reads it, cropped to the ROI (as in input_parameters_update)
+    return numpy.array( [ ( data.ROI_corners[i][1][1] - data.ROI_corners[i][0][1] + 1 ) * ( data.ROI_corners[i][1][2] - data.ROI_corners[i][0][2] + 1 ) \
+                          for i in range( 2 ) ], dtype=float )
+
+
+def new_slices( top, bottom, previousTop, previousBottom ):
+    # Number of slices of [ top, bottom ] that are not in [ previousTop, previousBottom ] (arrays are fine)
+    overlap = numpy.maximum( 0, numpy.minimum( bottom, previousBottom ) - numpy.maximum( top, previousTop ) + 1 )
+    return ( bottom - top + 1 ) - overlap
+
+
+def plan_slabs( extents, nodeDoneTable, data ):
+
+    nodeDone = numpy.array( nodeDoneTable, dtype=bool ).reshape( -1 )
+
+    # Extra slices of image 2 for the rotation in the image interpolation
+    rotationPadding = rotation_padding( data )
+
+    # z-extents of the slabs needed by each node [ top_im1, bottom_im1, top_im2, bottom_im2 ]
+    zExtents = numpy.zeros( ( extents.shape[0], 4 ), dtype=int )
+    zExtents[:,0] = extents[:,0,0,0]
+    zExtents[:,1] = extents[:,0,1,0]
+    zExtents[:,2] = numpy.maximum( extents[:,1,0,0] - rotationPadding, data.image_slices_extent[1,0] )
+    zExtents[:,3] = numpy.minimum( extents[:,1,1,0] + rotationPadding, data.image_slices_extent[1,1] )
+
+    # The nodes for which the padding makes image 2 too thick are planned without it,
+    #   DIC_worker then asks for the data of the rotation in a second request
+    tooThickPadded = zExtents[:,3] - zExtents[:,2] > data.memLimitSlices
+    zExtents[ tooThickPadded, 2 ] = extents[ tooThickPadded, 1, 0, 0 ]
+    zExtents[ tooThickPadded, 3 ] = extents[ tooThickPadded, 1, 1, 0 ]
+
+    # The nodes that do not fit in a slab even alone are left out, the others are planned
+    fitsAlone = ( zExtents[:,1] - zExtents[:,0] <= data.memLimitSlices ) & ( zExtents[:,3] - zExtents[:,2] <= data.memLimitSlices )
+    nodes     = numpy.where( numpy.logical_not( nodeDone ) & fitsAlone )[0]
+    tooThick  = numpy.where( numpy.logical_not( nodeDone ) & numpy.logical_not( fitsAlone ) )[0]
+    if len( nodes ) == 0:
+        return [], tooThick
+
+    # Weight of a slice of each image, so that the data read (and not only the number of slices) is minimised
+    sliceWeight = slice_voxels( data )
+
+    # All the nodes fit in one slab, nothing to plan
+    hull = [ zExtents[nodes,0].min(), zExtents[nodes,1].max(), zExtents[nodes,2].min(), zExtents[nodes,3].max() ]
+    if hull[1] - hull[0] <= data.memLimitSlices and hull[3] - hull[2] <= data.memLimitSlices:
+        return [ [ [ int( hull[0] ), int( hull[1] ) ], [ int( hull[2] ), int( hull[3] ) ], nodes ] ], tooThick
+
+    # The greedy plan is kept if it plans all the nodes with no more data read and fewer slabs (see above)
+    plan                  = level_plan( zExtents, nodes, sliceWeight, data.memLimitSlices )
+    greedy, greedyMissing = greedy_plan( zExtents, nodes, data.memLimitSlices )
+    if plan is None:
+        try: logging.log.info( "plan_slabs(): more than %i levels of nodes, using the greedy plan"%( MAX_LEVELS ) )
+        except: print "plan_slabs(): more than %i levels of nodes, using the greedy plan"%( MAX_LEVELS )
+        return greedy, numpy.sort( numpy.concatenate( ( tooThick, greedyMissing ) ) )
+    if len( greedyMissing ) == 0 and ( plan_cost( greedy, sliceWeight ), len( greedy ) ) < ( plan_cost( plan, sliceWeight ), len( plan ) ):
+        plan = greedy
+
+    return plan, tooThick
+
+
+def level_plan( zExtents, nodes, sliceWeight, memLimitSlices ):
+    # Slabs made of runs of consecutive levels, with the smallest data read, see above.
+    #   Returns None if there are too many levels for the dynamic programming (more than MAX_LEVELS)
+
+    # --- Levels: nodes with the same z-extents, sorted by top slice in image 1 (then image 2) ---
+    nodes      = nodes[ numpy.lexsort( ( zExtents[nodes,3], zExtents[nodes,1], zExtents[nodes,2], zExtents[nodes,0] ) ) ]
+    newLevel   = numpy.concatenate( ( [ True ], ( numpy.diff( zExtents[nodes], axis=0 ) != 0 ).any( axis=1 ) ) )
+    levelStart = numpy.concatenate( ( numpy.where( newLevel )[0], [ len( nodes ) ] ) )
+    levels     = zExtents[ nodes[ levelStart[:-1] ] ]
+
+    # --- Levels with the same top slice in image 1 (a row of nodes) are taken together, when they fit in a slab ---
+    groupStart = [ 0 ]
+    hull       = levels[0].copy()
+    for level in range( 1, len( levels ) ):
+        hull[0] = min( hull[0], levels[level,0] )
+        hull[1] = max( hull[1], levels[level,1] )
+        hull[2] = min( hull[2], levels[level,2] )
+        hull[3] = max( hull[3], levels[level,3] )
+        if levels[level,0] != levels[level-1,0] or hull[1] - hull[0] > memLimitSlices or hull[3] - hull[2] > memLimitSlices:
+            groupStart.append( level )
+            hull = levels[level].copy()
+    groupStart = numpy.array( groupStart + [ len( levels ) ], dtype=int )
+    levels     = numpy.array( [ [ levels[ a:b, 0 ].min(), levels[ a:b, 1 ].max(), levels[ a:b, 2 ].min(), levels[ a:b, 3 ].max() ] \
+                                for a, b in zip( groupStart[:-1], groupStart[1:] ) ], dtype=int )
+    levelStart = levelStart[ groupStart ]
+    nLevels    = len( levels )
+    if nLevels > MAX_LEVELS:
+        return None
+
+    # --- Dynamic programming on the last slab ---
+    #   The states are the slabs ending with each level j, they are kept in the rows stateOffset[j]:stateOffset[j+1] of:
+    #     stateStarts   the first level of the slab
+    #     stateExtents  its z-extents [ top_im1, bottom_im1, top_im2, bottom_im2 ]
+    #     stateCosts    the smallest data read for the levels 0..j with this slab as the last one, and
+    #     stateCounts   the number of slabs for it
+    #     statePrevious the row of the slab before it (-1 for the first slab)
+    #   The slabs ending with level j are nested (the ones starting higher hold the others), and the data read after
+    #   a slab can only be smaller if it is larger. So a slab is only kept if no larger one ending with the same level
+    #   has a smaller cost, this does not change the best plan. Only the MAX_STATES cheapest are then kept, so that
+    #   the work for each level stays bounded.
+    stateStarts   = Rows( int,   1 )
+    stateExtents  = Rows( int,   4 )
+    stateCosts    = Rows( float, 1 )
+    stateCounts   = Rows( int,   1 )
+    statePrevious = Rows( int,   1 )
+    stateOffset   = numpy.zeros( nLevels + 1, dtype=int )
+
+    for j in range( nLevels ):
+        # Extents of the slabs holding levels i..j for i = j, j-1, ..., they only grow with more levels.
+        #   The levels with their top slice in image 1 above the bottom of level j less memLimitSlices can not be in them
+        first = numpy.searchsorted( levels[:,0], levels[j,1] - memLimitSlices, side='left' )
+        hulls = levels[ first:j+1 ][::-1].copy()
+        hulls[:,0] = numpy.minimum.accumulate( hulls[:,0] )
+        hulls[:,1] = numpy.maximum.accumulate( hulls[:,1] )
+        hulls[:,2] = numpy.minimum.accumulate( hulls[:,2] )
+        hulls[:,3] = numpy.maximum.accumulate( hulls[:,3] )
+        fits  = ( hulls[:,1] - hulls[:,0] <= memLimitSlices ) & ( hulls[:,3] - hulls[:,2] <= memLimitSlices )
+        nHulls = len( fits ) if fits.all() else numpy.argmin( fits )
+
+        # Turned round to start with the largest slab, starts[k] is the first level of hulls[k]
+        hulls  = hulls[ :nHulls ][::-1]
+        starts = numpy.arange( j - nHulls + 1, j + 1 )
+        costs    = numpy.zeros( nHulls, dtype=float )
+        counts   = numpy.ones(  nHulls, dtype=int )
+        previous = -numpy.ones( nHulls, dtype=int )
+
+        if starts[0] == 0:
+            # The first slab of the plan
+            costs[0] = sliceWeight[0] * ( hulls[0,1] - hulls[0,0] + 1 ) + sliceWeight[1] * ( hulls[0,3] - hulls[0,2] + 1 )
+
+        # All the slabs ending with the levels starts-1, the one before each slab
+        rows = numpy.arange( stateOffset[ max( starts[0], 1 ) - 1 ], stateOffset[j] )
+        if len( rows ) > 0:
+            rowStarts       = numpy.searchsorted( stateOffset[ :j+1 ], rows, side='right' ) - starts[0]
+            rowHulls       = hulls[ rowStarts ]
+            previousExtents = stateExtents.rows[ rows ]
+            candidateCosts = stateCosts.rows[ rows ] + sliceWeight[0] * new_slices( rowHulls[:,0], rowHulls[:,1], previousExtents[:,0], previousExtents[:,1] ) \
+                                                     + sliceWeight[1] * new_slices( rowHulls[:,2], rowHulls[:,3], previousExtents[:,2], previousExtents[:,3] )
+
+            # Best slab before each one: smallest cost, then fewest slabs
+            order = numpy.lexsort( ( stateCounts.rows[ rows ], candidateCosts, rowStarts ) )
+            best  = order[ numpy.concatenate( ( [ True ], numpy.diff( rowStarts[ order ] ) != 0 ) ) ]
+            costs[    rowStarts[ best ] ] = candidateCosts[ best ]
+            counts[   rowStarts[ best ] ] = stateCounts.rows[ rows[ best ] ] + 1
+            previous[ rowStarts[ best ] ] = rows[ best ]
+
+        # Keep the slabs with no larger one as cheap (see above), and at most MAX_STATES of them, the cheapest
+        cheapest = numpy.concatenate( ( [ numpy.inf ], numpy.minimum.accumulate( costs )[:-1] ) )
+        keep     = costs <= cheapest
+        if keep.sum() > MAX_STATES:
+            keep[ numpy.where( keep )[0][ numpy.lexsort( ( counts[ keep ], costs[ keep ] ) )[ MAX_STATES: ] ] ] = False
+
+        stateStarts.append( starts[ keep ] )
+        stateExtents.append( hulls[ keep ] )
+        stateCosts.append( costs[ keep ] )
+        stateCounts.append( counts[ keep ] )
+        statePrevious.append( previous[ keep ] )
+        stateOffset[j+1] = stateOffset[j] + keep.sum()
+
+    # --- Walk back from the best last slab ---
+    plan = []
+    rows = numpy.arange( stateOffset[ nLevels - 1 ], stateOffset[ nLevels ] )
+    row  = rows[ numpy.lexsort( ( stateCounts.rows[ rows ], stateCosts.rows[ rows ] ) )[0] ]
+    j    = nLevels - 1
+    while row >= 0:
+        i    = stateStarts.rows[ row ]
+        hull = stateExtents.rows[ row ]
+        plan.insert( 0, [ [ int( hull[0] ), int( hull[1] ) ], [ int( hull[2] ), int( hull[3] ) ], numpy.sort( nodes[ levelStart[i]:levelStart[j+1] ] ) ] )
+        row  = statePrevious.rows[ row ]
+        j    = i - 1
+
+    return merge_slabs( plan, zExtents, sliceWeight, memLimitSlices )
+
+
+class Rows:
+    # Rows of an array that grows at the end, with room for twice as many when full
+    def __init__( self, dtype, width ):
+        self.buffer = numpy.zeros( ( 1024, width ), dtype=dtype )
+        self.length = 0
+        self.width  = width
+        self.rows   = self.buffer[ :0 ].reshape( ( 0, ) if width == 1 else ( 0, width ) )
+
+    def append( self, values ):
+        values = numpy.reshape( values, ( -1, self.width ) )
+        if self.length + len( values ) > len( self.buffer ):
+            buffer = numpy.zeros( ( 2 * ( self.length + len( values ) ), self.width ), dtype=self.buffer.dtype )
+            buffer[ :self.length ] = self.buffer[ :self.length ]
+            self.buffer = buffer
+        self.buffer[ self.length:self.length + len( values ) ] = values
+        self.length += len( values )
+        self.rows    = self.buffer[ :self.length ] if self.width > 1 else self.buffer[ :self.length, 0 ]
+
+
+def greedy_plan( zExtents, nodes, memLimitSlices ):
+    # The plan of the earlier versions of DIC_setup: each slab starts at the top slices of the nodes not done yet,
+    #   takes the nodes that fit in it when it is memLimitSlices thick, and its bottom is then brought up to the
+    #   lowest slice these nodes need. Returns the plan and the nodes that fit in no slab this way.
+    nodeDone = numpy.ones( zExtents.shape[0], dtype=bool )
+    nodeDone[ nodes ] = False
+    plan     = []
+    missing  = []
+
+    # --- Nodes sorted by the top slice of their extents in image 1 and image 2 ---
+    #   to pick the nodes of a slab with a searchsorted, and to follow the top slice of the nodes not done yet
+    #   (firstNotDone_imX: position in orderTop_imX before which all the nodes are done)
+    orderTop_image1      = nodes[ numpy.argsort( zExtents[nodes,0], kind='mergesort' ) ]
+    orderTop_image2      = nodes[ numpy.argsort( zExtents[nodes,2], kind='mergesort' ) ]
+    sortedTop_image1     = zExtents[ orderTop_image1, 0 ]
+    firstNotDone_image1  = 0
+    firstNotDone_image2  = 0
+
+    while True:
+        # Calculate the highest slice from NOT done nodes
+        while firstNotDone_image1 < len( orderTop_image1 ) and nodeDone[ orderTop_image1[ firstNotDone_image1 ] ]:
+            firstNotDone_image1 += 1
+        while firstNotDone_image2 < len( orderTop_image2 ) and nodeDone[ orderTop_image2[ firstNotDone_image2 ] ]:
+            firstNotDone_image2 += 1
+        if firstNotDone_image1 == len( orderTop_image1 ):
+            break
+
+        currentTopSlice_image1    = zExtents[ orderTop_image1[ firstNotDone_image1 ], 0 ]
+        currentTopSlice_image2    = zExtents[ orderTop_image2[ firstNotDone_image2 ], 2 ]
+        currentBottomSlice_image1 = currentTopSlice_image1 + memLimitSlices
+        currentBottomSlice_image2 = currentTopSlice_image2 + memLimitSlices
+
+        # Check for the nodes not done yet whether they are inside this block of data,
+        #   only the nodes with the top slice of image 1 inside it can be
+        candidates  = orderTop_image1[ numpy.searchsorted( sortedTop_image1, currentTopSlice_image1, side='left'  ) : \
+                                       numpy.searchsorted( sortedTop_image1, currentBottomSlice_image1, side='right' ) ]
+        inSlab      = numpy.logical_not( nodeDone[ candidates ] )                      \
+                        & ( zExtents[ candidates, 1 ] <= currentBottomSlice_image1 ) \
+                        & ( zExtents[ candidates, 2 ] >= currentTopSlice_image2    ) \
+                        & ( zExtents[ candidates, 3 ] <= currentBottomSlice_image2 )
+        nodesInSlab = numpy.sort( candidates[ inSlab ] )
+
+        if len( nodesInSlab ) == 0:
+            # The top node does not fit with the top of image 2, leave it out and go on with the others
+            missing.append( orderTop_image1[ firstNotDone_image1 ] )
+            nodeDone[ orderTop_image1[ firstNotDone_image1 ] ] = True
+            continue
+
+        # Do not read further than what the nodes of this slab need
+        plan.append( [ [ int( currentTopSlice_image1 ), int( zExtents[ nodesInSlab, 1 ].max() ) ], \
+                       [ int( currentTopSlice_image2 ), int( zExtents[ nodesInSlab, 3 ].max() ) ], nodesInSlab ] )
+        nodeDone[ nodesInSlab ] = True
+
+    return plan, numpy.array( missing, dtype=int )
+
+
+def plan_cost( plan, sliceWeight ):
+    # Data read by load_slices for the plan, in the units of sliceWeight
+    return sliceWeight[0] * slices_read( [ slab[0] for slab in plan ] ) + sliceWeight[1] * slices_read( [ slab[1] for slab in plan ] )
+
+
+def merge_slabs( plan, zExtents, sliceWeight, memLimitSlices ):
+    # The slabs of plan_slabs() hold runs of consecutive levels and are as thin as their nodes allow.
+    #   Going down the plan, each slab is made as thick as the memory limit allows towards the bottom of the
+    #   next one, when this does not make the data read any larger (the slices are then read by this slab
+    #   instead of the next one). The nodes of the later slabs that fit in it are moved to it, and the
+    #   slabs left empty are dropped if this does not make the data read any larger either.
+    cost = plan_cost( plan, sliceWeight )
+
+    for k in range( len( plan ) - 1 ):
+        for imageNumber in range( 2 ):
+            top, bottom = plan[k][imageNumber]
+            extended    = min( top + memLimitSlices, max( bottom, plan[k+1][imageNumber][1] ) )
+            if extended > bottom:
+                plan[k][imageNumber] = [ top, extended ]
+                extendedCost         = plan_cost( plan, sliceWeight )
+                if extendedCost <= cost: cost = extendedCost
+                else:                    plan[k][imageNumber] = [ top, bottom ]
+
+        top1, bottom1 = plan[k][0]
+        top2, bottom2 = plan[k][1]
+        for slab in plan[k+1:]:
+            nodeExtents = zExtents[ slab[2] ]
+            fits = ( nodeExtents[:,0] >= top1 ) & ( nodeExtents[:,1] <= bottom1 ) & ( nodeExtents[:,2] >= top2 ) & ( nodeExtents[:,3] <= bottom2 )
+            if fits.any():
+                plan[k][2] = numpy.sort( numpy.concatenate( ( plan[k][2], slab[2][ fits ] ) ) )
+                slab[2]    = slab[2][ numpy.logical_not( fits ) ]
+
+    k = 0
+    while k < len( plan ):
+        if len( plan[k][2] ) == 0 and plan_cost( plan[:k] + plan[k+1:], sliceWeight ) <= cost:
+            plan = plan[:k] + plan[k+1:]
+        else:
+            k += 1
+
+    return plan
+
+
+def slices_read( zExtentsList ):
+    # Number of slices read by load_slices for a sequence of z-extents: the ones that were not in the previous extents
+    slices   = 0
+    previous = [ -1, -1 ]
+    for top, bottom in zExtentsList:
+        slices  += new_slices( top, bottom, previous[0], previous[1] )
+        previous = [ top, bottom ]
+    return int( slices )
+
+
+def slices_needed( zExtents ):
+    # Number of slices in the union of the z-extents of the nodes
+    if len( zExtents ) == 0: return 0
+    zExtents = numpy.array( zExtents )
+    coverage = numpy.zeros( zExtents.max() - zExtents.min() + 2, dtype=int )
+    numpy.add.at( coverage, zExtents[:,0] - zExtents.min(),     1 )
+    numpy.add.at( coverage, zExtents[:,1] - zExtents.min() + 1, -1 )
+    return int( ( numpy.cumsum( coverage ) > 0 ).sum() )
+
+
+def log_slab_plan( plan, extents, data ):
+    # Log how much data will be read with this plan against the minimum (each slice needed by a node read once)
+    if data.image_data_format is None: bytesPerVoxel = 4
+    else:                              bytesPerVoxel = numpy.dtype( data.image_data_format ).itemsize
+
+    plannedNodes = numpy.concatenate( [ slab[2] for slab in plan ] ) if len( plan ) > 0 else numpy.array( [], dtype=int )
+
+    bytesRead    = 0
+    bytesMinimum = 0
+    for imageNumber in range( 2 ):
+        bytesSlice    = slice_voxels( data )[imageNumber] * bytesPerVoxel
+        bytesRead    += bytesSlice * slices_read( [ slab[imageNumber] for slab in plan ] )
+        bytesMinimum += bytesSlice * slices_needed( extents[ plannedNodes, imageNumber, :, 0 ] )
+
+    try:
+      logging.log.info( "plan_slabs(): %i slabs, expected data read %.1f MB (minimum %.1f MB)"%( len( plan ), bytesRead / 1024.0 / 1024.0, bytesMinimum / 1024.0 / 1024.0 ) )
+    except:
+      print "plan_slabs(): %i slabs, expected data read %.1f MB (minimum %.1f MB)"%( len( plan ), bytesRead / 1024.0 / 1024.0, bytesMinimum / 1024.0 / 1024.0 )
+
+    return bytesRead, bytesMinimum
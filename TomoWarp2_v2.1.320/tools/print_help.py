@@ -109,7 +109,8 @@ def help_continuum_slices_inputfile():
   print '                               or as an option in the command line)' 
   print '  DIR_image2                 (it has to be defined either in the inputfile'
   print '                               or as an option in the command line)'
-  print '  image_format               (Selects a type of image reader, RAW, EDF, TIFF)'
+  print '  image_format               (Selects a type of image reader, RAW, EDF, TIFF, CHUNKED)'
+  print '                               CHUNKED volumes (.twc) are made with python -m tools.chunked_volume'
   print '  image_data_format          REQUIRED if image_format == "RAW" (sets RAW data format with a'
   print '                               numpy-recognisable dtype, e.g., little-endian 32-bit float is \'<f4\')'
   print '  image_raw_size             REQUIRED if image_format == "RAW" and a crop is set'
@@ -29,6 +29,59 @@
 import logging
 from print_variable import pv
 
+
+def empty_volume( shape, image_data_format ):
+    """
+    Volume to read the slices into, in the data type of the images, so that integer images are
+      not doubled (or quadrupled) in memory.
+    Float volumes start as NaN as before, for integer volumes the slices that could not be read
+      are set to NaN at the end by missing_slices_to_nan()
+    """
+    import numpy
+
+    outputVolume = numpy.zeros( shape, dtype=image_data_format )
+    if outputVolume.dtype.kind == 'f':
+        outputVolume[:] = numpy.nan
+
+    return outputVolume
+
+
+def missing_slices_to_nan( outputVolume, missingSlices ):
+    """
+    Slices that could not be read have to be NaN, which needs a float volume:
+      an integer volume is only converted to float 32b when this happens
+    """
+    import numpy
+
+    if len( missingSlices ) > 0 and outputVolume.dtype.kind != 'f':
+        outputVolume = outputVolume.astype( '<f4' )
+        outputVolume[ missingSlices ] = numpy.nan
+
+    return outputVolume
+
+def read_slices( read_slice, numberOfSlices, ioThreads=1 ):
+    """
+    Call read_slice( sliceNumber ) for all the slices, on a pool of ioThreads threads if ioThreads > 1.
+      read_slice writes the slice in the preallocated output volume and returns False if it could not be read.
+      File reading and decompression release the GIL, so the slices are read in parallel.
+
+    Returns the list of the slices that could not be read
+    """
+    from multiprocessing.pool import ThreadPool
+
+    if ioThreads > 1 and numberOfSlices > 1:
+        pool = ThreadPool( min( ioThreads, numberOfSlices ) )
+        try:
+            sliceRead = pool.map( read_slice, range( numberOfSlices ) )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        sliceRead = [ read_slice( sliceNumber ) for sliceNumber in range( numberOfSlices ) ]
+
+    return [ sliceNumber for sliceNumber in range( numberOfSlices ) if not sliceRead[ sliceNumber ] ]
+
+
 def read_raw_3D( image_data_format, image_size, base_dir, raw_base_name, extension, slices_range, crop ):
     """
       This reads RAW volume
@@ -43,32 +96,48 @@ def read_raw_3D( image_data_format, image_size, base_dir, raw_base_name, extensi
     - crop                list of lists: [ [ x_min, x_max ], [ y_min, y_max ] ]
     """    
     
+    import os
     import numpy
     
     filename = "%s/%s%s"%( base_dir, raw_base_name, extension )
-    try: logging.log.debug( "read_raw_3D: Loading Full Volume: %s"%(filename) )
-    except: print "read_raw_3D: Loading Full Volume: %s"%(filename) 
+    try: logging.log.debug( "read_raw_3D: Reading slices %i to %i of: %s"%( slices_range[0], slices_range[1], filename ) )
+    except: print "read_raw_3D: Reading slices %i to %i of: %s"%( slices_range[0], slices_range[1], filename ) 
 
+    if not os.path.isfile( filename ):
+      try: logging.log.warning( "read_raw_3D(): File %s not found "%filename )
+      except: print  "read_raw_3D(): File %s not found "%filename 
+      raise Exception( "read_raw_3D(): File %s not found "%filename )
+
+    # The volume is memory-mapped, only the requested slices and crop are actually read from the file
     try:
-      outputVolume = numpy.fromfile( filename, dtype=image_data_format )
-    except:
-      try: logging.log.warning( "read_raw_slices(): File %s not found "%filename )
-      except: print  "read_raw_slices(): File %s not found "%filename 
-      outputVolume = []
-      
-    try:
-      if outputVolume != []:
-        outputVolume = outputVolume.reshape( image_size )
+      if os.path.getsize( filename ) != numpy.prod( image_size ) * numpy.dtype( image_data_format ).itemsize:
+        raise Exception
+      volume = numpy.memmap( filename, dtype=image_data_format, mode='r', shape=tuple( image_size ) )
     except:
-      raise Exception( "read_raw_slices(): Check image dimensions or ROI")
+      raise Exception( "read_raw_3D(): Check image dimensions or ROI")
+
+    # Slices outside the volume are missing (NaN)
+    numberOfSlices = int( slices_range[1] - slices_range[0] + 1 )
+    zFirst         = max( slices_range[0], 0 )
+    zLast          = min( slices_range[1], image_size[0] - 1 )
+    cropped        = volume[ zFirst:zLast+1, crop[0][1]:crop[1][1]+1, crop[0][2]:crop[1][2]+1 ]
+
+    if zFirst == slices_range[0] and zLast == slices_range[1]:
+      outputVolume = numpy.array( cropped )
+    else:
+      outputVolume  = empty_volume( ( numberOfSlices, ) + cropped.shape[1:], image_data_format )
+      missingSlices = range( 0, zFirst - slices_range[0] ) + range( zLast - slices_range[0] + 1, numberOfSlices )
+      if zLast >= zFirst:
+        outputVolume[ zFirst - slices_range[0]:zLast - slices_range[0] + 1 ] = cropped
+      outputVolume  = missing_slices_to_nan( outputVolume, missingSlices )
 
-    outputVolume = outputVolume[ slices_range[0]:slices_range[1]+1, crop[0][1]:crop[1][1]+1, crop[0][2]:crop[1][2]+1 ]
+    del cropped, volume
 
     return outputVolume
 
 
 
-def read_raw_slices( image_data_format, image_size, base_dir, raw_base_name, digits, extension, slices_range, crop=None ):
+def read_raw_slices( image_data_format, image_size, base_dir, raw_base_name, digits, extension, slices_range, crop=None, ioThreads=1 ):
     """
     2014-05-16 -- Edward Ando and Nadia Demartinou
       This reads RAW slices, and returns a 3D volume
@@ -82,6 +151,7 @@ def read_raw_slices( image_data_format, image_size, base_dir, raw_base_name, dig
     - extension           extension of raw files
     - slices_range        tuple or list of number of slices to read
     - crop                list of lists: [ [ x_min, x_max ], [ y_min, y_max ] ]
+    - ioThreads           number of slices read at the same time
     """    
     import numpy
     
@@ -89,11 +159,11 @@ def read_raw_slices( image_data_format, image_size, base_dir, raw_base_name, dig
     numberOfSlices = int( slices_range[1] - slices_range[0] + 1 )
     
     if crop == None:
-        outputVolume = numpy.ones( ( numberOfSlices, image_size[1], image_size[0] ), dtype=image_data_format ) * numpy.nan
+        outputVolume = empty_volume( ( numberOfSlices, image_size[1], image_size[0] ), image_data_format )
     else:
-        outputVolume = numpy.ones( ( numberOfSlices, crop[1][1]-crop[1][0], crop[0][1]-crop[0][0] ), dtype=image_data_format ) * numpy.nan
+        outputVolume = empty_volume( ( numberOfSlices, crop[1][1]-crop[1][0], crop[0][1]-crop[0][0] ), image_data_format )
 
-    for sliceNumber in range( numberOfSlices ):
+    def read_slice( sliceNumber ):
         
         try:
             # 2016-04-30 ET: if worrking in 2D digits == 0 and the name in constructed differently
@@ -101,14 +171,15 @@ def read_raw_slices( image_data_format, image_size, base_dir, raw_base_name, dig
               filename = "%s/%s%s"%( base_dir, raw_base_name, extension )
             else:
               filename = "%s/%s%0*i%s"%( base_dir, raw_base_name, int(digits), sliceNumber + slices_range[0], extension )
-            currentImage = numpy.fromfile( filename, dtype=image_data_format )
+            # Memory-mapped, only the cropped rows are actually read from the file
+            currentImage = numpy.memmap( filename, dtype=image_data_format, mode='r' )
         except:
             try: logging.log.warning( "read_raw_slices(): File %s not found "%filename )
             except: print "read_raw_slices(): File %s not found "%filename 
-            currentImage = []
+            return False
 
         try:
-          if currentImage != []:
+          if len( currentImage ) > 0:
             currentImage = currentImage.reshape( ( image_size ) )
             if crop == None:
                 outputVolume[ sliceNumber ] = currentImage
@@ -116,11 +187,38 @@ def read_raw_slices( image_data_format, image_size, base_dir, raw_base_name, dig
                 outputVolume[ sliceNumber ] = currentImage[ crop[1][0]:crop[1][1], crop[0][0]:crop[0][1] ]
         except:
               raise Exception( "read_raw_slices(): Check image dimensions or ROI")
+        return True
 
-    return outputVolume
+    missingSlices = read_slices( read_slice, numberOfSlices, ioThreads )
+
+    return missing_slices_to_nan( outputVolume, missingSlices )
 
     
     
+# TIFF volumes opened by read_tiff_3D, kept open for the whole run
+tiffVolumes = {}
+
+def open_tiff_3D( filename ):
+    """
+    Open a TIFF volume, or return it if it is already open
+    """
+    import tifffile
+
+    if filename not in tiffVolumes:
+        tiffVolumes[ filename ] = tifffile.TiffFile( filename )
+
+    return tiffVolumes[ filename ]
+
+
+def close_tiff_3D():
+    """
+    Close all the TIFF volumes opened by read_tiff_3D
+    """
+    for filename in tiffVolumes.keys():
+        try: tiffVolumes.pop( filename ).close()
+        except: pass
+
+
 def read_tiff_3D( image_data_format, image_size, base_dir, base_name, extension, slices_range, crop  ):
     """
       This reads TIFF volume
@@ -136,14 +234,35 @@ def read_tiff_3D( image_data_format, image_size, base_dir, base_name, extension,
     """    
 
     import numpy
-    import tifffile
 
     filename = "{}/{}{}".format( base_dir, base_name, extension )
-    try: logging.log.debug( "Read_tiff_3D: Loading Full TIFF Volume: %s"%(filename) )
-    except: print "Read_tiff_3D: Loading Full TIFF Volume: %s"%(filename) 
+    try: logging.log.debug( "Read_tiff_3D: Reading slices %i to %i of TIFF Volume: %s"%( slices_range[0], slices_range[1], filename ) )
+    except: print "Read_tiff_3D: Reading slices %i to %i of TIFF Volume: %s"%( slices_range[0], slices_range[1], filename ) 
+
+    # Only the pages of the requested slices are read (memory-mapped if they are not compressed, so that
+    #   only the cropped rows are read), the file and its page index are kept open for the next slabs
+    pages = open_tiff_3D( filename ).series[0].pages
+
+    numberOfSlices = int( slices_range[1] - slices_range[0] + 1 )
+    outputVolume   = None
+    missingSlices  = []
+    for sliceNumber in range( numberOfSlices ):
+        z = sliceNumber + slices_range[0]
+        if z < 0 or z >= len( pages ):
+            # Slices outside the volume are missing (NaN)
+            missingSlices.append( sliceNumber )
+            continue
+
+        currentImage = pages[ z ].asarray( memmap=True )[ crop[0][1]:crop[1][1]+1, crop[0][2]:crop[1][2]+1 ]
+        if outputVolume is None:
+            outputVolume = empty_volume( ( numberOfSlices, ) + currentImage.shape, currentImage.dtype )
+        outputVolume[ sliceNumber ] = currentImage
+        del currentImage
 
-    outputVolume =  tifffile.imread( filename )
-    outputVolume = outputVolume[ slices_range[0]:slices_range[1]+1, crop[0][1]:crop[1][1]+1, crop[0][2]:crop[1][2]+1 ]
+    if outputVolume is None:
+        raise Exception( "Read_tiff_3D: No slice of %i to %i in %s"%( slices_range[0], slices_range[1], filename ) )
+
+    outputVolume = missing_slices_to_nan( outputVolume, missingSlices )
 
     try: logging.log.debug( "Read_tiff_3D: Volume mean value: %f"%( outputVolume.mean() ) )
     except: print  "Read_tiff_3D: Volume mean value: %f"%( outputVolume.mean() ) 
@@ -152,7 +271,7 @@ def read_tiff_3D( image_data_format, image_size, base_dir, base_name, extension,
 
 
   
-def read_tiff_slices( image_data_format, imageDimensions, base_dir, tiff_base_name, digits, extension, slices_range, crop=None ):
+def read_tiff_slices( image_data_format, imageDimensions, base_dir, tiff_base_name, digits, extension, slices_range, crop=None, ioThreads=1 ):
     """
     This reads TIFF slices, and returns a 3D volume
     2015-03-31 EA: This is becoming default tiff reader with tifffile.py from http://www.lfd.uci.edu/~gohlke/
@@ -177,13 +296,13 @@ def read_tiff_slices( image_data_format, imageDimensions, base_dir, tiff_base_na
     # Define array for image loading
     if crop == None:
         # If we don't have a crop, we're going to use the whole slice size.
-        outputVolume = numpy.ones( ( numberOfSlices, imageDimensions[1], imageDimensions[0] ), dtype=image_data_format ) * numpy.nan
+        outputVolume = empty_volume( ( numberOfSlices, imageDimensions[1], imageDimensions[0] ), image_data_format )
     else:
         # Slice dimensions from crop
-        outputVolume = numpy.ones( ( numberOfSlices, crop[1][1] - crop[1][0], crop[0][1] - crop[0][0] ), dtype=image_data_format ) * numpy.nan
+        outputVolume = empty_volume( ( numberOfSlices, crop[1][1] - crop[1][0], crop[0][1] - crop[0][0] ), image_data_format )
 
     # Load all images into big array
-    for sliceNumber in range( numberOfSlices ):
+    def read_slice( sliceNumber ):
           
           try:
               # 2016-04-30 ET: if worrking in 2D digits == 0 and the name in constructed differently
@@ -199,19 +318,25 @@ def read_tiff_slices( image_data_format, imageDimensions, base_dir, tiff_base_na
                   outputVolume[ sliceNumber ] = currentImage.reshape( currentImage.size[1], currentImage.size[0] )
               else:
                   outputVolume[ sliceNumber ] = currentImage[ crop[1][0]:crop[1][1], crop[0][0]:crop[0][1] ]
+              return True
 
           except :
                 #print "\nread_tiff_slices(): Could not read slice "
               try: logging.log.warning( "read_tiff_slices(): File %s not found "%filename )
               except: print "read_tiff_slices(): File %s not found "%filename 
-        
+              return False
+
+    missingSlices = read_slices( read_slice, numberOfSlices, ioThreads )
+
+    outputVolume = missing_slices_to_nan( outputVolume, missingSlices )
+
     try: logging.log.debug( "read_tiff_slices(): Volume mean value = %s"%(outputVolume.mean()) )
     except: print "read_tiff_slices(): Volume mean value = %s"%(outputVolume.mean()) 
     
     return outputVolume
   
   
-def read_tiff_pil_slices( image_data_format, imageDimensions, base_dir, tiff_base_name, digits, extension, slices_range, crop=None ):
+def read_tiff_pil_slices( image_data_format, imageDimensions, base_dir, tiff_base_name, digits, extension, slices_range, crop=None, ioThreads=1 ):
     """
     This reads TIFF slices, and returns a 3D volume
 
@@ -256,13 +381,13 @@ def read_tiff_pil_slices( image_data_format, imageDimensions, base_dir, tiff_bas
     # Define array for image loading
     if crop == None:
         # If we don't have a crop, we're going to use the whole slice size.
-        outputVolume = numpy.ones( ( numberOfSlices, imageDimensions[1], imageDimensions[0] ), dtype=image_data_format ) * numpy.nan
+        outputVolume = empty_volume( ( numberOfSlices, imageDimensions[1], imageDimensions[0] ), image_data_format )
     else:
         # Slice dimensions from crop
-        outputVolume = numpy.ones( ( numberOfSlices, crop[1][1] - crop[1][0], crop[0][1] - crop[0][0] ), dtype=image_data_format ) * numpy.nan
+        outputVolume = empty_volume( ( numberOfSlices, crop[1][1] - crop[1][0], crop[0][1] - crop[0][0] ), image_data_format )
 
     # Load all images into big array
-    for sliceNumber in range( numberOfSlices ):
+    def read_slice( sliceNumber ):
 
         try:
             # 2016-04-30 ET: if worrking in 2D digits == 0 and the name in constructed differently
@@ -278,18 +403,24 @@ def read_tiff_pil_slices( image_data_format, imageDimensions, base_dir, tiff_bas
                 outputVolume[ sliceNumber ] = numpy.array( currentImage.getdata(), dtype=image_data_format ).reshape( currentImage.size[1], currentImage.size[0] )
             else:
                 outputVolume[ sliceNumber ] = numpy.array( currentImage.getdata(), dtype=image_data_format ).reshape( currentImage.size[1], currentImage.size[0] )[ crop[1][0]:crop[1][1], crop[0][0]:crop[0][1] ]
+            return True
 
         except :
             try: logging.log.warning( "read_tiff_slices(): File %s not found "%filename )
             except: print "read_tiff_slices(): File %s not found "%filename 
-    
+            return False
+
+    missingSlices = read_slices( read_slice, numberOfSlices, ioThreads )
+
+    outputVolume = missing_slices_to_nan( outputVolume, missingSlices )
+
     try: logging.log.debug( "read_tiff_pil_slices(): Volume mean value = %s"%( outputVolume.mean() ) )
     except: print "read_tiff_pil_slices(): Volume mean value = %s"%( outputVolume.mean() ) 
         
     return outputVolume
   
   
-def read_edf_slices( imageDimensions, base_dir, edf_base_name, digits, extension, slices_range, crop=None ):
+def read_edf_slices( imageDimensions, base_dir, edf_base_name, digits, extension, slices_range, crop=None, ioThreads=1 ):
     """
     This reads EDF slices, and returns a 3D volume
 
@@ -312,13 +443,13 @@ def read_edf_slices( imageDimensions, base_dir, edf_base_name, digits, extension
     # Define array for image loading
     if crop == None:
         # If we don't have a crop, we're going to use the whole slice size.
-        outputVolume = numpy.ones( ( numberOfSlices, imageDimensions[1], imageDimensions[0] ), dtype='<f4' ) * numpy.nan
+        outputVolume = empty_volume( ( numberOfSlices, imageDimensions[1], imageDimensions[0] ), '<f4' )
     else:
         # Slice dimensions from crop
-        outputVolume = numpy.ones( ( numberOfSlices, crop[1][1] - crop[1][0], crop[0][1] - crop[0][0] ), dtype='<f4' ) * numpy.nan
+        outputVolume = empty_volume( ( numberOfSlices, crop[1][1] - crop[1][0], crop[0][1] - crop[0][0] ), '<f4' )
 
     # Load all images into big array
-    for sliceNumber in range( numberOfSlices ):
+    def read_slice( sliceNumber ):
 
         try:
             # 2016-04-30 ET: if worrking in 2D digits == 0 and the name in constructed differently
@@ -332,11 +463,15 @@ def read_edf_slices( imageDimensions, base_dir, edf_base_name, digits, extension
                 outputVolume[ sliceNumber ] = currentImage
             else:
                 outputVolume[ sliceNumber ] = currentImage[ crop[1][0]:crop[1][1], crop[0][0]:crop[0][1] ]
+            return True
                 
         except :
             try: logging.log.warning( "read_edf_slices(): File %s not found "%filename )
             except: print "read_edf_slices(): File %s not found "%filename 
-            pass
+            return False
+
+    # EDF slices are read as float, the missing ones are already NaN
+    read_slices( read_slice, numberOfSlices, ioThreads )
           
     try: logging.log.debug( "read_edf_pil_slices(): Volume mean value = %s"%( outputVolume.mean() ) )
     except: print "read_edf_pil_slices(): Volume mean value = %s"%( outputVolume.mean() ) 
@@ -345,10 +480,111 @@ def read_edf_slices( imageDimensions, base_dir, edf_base_name, digits, extension
   
   
   
+# TomoWarp2 chunked volume: a directory of 3D blocks plus an index (see tools/chunked_volume.py)
+CHUNKED_INDEX = "index.json"
+
+def chunked_block_name( blockNumber ):
+    return "block_%04i_%04i_%04i.npy"%tuple( blockNumber )
+
+
+# Indexes of the chunked volumes read by read_chunked_extent, kept for the whole run
+chunkedIndexes = {}
+
+def read_chunked_index( directory ):
+    """
+    Read the index of a chunked volume: { "shape": [z,y,x], "chunkShape": [z,y,x], "dtype": "<u2", "firstSlice": 0, ... }
+      (the volumes written before firstSlice was in the index start at slice 0)
+    """
+    import os
+    import json
+
+    if directory not in chunkedIndexes:
+        indexFile = os.path.join( directory, CHUNKED_INDEX )
+        if not os.path.isfile( indexFile ):
+            raise Exception( "read_chunked_index(): %s is not a chunked volume, %s not found"%( directory, CHUNKED_INDEX ) )
+        with open( indexFile ) as f:
+            chunkedIndexes[ directory ] = json.load( f )
+        chunkedIndexes[ directory ].setdefault( "firstSlice", 0 )
+
+    return chunkedIndexes[ directory ]
+
+
+def read_chunked_extent( directory, extent ):
+    """
+    Read any 3D extent [ [ z_top, y_top, x_top ], [ z_bottom, y_bottom, x_bottom ] ] (included)
+      of a chunked volume, only the blocks it covers are opened (memory-mapped, so only the part
+      of each block inside the extent is read). Voxels outside the volume or in missing blocks are NaN
+      z is the slice number of the images the volume was converted from (starting at index[ "firstSlice" ])
+    """
+    import os
+    import numpy
+
+    index      = read_chunked_index( directory )
+    shape      = numpy.array( index[ "shape" ] )
+    chunkShape = numpy.array( index[ "chunkShape" ] )
+    extent     = numpy.array( extent, dtype=int )
+    extent[:,0] -= index[ "firstSlice" ]
+
+    outputVolume = empty_volume( tuple( extent[1] - extent[0] + 1 ), index[ "dtype" ] )
+    read         = numpy.zeros( outputVolume.shape, dtype=bool )
+
+    # Part of the extent inside the volume and blocks covering it
+    top    = numpy.maximum( extent[0], 0 )
+    bottom = numpy.minimum( extent[1], shape - 1 )
+    if ( bottom >= top ).all():
+        firstBlock = top // chunkShape
+        lastBlock  = bottom // chunkShape
+
+        for blockNumber in numpy.ndindex( *( lastBlock - firstBlock + 1 ) ):
+            blockNumber = numpy.array( blockNumber ) + firstBlock
+            blockTop    = blockNumber * chunkShape
+            filename    = os.path.join( directory, chunked_block_name( blockNumber ) )
+            if not os.path.isfile( filename ):
+                try: logging.log.warning( "read_chunked_extent(): Block %s not found "%filename )
+                except: print "read_chunked_extent(): Block %s not found "%filename 
+                continue
+
+            # Intersection of the extent with the block, in the coordinates of the block and of the output
+            fromBlock = numpy.maximum( top, blockTop )
+            toBlock   = numpy.minimum( bottom, blockTop + chunkShape - 1 )
+            inBlock   = tuple( [ slice( a, b + 1 ) for a, b in zip( fromBlock - blockTop, toBlock - blockTop ) ] )
+            inOutput  = tuple( [ slice( a, b + 1 ) for a, b in zip( fromBlock - extent[0], toBlock - extent[0] ) ] )
+
+            block = numpy.load( filename, mmap_mode='r' )
+            outputVolume[ inOutput ] = block[ inBlock ]
+            read[ inOutput ]         = True
+            del block
+
+    if not read.all() and outputVolume.dtype.kind != 'f':
+        outputVolume = outputVolume.astype( '<f4' )
+        outputVolume[ ~read ] = numpy.nan
+
+    return outputVolume
+
+
+def read_chunked_3D( image_data_format, base_dir, base_name, extension, slices_range, crop ):
+    """
+    This reads the slices of a TomoWarp2 chunked volume (see tools/chunked_volume.py)
+
+    INPUTS:
+    - Image format        image format as a format spec, i.e. '<f4'
+    - base_dir            the directory inside which the chunked volume is.
+    - base_name           the "base" name of the chunked volume directory
+    - extension           extension of the chunked volume directory (.twc)
+    - slices_range        tuple or list of number of slices to read
+    - crop                ROI corners [ [ z_min, y_min, x_min ], [ z_max, y_max, x_max ] ]
+    """    
+    directory = "%s/%s%s"%( base_dir, base_name, extension )
+    try: logging.log.debug( "read_chunked_3D: Reading slices %i to %i of: %s"%( slices_range[0], slices_range[1], directory ) )
+    except: print "read_chunked_3D: Reading slices %i to %i of: %s"%( slices_range[0], slices_range[1], directory ) 
+
+    return read_chunked_extent( directory, [ [ slices_range[0], crop[0][1], crop[0][2] ], [ slices_range[1], crop[1][1], crop[1][2] ] ] )
+
+
 def read_su(  ):
     pass
 
-def read_images( image_data_format, image_format, image_size, base_dir, base_name, digits, extension, corners, slices_range ):
+def read_images( image_data_format, image_format, image_size, base_dir, base_name, digits, extension, corners, slices_range, ioThreads=1 ):
         import sys
         
         # 2015-03-31 EA: This is now the tifffile reader
@@ -356,18 +592,22 @@ def read_images( image_data_format, image_format, image_size, base_dir, base_nam
             if len( image_size ) == 3:
                 outputVolume = read_tiff_3D( image_data_format, image_size, base_dir, base_name, extension, slices_range, corners )
             else:
-                outputVolume = read_tiff_slices(     image_data_format, image_size, base_dir, base_name, digits, extension, slices_range, [ [ corners[0][2], corners[1][2] ], [ corners[0][1], corners[1][1] ] ] )
+                outputVolume = read_tiff_slices(     image_data_format, image_size, base_dir, base_name, digits, extension, slices_range, [ [ corners[0][2], corners[1][2] ], [ corners[0][1], corners[1][1] ] ], ioThreads )
                 
         # 2015-03-31 EA: Moving to tiffffile for reading TIFF images, leaving the old option as a type of image called TIFF_PIL
         elif  image_format == "TIFF_PIL":
-            outputVolume = read_tiff_pil_slices( image_data_format, image_size, base_dir, base_name, digits, extension, slices_range, [ [ corners[0][2], corners[1][2] ], [ corners[0][1], corners[1][1] ] ] )
+            outputVolume = read_tiff_pil_slices( image_data_format, image_size, base_dir, base_name, digits, extension, slices_range, [ [ corners[0][2], corners[1][2] ], [ corners[0][1], corners[1][1] ] ], ioThreads )
           
         elif  image_format == "EDF":
-            outputVolume = read_edf_slices( image_size, base_dir, base_name, digits, extension, slices_range, [ [ corners[0][2], corners[1][2] ], [ corners[0][1], corners[1][1] ] ] )
+            outputVolume = read_edf_slices( image_size, base_dir, base_name, digits, extension, slices_range, [ [ corners[0][2], corners[1][2] ], [ corners[0][1], corners[1][1] ] ], ioThreads )
             
+        # TomoWarp2 chunked volume, converted with tools/chunked_volume.py
+        elif image_format == "CHUNKED":
+            outputVolume = read_chunked_3D( image_data_format, base_dir, base_name, extension, slices_range, corners )
+
         elif image_format == "RAW":
             if len( image_size ) == 2:
-                outputVolume =  read_raw_slices( image_data_format, image_size, base_dir, base_name, digits, extension, slices_range, [ [ corners[0][2], corners[1][2] ], [ corners[0][1], corners[1][1] ] ] )
+                outputVolume =  read_raw_slices( image_data_format, image_size, base_dir, base_name, digits, extension, slices_range, [ [ corners[0][2], corners[1][2] ], [ corners[0][1], corners[1][1] ] ], ioThreads )
                   
             elif len( image_size ) == 3:
                 outputVolume = read_raw_3D( image_data_format, image_size, base_dir, base_name, extension, slices_range, corners )
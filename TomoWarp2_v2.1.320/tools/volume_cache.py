@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016, Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+# This file is part of TomoWarp2.
+#
+# TomoWarp2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TomoWarp2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TomoWarp2.  If not, see <http://www.gnu.org/licenses/>.
+
+# ===================================================================
+# ===========================  TomoWarp2  ===========================
+# ===================================================================
+
+# Authors: Erika Tudisco, Edward Andò, Stephen Hall, Rémi Cailletaud
+
+"""
+On-disk cache of the decoded images, used by load_slices when data.volumeCacheDir is set.
+
+Each image is stored, with whole slices and in a single data type ( data.image_data_format, or float
+  32b if it is not given ), in a .npy file of the cache directory that is memory-mapped by the next runs
+  instead of decoding the slices again, and cropped to the ROI when it is read. The file name is a
+  fingerprint of the directory, prefix, format, slice range and of the sizes and modification times of
+  the image files, so that a cache is not used anymore when the images change. The ROI is not in it:
+  the ROI of image 2 grows with correlation_window and search_window, and a run with other windows
+  uses the same cache.
+
+The slices are decoded and added to the cache the first time they are read: a second .npy file keeps
+  for each slice whether it is not read yet (0), read (1) or missing (2, NaN).
+
+When a new cache is created the least recently used ones are deleted to keep the cache directory
+  under data.volumeCacheLimitMB. An image bigger than this limit is not cached.
+"""
+
+import os
+import hashlib
+import numpy
+import logging
+from numpy.lib.format import open_memmap
+
+from read_images import read_images, empty_volume, missing_slices_to_nan
+
+
+# Caches opened in this process: imageNumber -> [ fingerprint, volume, slice state, first slice ]
+openCaches = {}
+
+SLICE_NOT_READ = 0
+SLICE_READ     = 1
+SLICE_MISSING  = 2
+
+
+def image_files( data, imageNumber ):
+    # List of the files of an image: one file per slice, or a single file for a 3D volume or a 2D image
+    directory = data.DIR_image[imageNumber-1]
+    prefix    = data.image_prefix[imageNumber-1]
+    digits    = data.image_digits[imageNumber-1]
+
+    if digits == 0 or len( data.image_size[imageNumber-1] ) == 3:
+        return [ "%s/%s%s"%( directory, prefix, data.image_ext ) ]
+
+    return [ "%s/%s%0*i%s"%( directory, prefix, int(digits), z, data.image_ext ) \
+               for z in range( data.image_slices_extent[imageNumber-1,0], data.image_slices_extent[imageNumber-1,1] + 1 ) ]
+
+
+def volume_fingerprint( data, imageNumber ):
+    # Fingerprint of an image: what is read (files, format, slices) and the size and modification time of each file
+    fingerprint = hashlib.md5()
+    fingerprint.update( repr( [ os.path.abspath( data.DIR_image[imageNumber-1] ), data.image_prefix[imageNumber-1], int( data.image_digits[imageNumber-1] ), \
+                                data.image_ext, data.image_format, data.image_data_format, numpy.array( data.image_size[imageNumber-1] ).tolist(), \
+                                numpy.array( data.image_slices_extent[imageNumber-1] ).tolist() ] ) )
+
+    for filename in image_files( data, imageNumber ):
+        try:
+            fileStat = os.stat( filename )
+            fingerprint.update( "%s %i %r"%( os.path.basename( filename ), fileStat.st_size, fileStat.st_mtime ) )
+        except OSError:
+            fingerprint.update( "%s missing"%( os.path.basename( filename ) ) )
+
+    return fingerprint.hexdigest()
+
+
+def whole_slices( data, imageNumber ):
+    # ROI corners of the whole slices of an image, the ones that are cached
+    return [ [ data.image_slices_extent[imageNumber-1,0], 0, 0 ], \
+             [ data.image_slices_extent[imageNumber-1,1], data.image_size[imageNumber-1][-2] - 1, data.image_size[imageNumber-1][-1] - 1 ] ]
+
+
+def cache_dtype( data ):
+    if data.image_data_format is None: return numpy.dtype( '<f4' )
+    else:                              return numpy.dtype( data.image_data_format )
+
+
+def evict_caches( cacheDir, bytesNeeded, limitBytes, keep=[] ):
+    # Delete the least recently used caches until bytesNeeded fit under limitBytes, returns False if they can not fit.
+    #   The caches in keep (open in this process) are not deleted, but they count in the space used
+    if bytesNeeded > limitBytes:
+        return False
+
+    entries = []
+    for filename in os.listdir( cacheDir ):
+        if filename.endswith( ".volume.npy" ):
+            fingerprint = filename[:-len( ".volume.npy" )]
+            files       = [ os.path.join( cacheDir, fingerprint + ".volume.npy" ), os.path.join( cacheDir, fingerprint + ".slices.npy" ) ]
+            entries.append( [ os.path.getmtime( files[0] ), sum( [ os.path.getsize( f ) for f in files if os.path.exists( f ) ] ), files, fingerprint in keep ] )
+
+    used = sum( [ entry[1] for entry in entries ] )
+    for lastUsed, size, files, kept in sorted( entries ):
+        if used + bytesNeeded <= limitBytes:
+            break
+        if kept:
+            continue
+        for f in files:
+            try: os.remove( f )
+            except OSError: pass
+        used -= size
+        try: logging.log.info( "volume_cache: removed %s (%.1f MB)"%( files[0], size / 1024.0 / 1024.0 ) )
+        except: print "volume_cache: removed %s (%.1f MB)"%( files[0], size / 1024.0 / 1024.0 )
+
+    return used + bytesNeeded <= limitBytes
+
+
+def open_volume_cache( data, imageNumber, sliceShape ):
+    # Open the cache of an image, creating it for slices of sliceShape if there is none. Returns None if it can not be cached
+    if imageNumber in openCaches:
+        return openCaches[ imageNumber ]
+
+    cacheDir    = data.volumeCacheDir
+    fingerprint = volume_fingerprint( data, imageNumber )
+    volumeFile  = os.path.join( cacheDir, fingerprint + ".volume.npy" )
+    slicesFile  = os.path.join( cacheDir, fingerprint + ".slices.npy" )
+    firstSlice  = int( data.image_slices_extent[imageNumber-1,0] )
+    nSlices     = int( data.image_slices_extent[imageNumber-1,1] ) - firstSlice + 1
+
+    if not os.path.isdir( cacheDir ):
+        os.makedirs( cacheDir )
+
+    volume = None
+    if os.path.exists( volumeFile ) and os.path.exists( slicesFile ):
+        try:
+            volume      = open_memmap( volumeFile, mode='r+' )
+            sliceState  = open_memmap( slicesFile, mode='r+' )
+            if volume.shape != ( nSlices, ) + tuple( sliceShape ) or volume.dtype != cache_dtype( data ) or len( sliceState ) != nSlices:
+                volume = None
+            else:
+                # Used now, for the eviction
+                os.utime( volumeFile, None )
+                try: logging.log.info( "volume_cache: image %i read from %s (%i/%i slices)"%( imageNumber, volumeFile, ( sliceState != SLICE_NOT_READ ).sum(), nSlices ) )
+                except: print "volume_cache: image %i read from %s (%i/%i slices)"%( imageNumber, volumeFile, ( sliceState != SLICE_NOT_READ ).sum(), nSlices )
+        except:
+            volume = None
+
+    if volume is None:
+        volumeBytes = nSlices * int( numpy.prod( sliceShape ) ) * cache_dtype( data ).itemsize
+        keep        = [ cache[0] for cache in openCaches.values() if cache is not None ]
+        if not evict_caches( cacheDir, volumeBytes + nSlices, data.volumeCacheLimitMB * 1024 * 1024, keep ):
+            try: logging.log.warning( "volume_cache: image %i (%.1f MB) does not fit in volumeCacheLimitMB, it is not cached"%( imageNumber, volumeBytes / 1024.0 / 1024.0 ) )
+            except: print "volume_cache: image %i (%.1f MB) does not fit in volumeCacheLimitMB, it is not cached"%( imageNumber, volumeBytes / 1024.0 / 1024.0 )
+            openCaches[ imageNumber ] = None
+            return None
+
+        # The slice states are written last, a cache without them is not used
+        for f in [ slicesFile, volumeFile ]:
+            if os.path.exists( f ): os.remove( f )
+        volume     = open_memmap( volumeFile, mode='w+', dtype=cache_dtype( data ), shape=( nSlices, ) + tuple( sliceShape ) )
+        sliceState = open_memmap( slicesFile, mode='w+', dtype='<u1', shape=( nSlices, ) )
+        try: logging.log.info( "volume_cache: image %i cached in %s"%( imageNumber, volumeFile ) )
+        except: print "volume_cache: image %i cached in %s"%( imageNumber, volumeFile )
+
+    openCaches[ imageNumber ] = [ fingerprint, volume, sliceState, firstSlice ]
+    return openCaches[ imageNumber ]
+
+
+def close_volume_caches():
+    # Write the caches opened in this process to disk and close them
+    for imageNumber in openCaches.keys():
+        cache = openCaches.pop( imageNumber )
+        if cache is not None:
+            cache[1].flush()
+            cache[2].flush()
+
+
+def read_images_cached( data, imageNumber, slices_range ):
+    """
+    Same as read_images for the slices of slices_range of image imageNumber, through the cache:
+      the slices that are not in the cache are decoded and added to it.
+      Only the slices of data.image_slices_extent are cached, the ones outside of it are missing (NaN)
+      as in read_raw_3D. The whole slices are cached, and cropped to the ROI here
+    """
+    def read( zRange, corners ):
+        return read_images( data.image_data_format, data.image_format, data.image_size[imageNumber-1], data.DIR_image[imageNumber-1], \
+                 data.image_prefix[imageNumber-1], data.image_digits[imageNumber-1], data.image_ext, corners, zRange, data.ioThreads )
+
+    corners = data.ROI_corners[imageNumber-1]
+    roi     = ( slice( corners[0][1], corners[1][1] + 1 ), slice( corners[0][2], corners[1][2] + 1 ) )
+    cache   = openCaches.get( imageNumber, False )
+
+    if cache is False:
+        # The shape of the whole slices is the one given by the readers
+        images = read( slices_range, whole_slices( data, imageNumber ) )
+        cache  = open_volume_cache( data, imageNumber, images.shape[1:] )
+        if cache is None:
+            return numpy.ascontiguousarray( images[ ( slice( None ), ) + roi ] )
+        zFirst, zLast = cached_range( cache, slices_range )
+        if zLast >= zFirst and ( cache[2][ zFirst - cache[3]:zLast - cache[3] + 1 ] == SLICE_NOT_READ ).any():
+            store_slices( cache, zFirst, images[ zFirst - slices_range[0]:zLast - slices_range[0] + 1 ] )
+
+    elif cache is None:
+        return read( slices_range, corners )
+
+    fingerprint, volume, sliceState, firstSlice = cache
+    numberOfSlices = int( slices_range[1] - slices_range[0] + 1 )
+    zFirst, zLast  = cached_range( cache, slices_range )
+    sliceShape     = volume[ ( 0, ) + roi ].shape
+
+    if zLast < zFirst:
+        # Nothing of this range is in the image
+        return missing_slices_to_nan( empty_volume( ( numberOfSlices, ) + sliceShape, volume.dtype ), range( numberOfSlices ) )
+
+    rows = slice( zFirst - firstSlice, zLast - firstSlice + 1 )
+
+    # Decode the runs of slices that are not in the cache yet
+    notRead = numpy.where( sliceState[ rows ] == SLICE_NOT_READ )[0] + zFirst
+    if len( notRead ) > 0:
+        runStarts = numpy.concatenate( [ [0], numpy.where( numpy.diff( notRead ) > 1 )[0] + 1 ] )
+        runEnds   = numpy.concatenate( [ runStarts[1:], [ len( notRead ) ] ] ) - 1
+        for runStart, runEnd in zip( runStarts, runEnds ):
+            store_slices( cache, notRead[ runStart ], read( [ notRead[ runStart ], notRead[ runEnd ] ], whole_slices( data, imageNumber ) ) )
+
+    missingSlices = list( numpy.where( sliceState[ rows ] == SLICE_MISSING )[0] + zFirst - slices_range[0] )
+
+    if zFirst == slices_range[0] and zLast == slices_range[1]:
+        images = numpy.array( volume[ ( rows, ) + roi ] )
+    else:
+        images = empty_volume( ( numberOfSlices, ) + sliceShape, volume.dtype )
+        images[ zFirst - slices_range[0]:zLast - slices_range[0] + 1 ] = volume[ ( rows, ) + roi ]
+        missingSlices = range( 0, zFirst - slices_range[0] ) + missingSlices + range( zLast - slices_range[0] + 1, numberOfSlices )
+
+    return missing_slices_to_nan( images, missingSlices )
+
+
+def cached_range( cache, slices_range ):
+    # First and last slices of slices_range that are in the cache (last < first if there are none)
+    firstSlice = cache[3]
+    lastSlice  = firstSlice + len( cache[2] ) - 1
+    return max( slices_range[0], firstSlice ), min( slices_range[1], lastSlice )
+
+
+def store_slices( cache, zTop, images ):
+    # Copy the decoded slices from zTop in the cache, the slices that could not be read (all NaN) are marked missing
+    fingerprint, volume, sliceState, firstSlice = cache
+    rows = slice( zTop - firstSlice, zTop - firstSlice + len( images ) )
+
+    if images.dtype.kind == 'f':
+        missing = numpy.isnan( images.reshape( len( images ), -1 ) ).all( axis=1 )
+    else:
+        missing = numpy.zeros( len( images ), dtype=bool )
+
+    if volume.dtype.kind == 'f':
+        volume[ rows ] = images
+    else:
+        volume[ rows ][ ~missing ] = images[ ~missing ]
+
+    sliceState[ rows ] = numpy.where( missing, SLICE_MISSING, SLICE_READ )